@@ -14,10 +14,14 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = Config.SQLALCHEMY_DATABASE_URI
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False 
 app.config['SECRET_KEY'] = Config.SECRET_KEY
+app.config['POSTING_CHUNK_SIZE'] = Config.POSTING_CHUNK_SIZE
+app.config['INSTRUMENTATION_ENABLED'] = Config.INSTRUMENTATION_ENABLED
 
 
 db = SQLAlchemy(app, model_class=Base)
 
 migrate = Migrate(app, db)
 
-from application import routes, models
\ No newline at end of file
+from application import routes, models, commands, instrumentation
+
+instrumentation.init_app(app)
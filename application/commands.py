@@ -0,0 +1,350 @@
+# application/commands.py
+# Консольні команди обслуговування (flask <команда>)
+import json
+import time
+from datetime import datetime
+
+import click
+
+from application import app, db
+from application.services.services import DocumentPostingService
+from application.services.ParallelPostingService import ParallelPostingService
+from application.services.SnapshotService import SnapshotService
+from application.services.SalesRollupService import SalesRollupService
+from application.services.ReportJobService import ReportJobService
+from application.services.ReportCache import record_posting_events
+from application.services.ReconciliationService import ReconciliationService, DISCREPANCY_COLUMNS
+from application.services.ExportService import csv_chunks
+
+
+@app.cli.group()
+def fifo():
+    """Обслуговування партій FIFO."""
+
+
+@fifo.command('rebuild-layers')
+@click.option('--nomenclature', 'nomenclature_ids', multiple=True,
+              help='ID номенклатури (можна кілька). Без параметра - усі товари.')
+def rebuild_layers(nomenclature_ids):
+    """Перебудовує партії FIFO з історії проведених документів і звіряє собівартість списань."""
+    posting_service = DocumentPostingService(db.session)
+    changed = posting_service.rebuild_layers(list(nomenclature_ids) or None)
+    posting_service.inventory_manager.apply_deltas()
+    posting_service.commit_changes()
+    click.echo(f'Партії FIFO перебудовано, собівартість змінено в {changed} рядках.')
+
+
+@fifo.command('recost')
+@click.option('--nomenclature', 'nomenclature_ids', multiple=True, required=True,
+              help='ID номенклатури (можна кілька).')
+@click.option('--from', 'date_from', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Перерахувати списання, починаючи з цієї дати. Без параметра - всю історію.')
+def recost(nomenclature_ids, date_from):
+    """Перераховує собівартість списань (FIFO), залишки та знімки після зміни історії."""
+    posting_service = DocumentPostingService(db.session)
+    posting_service.inventory_manager.preload(list(nomenclature_ids), for_update=True)
+    changed = posting_service.recost(list(nomenclature_ids), (date_from or datetime(1970, 1, 1), ''))
+    posting_service.inventory_manager.apply_deltas()
+    posting_service.commit_changes()
+    click.echo(f'Собівартість змінено в {changed} рядках.')
+
+
+@app.cli.group()
+def inventory():
+    """Залишки товарів."""
+
+
+@inventory.command('reconcile')
+@click.option('--nomenclature', 'nomenclature_ids', multiple=True,
+              help='ID номенклатури (можна кілька). Без параметра - усі товари.')
+@click.option('--workers', type=click.IntRange(1), default=4, help='Процесів звірки.')
+@click.option('--shard-size', type=click.IntRange(1), default=500, help='Товарів в одному шарді.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Записати розбіжності в CSV.')
+@click.option('--repair', is_flag=True, help='Виправити залишки за історією документів.')
+def reconcile_inventory(nomenclature_ids, workers, shard_size, output, repair):
+    """Звіряє залишки з проведеними документами (кількість і вартість FIFO)."""
+    service = ReconciliationService(workers=workers, shard_size=shard_size)
+    started = time.perf_counter()
+    discrepancies = service.find_discrepancies(list(nomenclature_ids) or None)
+    elapsed = time.perf_counter() - started
+
+    for d in discrepancies:
+        click.echo(
+            f'{d.nomenclature_id} ({d.nomenclature_name}) рахунок {d.account or "-"}: '
+            f'к-ть {d.stored_quantity} -> {d.ledger_quantity}, вартість {d.stored_amount} -> {d.ledger_amount}'
+            + (f', собівартість рядків {d.recorded_amount}' if d.recorded_amount != d.ledger_amount else '')
+            + ('' if d.layers_match else ', партії FIFO не збігаються')
+        )
+    if output:
+        with open(output, 'wb') as f:
+            for chunk in csv_chunks(DISCREPANCY_COLUMNS, discrepancies):
+                f.write(chunk)
+    click.echo(f'Розбіжностей: {len(discrepancies)} (звірка {elapsed:.1f} с).')
+
+    if discrepancies and repair:
+        repaired = service.repair(discrepancies)
+        click.echo(f'Виправлено розбіжностей: {repaired}.')
+    elif discrepancies:
+        # Ненульовий код виходу - для запуску за розкладом
+        raise SystemExit(1)
+
+
+@app.cli.group()
+def documents():
+    """Операції з документами."""
+
+
+@documents.command('post')
+@click.option('--from', 'date_from', type=click.DateTime(formats=['%Y-%m-%d']), help='Дата початку (включно).')
+@click.option('--to', 'date_to', type=click.DateTime(formats=['%Y-%m-%d']), help='Дата кінця (включно).')
+@click.option('--id', 'doc_ids', multiple=True, help='ID документа (можна кілька).')
+@click.option('--chunk-size', type=int, default=None, help='Документів на одну транзакцію.')
+@click.option('--workers', type=click.IntRange(1), default=1,
+              help='Потоків проведення: документи без спільної номенклатури проводяться паралельно.')
+def post_documents(date_from, date_to, doc_ids, chunk_size, workers):
+    """Пакетне проведення документів у хронологічному порядку."""
+    if not doc_ids and date_from is None and date_to is None:
+        raise click.UsageError('Вкажіть --id або діапазон дат --from/--to.')
+
+    params = dict(
+        doc_ids=list(doc_ids) or None,
+        date_from=date_from,
+        date_to=datetime.combine(date_to.date(), datetime.max.time()) if date_to else None,
+    )
+    chunk_size = chunk_size or app.config['POSTING_CHUNK_SIZE']
+    if workers > 1:
+        results = ParallelPostingService(app, workers=workers, chunk_size=chunk_size).post_documents(**params)
+    else:
+        results = DocumentPostingService(db.session).post_documents(chunk_size=chunk_size, **params)
+
+    failed = [r for r in results if r['status'] == 'error']
+    for r in failed:
+        click.echo(f"{r['document_id']}: {r['error']}", err=True)
+    click.echo(f'Проведено: {len(results) - len(failed)}, з помилками: {len(failed)}.')
+
+
+@documents.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']),
+              help='Формат файлу. За замовчуванням - за розширенням (.csv або NDJSON).')
+@click.option('--batch-size', type=int, default=None, help='Документів на одну порцію запису.')
+def import_documents(path, fmt, batch_size):
+    """Масовий імпорт документів з NDJSON або CSV."""
+    from application.services.DocumentImportService import DocumentImportService
+
+    fmt = fmt or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        report = DocumentImportService(db.session, batch_size=batch_size).import_stream(f, fmt)
+
+    for error in report['errors']:
+        click.echo(f"рядок {error['line']} ({error['ref'] or '-'}): {error['error']}", err=True)
+    click.echo(f"Імпортовано: {report['imported']}, з помилками: {report['failed']}.")
+
+
+@app.cli.group()
+def snapshots():
+    """Знімки залишків на кінець періоду."""
+
+
+@snapshots.command('create')
+@click.option('--period-end', type=click.DateTime(formats=['%Y-%m-%d']), required=True,
+              help='Останній день періоду.')
+def create_snapshot(period_end):
+    """Створює (або перераховує) знімок залишків на кінець дня."""
+    count = SnapshotService(db.session).create_snapshot(period_end.date())
+    db.session.commit()
+    click.echo(f'Знімок на {period_end.date()}: {count} рядків.')
+
+
+@snapshots.command('close-months')
+@click.option('--until', type=click.DateTime(formats=['%Y-%m-%d']), required=True,
+              help='Створювати знімки місяців, що закінчились до цієї дати включно.')
+def close_months(until):
+    """Створює відсутні щомісячні знімки залишків."""
+    created = SnapshotService(db.session).close_months(until.date())
+    db.session.commit()
+    click.echo(f'Створено знімків: {len(created)}.')
+
+
+@app.cli.group()
+def rollups():
+    """Підсумкові таблиці для звітів."""
+
+
+@rollups.command('rebuild-sales')
+@click.option('--from', 'date_from', type=click.DateTime(formats=['%Y-%m-%d']), help='Дата початку (включно).')
+@click.option('--to', 'date_to', type=click.DateTime(formats=['%Y-%m-%d']), help='Дата кінця (включно).')
+def rebuild_sales(date_from, date_to):
+    """Перераховує денний підсумок продажів з проведених документів."""
+    date_from, date_to = (date_from.date() if date_from else None), (date_to.date() if date_to else None)
+    count = SalesRollupService(db.session).rebuild(date_from, date_to)
+    # Зведені звіти за цей період могли змінитися
+    record_posting_events(db.session, [(date_from, date_to)])
+    db.session.commit()
+    click.echo(f'Підсумок продажів перераховано: {count} рядків.')
+
+
+@app.cli.group()
+def reports():
+    """Черга звітів."""
+
+
+@reports.command('worker')
+@click.option('--poll-interval', type=float, default=1.0, help='Пауза (сек.), коли черга порожня.')
+@click.option('--once', is_flag=True, help='Виконати всі завдання з черги і завершитись.')
+def reports_worker(poll_interval, once):
+    """Виконує завдання з черги звітів (можна запускати кілька воркерів)."""
+    job_service = ReportJobService(db.session)
+    click.echo('Воркер звітів запущено.')
+    try:
+        while True:
+            job = job_service.run_next()
+            if job is not None:
+                click.echo(f'{job.job_id} {job.report_type}: {job.status}')
+                continue
+            # Черга порожня: прибирання і пауза
+            job_service.requeue_stale()
+            job_service.purge_expired()
+            if once:
+                break
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        db.session.rollback()
+    click.echo('Воркер звітів зупинено.')
+
+
+@reports.command('purge')
+def reports_purge():
+    """Видаляє завершені завдання, старші за термін зберігання."""
+    deleted = ReportJobService(db.session).purge_expired()
+    click.echo(f'Видалено завдань: {deleted}.')
+
+
+@app.cli.group()
+def testdata():
+    """Синтетичні дані для навантажувального тестування (запускати на окремій базі)."""
+
+
+@testdata.command('generate')
+@click.option('--documents', type=int, default=10000, help='Скільки документів згенерувати.')
+@click.option('--items', type=int, default=500, help='Кількість номенклатури.')
+@click.option('--counterparties', type=int, default=50, help='Кількість контрагентів.')
+@click.option('--max-lines', type=int, default=5, help='Максимум рядків у документі.')
+@click.option('--incoming-ratio', type=click.FloatRange(0, 1), default=0.45, help='Частка прибуткових накладних.')
+@click.option('--other-ratio', type=click.FloatRange(0, 1), default=0.0,
+              help='Частка документів, що не проводяться (замовлення, рахунки).')
+@click.option('--from', 'date_from', type=click.DateTime(formats=['%Y-%m-%d']), help='Дата першого документа.')
+@click.option('--to', 'date_to', type=click.DateTime(formats=['%Y-%m-%d']), help='Дата останнього документа.')
+@click.option('--seed', type=int, default=42, help='Seed генератора.')
+@click.option('--batch-size', type=int, default=5000, help='Документів на одну порцію запису.')
+@click.option('--no-copy', is_flag=True, help='Писати multi-row INSERT замість COPY.')
+@click.option('--post', is_flag=True, help='Провести згенеровані документи в хронологічному порядку.')
+def testdata_generate(documents, items, counterparties, max_lines, incoming_ratio, other_ratio,
+                      date_from, date_to, seed, batch_size, no_copy, post):
+    """Генерує детерміновані документи з рядками (лише в порожню базу)."""
+    from application.test import test_data_generator
+
+    try:
+        stats = test_data_generator.generate(
+            documents=documents, items=items, counterparties=counterparties, max_lines=max_lines,
+            incoming_ratio=incoming_ratio, other_ratio=other_ratio,
+            date_from=date_from.date() if date_from else None,
+            date_to=date_to.date() if date_to else None,
+            seed=seed, batch_size=batch_size, use_copy=not no_copy,
+            post=post, chunk_size=app.config['POSTING_CHUNK_SIZE'],
+        )
+    except (RuntimeError, ValueError) as e:
+        raise click.ClickException(str(e))
+
+    click.echo(f"Документів: {stats['documents']}, рядків: {stats['lines']}.")
+    if post:
+        click.echo(f"Проведено: {stats['posted']}, з помилками: {stats['errors']}.")
+
+
+@app.cli.group()
+def bench():
+    """Бенчмарки продуктивності (запускати на окремій базі)."""
+
+
+@bench.command('explain')
+@click.option('--documents', type=int, default=20000, help='Скільки документів згенерувати.')
+@click.option('--seed', type=int, default=42, help='Seed генератора.')
+@click.option('--no-seed', is_flag=True, help='Не генерувати дані, використати наявні.')
+@click.option('--output', type=click.Path(dir_okay=False), default='explain.json', help='Куди записати результат.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Попередній результат для порівняння.')
+def bench_explain(documents, seed, no_seed, output, baseline):
+    """EXPLAIN ANALYZE для запитів проведення та звітів."""
+    from application.test import explain_benchmark
+
+    results = explain_benchmark.run(documents=documents, seed=seed, skip_seed=no_seed)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    for name, plans in results.items():
+        slowest = max((plan['execution_ms'] for plan in plans), default=0)
+        click.echo(f'{name}: {len(plans)} запитів, найповільніший {slowest} ms')
+
+    if baseline:
+        with open(baseline, encoding='utf-8') as f:
+            regressions = explain_benchmark.compare(results, json.load(f))
+        for line in regressions:
+            click.echo(f'РЕГРЕСІЯ {line}', err=True)
+        if regressions:
+            raise SystemExit(1)
+
+
+@bench.command('run')
+@click.option('--documents', type=int, default=20000, help='Скільки документів згенерувати.')
+@click.option('--seed', type=int, default=42, help='Seed генератора.')
+@click.option('--repeat', type=int, default=50, help='Повторів кожного сценарію.')
+@click.option('--no-seed', is_flag=True, help='Не генерувати дані, використати наявні.')
+@click.option('--output', type=click.Path(dir_okay=False), default='bench.json', help='Куди записати результат.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Попередній результат для порівняння.')
+def bench_run(documents, seed, repeat, no_seed, output, baseline):
+    """Час, кількість запитів та пам'ять для проведення, FIFO, звітів і API."""
+    from application.test import benchmarks
+
+    results = benchmarks.run(documents=documents, seed=seed, repeat=repeat, skip_seed=no_seed)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    for name, stats in results['scenarios'].items():
+        click.echo(
+            f"{name}: p50 {stats['p50_ms']} ms, p95 {stats['p95_ms']} ms, p99 {stats['p99_ms']} ms, "
+            f"запитів {stats['queries']}, БД p50 {stats['db_ms_p50']} ms, пам'ять {stats['peak_kib']} KiB"
+        )
+
+    if baseline:
+        with open(baseline, encoding='utf-8') as f:
+            regressions = benchmarks.compare(results, json.load(f))
+        for line in regressions:
+            click.echo(f'РЕГРЕСІЯ {line}', err=True)
+        if regressions:
+            raise SystemExit(1)
+
+
+@bench.command('queries')
+@click.option('--seed-data', is_flag=True, help='Згенерувати невеликий набір даних, якщо база порожня.')
+def bench_queries(seed_data):
+    """Перевіряє бюджет SQL-запитів сторінок і сервісів (N+1)."""
+    from application.test import query_budget
+
+    try:
+        results = query_budget.run(seed_data=seed_data)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+    failed = 0
+    for result in results:
+        status = 'FAIL' if result['errors'] else 'OK'
+        failed += bool(result['errors'])
+        target = f" [{result['document_id']}]" if result['document_id'] else ''
+        click.echo(
+            f"{status} {result['check']}{target}: запитів {result['queries']}/{result['max_queries']}, "
+            f"під час рендерингу {result['render_queries']}/{result['max_render_queries']}"
+        )
+        for error in result['errors']:
+            click.echo(f'    {error}', err=True)
+
+    if failed:
+        raise SystemExit(1)
@@ -49,8 +49,23 @@ class ReportForm(FlaskForm):
     report_type = SelectField('Тип звіту', choices=[
         ('sales', 'Звіт про продажі'),
         ('inventory_date', 'Залишки на дату'),
+        ('inventory_series', 'Динаміка залишків'),
 
     ])
+    # Для звіту про продажі: зведені режими читають денний підсумок (SalesDaily)
+    group_by = SelectField('Групування', choices=[
+        ('lines', 'Детально (рядки)'),
+        ('day', 'По днях'),
+        ('counterparty', 'По контрагентах'),
+        ('nomenclature', 'По товарах'),
+    ], default='lines')
+    # Для динаміки залишків: крок сітки дат і необов'язковий фільтр по товару
+    step = SelectField('Крок', choices=[
+        ('day', 'День'),
+        ('week', 'Тиждень'),
+        ('month', 'Місяць'),
+    ], default='day')
+    nomenclature_id = HiddenField('Товар')
 
 
         
@@ -0,0 +1,225 @@
+# application/instrumentation.py
+"""
+Вимірювання запитів: час відповіді, кількість SQL-запитів, час у БД
+та найповільніший запит. Вмикається INSTRUMENTATION_ENABLED у config.py.
+
+Для кожного запиту додається заголовок Server-Timing (видно в DevTools браузера),
+агреговані гістограми по endpoint доступні на GET /_stats (DELETE /_stats - скинути).
+Для потокових відповідей статистика враховує і генерацію тіла.
+record_queries() можна використовувати і поза HTTP (бенчмарки, CLI).
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Верхні межі кошиків гістограми, мс (останній - все, що повільніше)
+HISTOGRAM_BOUNDS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+SLOW_STATEMENT_LENGTH = 500
+
+_current_recorder = ContextVar('query_recorder', default=None)
+
+
+class QueryRecorder:
+    """Статистика SQL-запитів одного блоку коду (вкладені блоки враховуються і в зовнішньому)."""
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.count = 0
+        self.db_ms = 0.0
+        self.slowest_ms = 0.0
+        self.slowest_statement = None
+
+    def add(self, statement, elapsed_ms):
+        self.count += 1
+        self.db_ms += elapsed_ms
+        if elapsed_ms > self.slowest_ms:
+            self.slowest_ms = elapsed_ms
+            self.slowest_statement = statement
+        if self.parent is not None:
+            self.parent.add(statement, elapsed_ms)
+
+
+@contextmanager
+def record_queries():
+    """Рахує SQL-запити, виконані в блоці (у поточному потоці/контексті)."""
+    recorder = QueryRecorder(parent=_current_recorder.get())
+    token = _current_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current_recorder.reset(token)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_recorder.get() is not None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    recorder = _current_recorder.get()
+    started = conn.info.get('query_started')
+    if recorder is not None and started:
+        recorder.add(statement, (time.perf_counter() - started.pop()) * 1000)
+
+
+class EndpointStats:
+    """Агрегати по endpoint: гістограма часу, запити, час у БД, найповільніший SQL."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def add(self, endpoint, wall_ms, recorder):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = {
+                    'count': 0,
+                    'wall_ms_total': 0.0,
+                    'wall_ms_max': 0.0,
+                    'histogram': [0] * len(HISTOGRAM_BOUNDS_MS),
+                    'queries_total': 0,
+                    'queries_max': 0,
+                    'db_ms_total': 0.0,
+                    'slowest_statement_ms': 0.0,
+                    'slowest_statement': None,
+                }
+            stats['count'] += 1
+            stats['wall_ms_total'] += wall_ms
+            stats['wall_ms_max'] = max(stats['wall_ms_max'], wall_ms)
+            stats['histogram'][_bucket(wall_ms)] += 1
+            stats['queries_total'] += recorder.count
+            stats['queries_max'] = max(stats['queries_max'], recorder.count)
+            stats['db_ms_total'] += recorder.db_ms
+            if recorder.slowest_ms > stats['slowest_statement_ms']:
+                stats['slowest_statement_ms'] = recorder.slowest_ms
+                stats['slowest_statement'] = ' '.join(recorder.slowest_statement.split())[:SLOW_STATEMENT_LENGTH]
+
+    def snapshot(self):
+        """Знімок для /_stats: середні значення та оцінка перцентилів з гістограми."""
+        with self._lock:
+            result = {}
+            for endpoint, stats in sorted(self._endpoints.items()):
+                count = stats['count']
+                result[endpoint] = {
+                    'count': count,
+                    'wall_ms_avg': round(stats['wall_ms_total'] / count, 3),
+                    'wall_ms_max': round(stats['wall_ms_max'], 3),
+                    'wall_ms_p50_le': _histogram_percentile(stats['histogram'], count, 50),
+                    'wall_ms_p95_le': _histogram_percentile(stats['histogram'], count, 95),
+                    'histogram': [
+                        {'le_ms': _bucket_label(bound), 'count': n}
+                        for bound, n in zip(HISTOGRAM_BOUNDS_MS, stats['histogram'])
+                    ],
+                    'queries_avg': round(stats['queries_total'] / count, 2),
+                    'queries_max': stats['queries_max'],
+                    'db_ms_avg': round(stats['db_ms_total'] / count, 3),
+                    'slowest_statement_ms': round(stats['slowest_statement_ms'], 3),
+                    'slowest_statement': stats['slowest_statement'],
+                }
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+def _bucket(value_ms):
+    for index, bound in enumerate(HISTOGRAM_BOUNDS_MS):
+        if value_ms <= bound:
+            return index
+    return len(HISTOGRAM_BOUNDS_MS) - 1
+
+
+def _bucket_label(bound):
+    return bound if bound != float('inf') else 'inf'
+
+
+def _histogram_percentile(histogram, count, q):
+    """Верхня межа кошика, в який потрапляє q-й перцентиль (None - повільніше за всі межі)."""
+    threshold = q / 100 * count
+    seen = 0
+    for bound, n in zip(HISTOGRAM_BOUNDS_MS, histogram):
+        seen += n
+        if seen >= threshold:
+            return bound if bound != float('inf') else None
+    return None
+
+
+endpoint_stats = EndpointStats()
+
+
+def _record_stream(chunks, recorder, started, endpoint):
+    """
+    Потокове тіло (stream_with_context): запити, виконані під час генерації частин,
+    додаються до recorder запиту, статистика endpoint записується після останньої частини.
+    """
+    iterator = iter(chunks)
+    try:
+        while True:
+            token = _current_recorder.set(recorder)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _current_recorder.reset(token)
+            yield chunk
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+        endpoint_stats.add(endpoint, (time.perf_counter() - started) * 1000, recorder)
+
+
+def init_app(app):
+    """Підключає вимірювання до застосунку, якщо INSTRUMENTATION_ENABLED."""
+    if not app.config.get('INSTRUMENTATION_ENABLED'):
+        return
+
+    @app.before_request
+    def _start_request_timing():
+        g.request_started = time.perf_counter()
+        g.query_recorder = QueryRecorder(parent=_current_recorder.get())
+        g.query_recorder_token = _current_recorder.set(g.query_recorder)
+
+    @app.after_request
+    def _finish_request_timing(response):
+        started = g.pop('request_started', None)
+        recorder = g.get('query_recorder')
+        if started is None or recorder is None:
+            return response
+
+        wall_ms = (time.perf_counter() - started) * 1000
+        endpoint = request.endpoint or '<404>'
+        if response.is_streamed:
+            # Тіло генерується вже після запиту: статистика - коли воно віддане повністю
+            response.response = _record_stream(response.response, recorder, started, endpoint)
+        elif endpoint != 'instrumentation_stats':
+            endpoint_stats.add(endpoint, wall_ms, recorder)
+        # Для потокової відповіді заголовок показує лише роботу до початку тіла
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={recorder.db_ms:.1f};desc="{recorder.count} queries", '
+            f'app;dur={wall_ms - recorder.db_ms:.1f}, total;dur={wall_ms:.1f}'
+        )
+        return response
+
+    @app.teardown_request
+    def _stop_query_recording(exc):
+        token = g.pop('query_recorder_token', None)
+        if token is not None:
+            _current_recorder.reset(token)
+
+    @app.route('/_stats', methods=['GET', 'DELETE'], endpoint='instrumentation_stats')
+    def instrumentation_stats():
+        if request.method == 'DELETE':
+            endpoint_stats.reset()
+        return jsonify(endpoint_stats.snapshot())
@@ -1,4 +1,5 @@
-from sqlalchemy import String, Integer, Date, ForeignKey, DateTime, Numeric, Boolean
+from sqlalchemy import String, Integer, BigInteger, Date, ForeignKey, DateTime, Numeric, Boolean, DDL, Sequence, event, func
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship, Mapped, mapped_column 
 
 from typing import List, Optional 
@@ -7,6 +8,12 @@ from datetime import date, datetime
 from application import db 
 
 
+# Спільна послідовність змін документів і залишків (курсор /api/.../changes).
+# Значення видаються безпосередньо перед commit під блокуванням (ChangeFeed.lock_change_seq),
+# тому зростають у порядку фіксації транзакцій
+change_sequence = Sequence('change_seq', metadata=db.metadata)
+
+
 class Counterparty(db.Model):
     __tablename__ = 'counterparty'
     
@@ -43,11 +50,30 @@ class Document(db.Model):
     
     is_posted: Mapped[bool] = mapped_column(Boolean, default=False)
 
+    # Версія документа (ETag сторінок): збільшується при кожній зміні документа або його рядків
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=1, server_default='1')
+    # Номер останньої зміни (для синхронізації клієнтів) та її час
+    change_seq: Mapped[int] = mapped_column(BigInteger, nullable=False, server_default=change_sequence.next_value())
+    last_updated: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True,
+                                                             default=datetime.now, onupdate=datetime.now)
+
     counterparty: Mapped["Counterparty"] = relationship(back_populates="documents")
     
 
     lines: Mapped[List["DocumentLine"]] = relationship(back_populates="document", lazy=True)
 
+    __table_args__ = (
+        # Журнал документів: сортування та keyset-пагінація
+        db.Index('ix_documents_date_id', 'document_date', 'documents_id'),
+        # Звіти та FIFO читають лише проведені документи
+        db.Index('ix_documents_posted_type_date', 'operation_type', 'document_date',
+                 postgresql_where=db.text('is_posted')),
+        db.Index('ix_documents_posted_date', 'document_date', postgresql_where=db.text('is_posted')),
+        db.Index('ix_documents_counterparty_id', 'counterparty_id'),
+        # /api/documents/changes: рядки після курсора
+        db.Index('ix_documents_change_seq', 'change_seq'),
+    )
+
     def __repr__(self):
         return f'<Document {self.documents_id} ({self.document_date})>'
 
@@ -65,6 +91,21 @@ class Nomenclature(db.Model):
 
     def __repr__(self):
         return f'<Nomenclature {self.nomenclature_name}>'
+
+
+# Пошук номенклатури (/api/nomenclature/search): префікс та підрядок
+db.Index(
+    'ix_nomenclature_name_lower_prefix',
+    func.lower(Nomenclature.nomenclature_name).label('name_lower'),
+    postgresql_ops={'name_lower': 'text_pattern_ops'}
+)
+db.Index(
+    'ix_nomenclature_name_trgm',
+    Nomenclature.nomenclature_name,
+    postgresql_using='gin',
+    postgresql_ops={'nomenclature_name': 'gin_trgm_ops'}
+)
+event.listen(db.metadata, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
     
 
     
@@ -98,6 +139,12 @@ class DocumentLine(db.Model):
     document: Mapped["Document"] = relationship(back_populates="lines")
     nomenclature: Mapped["Nomenclature"] = relationship(back_populates="document_lines")
 
+    __table_args__ = (
+        # selectinload(Document.lines) та з'єднання з documents
+        db.Index('ix_document_lines_document_id', 'document_id'),
+        # Історія руху товару (FIFO, звіти по товару)
+        db.Index('ix_document_lines_nomenclature_document', 'nomenclature_id', 'document_id'),
+    )
 
     def __repr__(self):
         return f'<DocumentLine {self.product_item_id}>'
@@ -124,15 +171,230 @@ class InventoryBalance(db.Model):
 
     # Поле для відстеження останнього оновлення 
     last_updated: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.now, onupdate=datetime.now)
+    # Номер останньої зміни: задається явно в upsert залишків (InventoryManager.apply_deltas)
+    change_seq: Mapped[int] = mapped_column(BigInteger, nullable=False, server_default=change_sequence.next_value())
 
  
     nomenclature: Mapped["Nomenclature"] = relationship(lazy="joined")
 
-    # Унікальний індекс: один товар на одному рахунку не може мати два рядки залишків
+    # Унікальний індекс: один товар на одному рахунку не може мати два рядки залишків.
+    # NULLS NOT DISTINCT: рядок без рахунку теж один (потрібно для ON CONFLICT)
     __table_args__ = (
-        db.UniqueConstraint('nomenclature_id', 'account', name='uix_nomenclature_account'),
+        db.UniqueConstraint('nomenclature_id', 'account', name='uix_nomenclature_account',
+                            postgresql_nulls_not_distinct=True),
+        # /api/inventory/changes: рядки після курсора
+        db.Index('ix_inventory_balances_change_seq', 'change_seq'),
     )
 
     def __repr__(self):
         return f'<Balance {self.nomenclature.nomenclature_name}: {self.quantity}>'
 
+
+
+
+class CostLayer(db.Model):
+    """Партія FIFO: рядок приходу та його ще не списаний залишок."""
+    __tablename__ = 'cost_layers'
+
+    layer_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+
+    nomenclature_id: Mapped[str] = mapped_column(
+        ForeignKey(Nomenclature.nomenclature_id, onupdate='CASCADE', ondelete='RESTRICT'),
+        nullable=False
+    )
+    # Рядок приходу, з якого утворилась партія (одна партія на рядок)
+    line_id: Mapped[str] = mapped_column(
+        ForeignKey(DocumentLine.product_item_id, onupdate='CASCADE', ondelete='RESTRICT'),
+        nullable=False, unique=True
+    )
+    document_id: Mapped[str] = mapped_column(
+        ForeignKey(Document.documents_id, onupdate='CASCADE', ondelete='RESTRICT'),
+        nullable=False
+    )
+
+    # Порядок черги FIFO: (layer_date, document_id, layer_id)
+    layer_date: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    quantity: Mapped[float] = mapped_column(Numeric(12, 3), nullable=False)
+    remaining_quantity: Mapped[float] = mapped_column(Numeric(12, 3), nullable=False)
+    # Вартість всієї партії (ціна одиниці = total_amount / quantity)
+    total_amount: Mapped[float] = mapped_column(Numeric(12, 2), nullable=False)
+
+    # Списання читає лише відкриті партії, тому індекс частковий
+    __table_args__ = (
+        db.Index(
+            'ix_cost_layers_open',
+            'nomenclature_id', 'layer_date', 'document_id', 'layer_id',
+            postgresql_where=db.text('remaining_quantity > 0')
+        ),
+    )
+
+    def __repr__(self):
+        return f'<CostLayer {self.layer_id}: {self.remaining_quantity}/{self.quantity}>'
+
+
+
+class CostLayerConsumption(db.Model):
+    """Скільки рядок списання забрав з конкретної партії і за якою вартістю."""
+    __tablename__ = 'cost_layer_consumptions'
+
+    consumption_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+
+    layer_id: Mapped[int] = mapped_column(
+        ForeignKey(CostLayer.layer_id, ondelete='CASCADE'),
+        nullable=False, index=True
+    )
+    # Рядок видаткового документа
+    line_id: Mapped[str] = mapped_column(
+        ForeignKey(DocumentLine.product_item_id, onupdate='CASCADE', ondelete='RESTRICT'),
+        nullable=False, index=True
+    )
+
+    quantity: Mapped[float] = mapped_column(Numeric(12, 3), nullable=False)
+    cost: Mapped[float] = mapped_column(Numeric(18, 6), nullable=False)
+
+    layer: Mapped["CostLayer"] = relationship()
+
+    def __repr__(self):
+        return f'<CostLayerConsumption {self.line_id} <- {self.layer_id}: {self.quantity}>'
+
+
+
+class InventorySnapshotPeriod(db.Model):
+    """Закритий період: для нього збережено залишки на кінець дня period_end."""
+    __tablename__ = 'inventory_snapshot_periods'
+
+    period_end: Mapped[date] = mapped_column(Date, primary_key=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.now)
+
+    def __repr__(self):
+        return f'<SnapshotPeriod {self.period_end}>'
+
+
+
+class InventorySnapshot(db.Model):
+    """Залишок (кількість і вартість) товару на рахунку на кінець періоду."""
+    __tablename__ = 'inventory_snapshots'
+
+    snapshot_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+
+    period_end: Mapped[date] = mapped_column(
+        ForeignKey(InventorySnapshotPeriod.period_end, ondelete='CASCADE'),
+        nullable=False
+    )
+    nomenclature_id: Mapped[str] = mapped_column(
+        ForeignKey(Nomenclature.nomenclature_id, onupdate='CASCADE', ondelete='RESTRICT'),
+        nullable=False
+    )
+    account: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+
+    quantity: Mapped[float] = mapped_column(Numeric(12, 3), default=0)
+    total_amount: Mapped[float] = mapped_column(Numeric(12, 2), default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('period_end', 'nomenclature_id', 'account', name='uix_snapshot_period_item',
+                            postgresql_nulls_not_distinct=True),
+    )
+
+    def __repr__(self):
+        return f'<InventorySnapshot {self.period_end} {self.nomenclature_id}: {self.quantity}>'
+
+
+
+class SalesDaily(db.Model):
+    """Денний підсумок продажів по (дата, контрагент, товар). Оновлюється при проведенні."""
+    __tablename__ = 'sales_daily'
+
+    sales_daily_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+
+    sale_date: Mapped[date] = mapped_column(Date, nullable=False)
+    counterparty_id: Mapped[Optional[str]] = mapped_column(
+        ForeignKey(Counterparty.counterparty_id, onupdate='CASCADE', ondelete='RESTRICT'),
+        nullable=True
+    )
+    nomenclature_id: Mapped[str] = mapped_column(
+        ForeignKey(Nomenclature.nomenclature_id, onupdate='CASCADE', ondelete='RESTRICT'),
+        nullable=False
+    )
+
+    quantity: Mapped[float] = mapped_column(Numeric(14, 3), default=0)
+    # Виручка без ПДВ (сума DocumentLine.total_amount)
+    total_amount: Mapped[float] = mapped_column(Numeric(14, 2), default=0)
+    lines_count: Mapped[int] = mapped_column(Integer, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('sale_date', 'counterparty_id', 'nomenclature_id', name='uix_sales_daily_key',
+                            postgresql_nulls_not_distinct=True),
+    )
+
+    def __repr__(self):
+        return f'<SalesDaily {self.sale_date} {self.nomenclature_id}: {self.total_amount}>'
+
+
+
+class ChangeCounter(db.Model):
+    """Лічильник змін таблиці (версія для інвалідації кешів)."""
+    __tablename__ = 'change_counters'
+
+    name: Mapped[str] = mapped_column(String, primary_key=True)
+    version: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ChangeCounter {self.name}: {self.version}>'
+
+
+
+class PostingEvent(db.Model):
+    """
+    Зміна проведених даних (проведення, скасування, перерахунок) і діапазон дат, якого вона стосується.
+    event_id - водяний знак: видається лічильником change_counters['postings'] у тій самій
+    транзакції, тому зростає в порядку commit і не має пропусків.
+    """
+    __tablename__ = 'posting_events'
+
+    event_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    # NULL - діапазон відкритий з цього боку
+    date_from: Mapped[Optional[date]] = mapped_column(Date, nullable=True)
+    date_to: Mapped[Optional[date]] = mapped_column(Date, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, default=datetime.now)
+
+    def __repr__(self):
+        return f'<PostingEvent {self.event_id}: {self.date_from}..{self.date_to}>'
+
+
+
+class ReportJob(db.Model):
+    """Завдання на формування звіту (черга для воркера) та його збережений результат."""
+    __tablename__ = 'report_jobs'
+
+    job_id: Mapped[str] = mapped_column(String, primary_key=True)
+
+    report_type: Mapped[str] = mapped_column(String, nullable=False)
+    # Параметри звіту (дати ISO, групування, фільтри деталізації)
+    params: Mapped[dict] = mapped_column(JSONB, nullable=False)
+    # Канонічний ключ параметрів: однакові запити використовують один результат
+    params_key: Mapped[str] = mapped_column(String, nullable=False)
+
+    # queued -> running -> done | failed
+    status: Mapped[str] = mapped_column(String, nullable=False, default='queued')
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    error: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    # {'columns': [...], 'types': [...], 'rows': [[...], ...]}
+    result: Mapped[Optional[dict]] = mapped_column(JSONB, nullable=True)
+
+    # Водяний знак проведень (PostingEvent.event_id), на якому сформовано результат
+    watermark: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, default=datetime.now)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # Воркер бере найстаріше завдання в черзі
+        db.Index('ix_report_jobs_queued', 'created_at', postgresql_where=db.text("status = 'queued'")),
+        # Пошук готового результату для повторного використання
+        db.Index('ix_report_jobs_params_key', 'params_key', 'created_at'),
+    )
+
+    def __repr__(self):
+        return f'<ReportJob {self.job_id} {self.report_type}: {self.status}>'
@@ -1,9 +1,13 @@
 from application.models import Document, Counterparty, Nomenclature, DocumentLine
-from flask import render_template, url_for, redirect , jsonify, request, abort, flash
-from sqlalchemy import func, case, and_
-from sqlalchemy.orm import selectinload
-from datetime import date, datetime
-from decimal import Decimal
+from flask import render_template, url_for, redirect , jsonify, request, abort, flash, stream_with_context, make_response
+from flask import session as flask_session
+from sqlalchemy import func, case, and_, or_, tuple_, cast, String
+from sqlalchemy.orm import selectinload, joinedload
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+import base64
+import io
+import json
 import uuid
 
 
@@ -13,7 +17,20 @@ from application.forms import  DocumentForm, ReportForm
 from application.services.DocumentService import DocumentService
 from application.services.services import DocumentPostingService
 from application.services.exceptions import PostingError, InsufficientStockError
-from application.services.ReportServices import ReportService
+from application.services.ReferenceCache import reference_cache
+from application.services.DocumentImportService import DocumentImportService, IMPORT_FORMATS
+from application.services.ReportJobService import (
+    ReportJobService, make_params, params_key, decode_result, report_query, run_report, JOB_DONE
+)
+from application.services.ReportCache import report_cache
+from application.services.DocumentCache import (
+    document_state_query, document_etag, documents_list_etag, document_html_cache
+)
+from application.services.ChangeFeed import document_changes_query, inventory_changes_query, read_changes
+from application.serialization import json_response, payload_format, encode_rows
+from application.services.ExportService import (
+    EXPORT_FORMATS, EXPORT_MIMETYPES, DOCUMENT_COLUMNS, report_columns, stream_rows, export_chunks
+)
 
 
 
@@ -22,64 +39,315 @@ from application.services.ReportServices import ReportService
 @app.route('/')
 @app.route('/documents')
 def documents_list():
+    # Таблиця завантажує дані сама (/api/documents), сторінці документи не потрібні
+    return render_template('documents_list_tabulator.html')
+
+
+# Колонки, за якими API списку документів вміє сортувати на сервері.
+# Кожне сортування доповнюється documents_id, щоб ключ був унікальним (keyset).
+_DOCUMENT_SORT_COLUMNS = {
+    'date': Document.document_date,
+    'id': Document.documents_id,
+    'type': func.coalesce(Document.operation_type, ''),
+    'counterparty_name': func.coalesce(Counterparty.counterparty_name, ''),
+    'amount': func.coalesce(Document.total_amount, 0),
+}
+_DOCUMENTS_PAGE_SIZE_MAX = 500
 
-    documents = db.session.execute(
-        db.select(Document)
-        .order_by(Document.document_date.desc(), Document.documents_id.desc())
-    ).scalars().all()
-    
 
-    return render_template('documents_list_tabulator.html', documents=documents)
+def _encode_cursor(sort_value, doc_id):
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    elif isinstance(sort_value, Decimal):
+        sort_value = str(sort_value)
+    raw = json.dumps([sort_value, doc_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def _decode_cursor(cursor, sort_field):
+    try:
+        sort_value, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if sort_field == 'date' and sort_value is not None:
+            sort_value = datetime.fromisoformat(sort_value)
+        elif sort_field == 'amount':
+            sort_value = Decimal(sort_value)
+    except (ValueError, TypeError, InvalidOperation):
+        abort(400, description='Некоректний курсор пагінації.')
+    return sort_value, doc_id
+
+
+def _keyset_after(sort_column, sort_value, last_id, descending):
+    """
+    Умова "рядки після курсора" для keyset-пагінації з урахуванням NULL у колонці
+    сортування (NULL вважається більшим за будь-яке значення, див. ORDER BY).
+    Порівняння кортежу з NULL дає NULL, тому такі рядки обробляються окремо.
+    """
+    key = tuple_(sort_column, Document.documents_id)
+    if sort_value is None:
+        same_null = and_(sort_column.is_(None),
+                         Document.documents_id < last_id if descending else Document.documents_id > last_id)
+        # При спаданні після NULL-рядків ідуть усі рядки зі значенням
+        return or_(same_null, sort_column.isnot(None)) if descending else same_null
+    bound = tuple_(sort_value, last_id)
+    if descending:
+        return key < bound
+    return or_(key > bound, sort_column.is_(None))
+
+
+def _date_prefix_range(value):
+    """'2025', '2025-11' або '2025-11-19' -> напіввідкритий інтервал [start, end)."""
+    for fmt, step in (('%Y-%m-%d', 'day'), ('%Y-%m', 'month'), ('%Y', 'year')):
+        try:
+            start = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if step == 'day':
+            end = start + timedelta(days=1)
+        elif step == 'month':
+            end = (start + timedelta(days=32)).replace(day=1)
+        else:
+            end = start.replace(year=start.year + 1)
+        return start, end
+    return None
+
+
+def _apply_document_filters(query, args):
+    """Серверні headerFilter-и Tabulator: дата (префікс), тип, контрагент."""
+    date_value = args.get('filter_date', '').strip()
+    if date_value:
+        date_range = _date_prefix_range(date_value)
+        if date_range:
+            query = query.filter(Document.document_date >= date_range[0],
+                                 Document.document_date < date_range[1])
+        else:
+            # Довільний текст: повільний, але коректний пошук по рядковому поданню дати
+            query = query.filter(cast(Document.document_date, String).contains(date_value, autoescape=True))
+
+    type_value = args.get('filter_type', '').strip()
+    if type_value:
+        query = query.filter(Document.operation_type == type_value)
+
+    counterparty_value = args.get('filter_counterparty_name', '').strip()
+    if counterparty_value:
+        query = query.filter(Counterparty.counterparty_name.istartswith(counterparty_value, autoescape=True))
+
+    return query
+
+
+# Колонки /api/documents, вже у вигляді для відповіді: дата і сума форматуються в SQL,
+# тож рядок запиту кодується в JSON без перетворень у Python
+_DOCUMENT_API_COLUMNS = (
+    Document.documents_id.label('id'),
+    func.coalesce(func.to_char(Document.document_date, 'YYYY-MM-DD HH24:MI:SS'), 'Н/Д').label('date'),
+    Document.operation_type.label('type'),
+    func.coalesce(Counterparty.counterparty_name, 'Немає').label('counterparty_name'),
+    cast(Document.total_amount, String).label('amount'),
+    Document.currency.label('currency'),
+    Document.documents_id.label('actions'),  # Потрібно для генерації посилань
+)
+_DOCUMENT_API_FIELDS = tuple(column.key for column in _DOCUMENT_API_COLUMNS)
 
 
 @app.route('/api/documents')
 def documents_api():
-    documents = db.session.execute(
-        db.select(Document)
-        .options(selectinload(Document.counterparty)) 
-        .order_by(Document.document_date.desc(), Document.documents_id.desc())
-    ).scalars().all()
-    
+    # ETag залежить від версії журналу: Tabulator при перезавантаженні отримує 304
+    etag = documents_list_etag(db.session)
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
+
+    response = _documents_api_response()
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def _documents_api_response():
+    fmt = payload_format()
+    query = (
+        db.select(*_DOCUMENT_API_COLUMNS)
+        .select_from(Document)
+        .outerjoin(Counterparty, Document.counterparty_id == Counterparty.counterparty_id)
+    )
 
-    data = []
-    for doc in documents:
-        data.append({
-            'id': doc.documents_id,
-            'date': doc.document_date.strftime('%Y-%m-%d %H:%M:%S') if doc.document_date else 'Н/Д',
-            'type': doc.operation_type,
-            'counterparty_name': doc.counterparty.counterparty_name if doc.counterparty else 'Немає',
-            'amount': doc.total_amount,
-            'currency': doc.currency,
-            'actions': doc.documents_id # Потрібно для генерації посилань
-        })
-        
-    return jsonify(data)
+    # Без параметра size віддаємо весь список (старий режим для pagination: "local")
+    if 'size' not in request.args:
+        rows = db.session.execute(
+            query.order_by(Document.document_date.desc(), Document.documents_id.desc())
+        ).all()
+        return json_response(encode_rows(_DOCUMENT_API_FIELDS, rows, fmt))
+
+    # Віддалена пагінація: keyset по (колонка сортування, documents_id),
+    # тому вартість сторінки не залежить від її номера та розміру таблиці.
+    size = min(max(request.args.get('size', 20, type=int), 1), _DOCUMENTS_PAGE_SIZE_MAX)
+    sort_field = request.args.get('sort', 'date')
+    if sort_field not in _DOCUMENT_SORT_COLUMNS:
+        abort(400, description=f'Невідоме поле сортування: {sort_field}')
+    descending = request.args.get('dir', 'desc') != 'asc'
+    sort_column = _DOCUMENT_SORT_COLUMNS[sort_field]
+
+    query = _apply_document_filters(query, request.args)
+
+    cursor = request.args.get('after')
+    if cursor:
+        sort_value, last_id = _decode_cursor(cursor, sort_field)
+        query = query.filter(_keyset_after(sort_column, sort_value, last_id, descending))
+
+    # NULL (лише дата може бути NULL) - більший за будь-яке значення, як в індексі
+    # ix_documents_date_id: на початку при спаданні, в кінці при зростанні
+    if descending:
+        query = query.order_by(sort_column.desc().nulls_first(), Document.documents_id.desc())
+    else:
+        query = query.order_by(sort_column.asc().nulls_last(), Document.documents_id.asc())
+
+    # Беремо на один рядок більше, щоб знати, чи є наступна сторінка.
+    # Значення сортування - остання колонка, для курсора; у відповідь не йде
+    rows = db.session.execute(query.add_columns(sort_column).limit(size + 1)).all()
+    has_more = len(rows) > size
+    rows = rows[:size]
+
+    next_cursor = None
+    if has_more:
+        last_row = rows[-1]
+        next_cursor = _encode_cursor(last_row[-1], last_row.id)
+
+    return json_response({
+        'data': encode_rows(_DOCUMENT_API_FIELDS, [row[:-1] for row in rows], fmt),
+        'next_cursor': next_cursor,
+    })
+
+_CHANGES_PAGE_SIZE_MAX = 1000
+
+
+def _changes_response(query_factory):
+    """
+    Сторінка змін після курсора ?since= (0 - початкова повна вибірка), до ?limit= рядків.
+    Клієнт зберігає "cursor" з відповіді і передає його в наступному запиті;
+    "has_more" - зміни ще є, можна запитувати одразу.
+    """
+    fmt = payload_format()
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        since = -1
+    if since < 0:
+        abort(400, description='Некоректний курсор змін.')
+    limit = min(max(request.args.get('limit', _CHANGES_PAGE_SIZE_MAX, type=int), 1), _CHANGES_PAGE_SIZE_MAX)
+
+    query = query_factory(since)
+    rows, cursor, has_more = read_changes(db.session, query, since, limit)
+    return json_response({
+        'data': encode_rows(query.selected_columns.keys(), rows, fmt),
+        'cursor': cursor,
+        'has_more': has_more,
+    })
+
+
+@app.route('/api/documents/changes')
+def document_changes_api():
+    """Документи, створені або змінені (у т.ч. проведені) після курсора since."""
+    return _changes_response(document_changes_query)
+
+
+def _export_response(fmt, columns, rows, filename, sheet_name):
+    """Потокова відповідь CSV/XLSX: рядки читаються з курсора під час передачі."""
+    return app.response_class(
+        stream_with_context(export_chunks(fmt, columns, rows, sheet_name)),
+        mimetype=EXPORT_MIMETYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename={filename}.{fmt}'},
+    )
+
+@app.route('/documents/export')
+def export_documents():
+    """Експорт журналу документів (?format=csv|xlsx) з тими самими фільтрами і сортуванням, що й /api/documents."""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        abort(400, description='Формат експорту: csv або xlsx.')
+    sort_field = request.args.get('sort', 'date')
+    if sort_field not in _DOCUMENT_SORT_COLUMNS:
+        abort(400, description=f'Невідоме поле сортування: {sort_field}')
+    sort_column = _DOCUMENT_SORT_COLUMNS[sort_field]
+
+    # Лише потрібні колонки, без ORM-об'єктів
+    query = (
+        db.select(
+            Document.document_date, Document.documents_id, Document.operation_type,
+            Counterparty.counterparty_name, Document.total_amount, Document.currency, Document.is_posted,
+        )
+        .outerjoin(Document.counterparty)
+    )
+    query = _apply_document_filters(query, request.args)
+    if request.args.get('dir', 'desc') != 'asc':
+        query = query.order_by(sort_column.desc(), Document.documents_id.desc())
+    else:
+        query = query.order_by(sort_column.asc(), Document.documents_id.asc())
+
+    return _export_response(fmt, DOCUMENT_COLUMNS, stream_rows(db.session, query),
+                            f'documents-{date.today().isoformat()}', 'Документи')
 
 
 
 
+_NOMENCLATURE_SEARCH_LIMIT_MAX = 50
+
+
+@app.route('/api/nomenclature/search')
+def nomenclature_search_api():
+    """
+    Пошук номенклатури для рядків документа: спочатку збіги за префіксом
+    (індекс lower(name) text_pattern_ops), потім за підрядком (триграмний GIN-індекс).
+    """
+    query_text = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 20, type=int), 1), _NOMENCLATURE_SEARCH_LIMIT_MAX)
+    if not query_text:
+        return jsonify([])
+
+    name_lower = func.lower(Nomenclature.nomenclature_name)
+    prefix_rows = db.session.execute(
+        db.select(Nomenclature.nomenclature_id, Nomenclature.nomenclature_name)
+        .filter(name_lower.startswith(query_text.lower(), autoescape=True))
+        .order_by(name_lower)
+        .limit(limit)
+    ).all()
+
+    rows = list(prefix_rows)
+    # Триграми мають сенс від 3 символів, коротший запит - лише префікс
+    if len(rows) < limit and len(query_text) >= 3:
+        found = [row.nomenclature_id for row in rows]
+        contains_rows = db.session.execute(
+            db.select(Nomenclature.nomenclature_id, Nomenclature.nomenclature_name)
+            .filter(
+                Nomenclature.nomenclature_name.icontains(query_text, autoescape=True),
+                Nomenclature.nomenclature_id.notin_(found)
+            )
+            .order_by(func.strpos(name_lower, query_text.lower()), func.length(Nomenclature.nomenclature_name))
+            .limit(limit - len(rows))
+        ).all()
+        rows.extend(contains_rows)
+
+    return jsonify([{'id': row.nomenclature_id, 'name': row.nomenclature_name} for row in rows])
+
+
+def _nomenclature_names(form):
+    """Назви лише тих товарів, які вже обрані в рядках форми."""
+    ids = {entry.data['nomenclature_id'] for entry in form.lines.entries if entry.data['nomenclature_id']}
+    if not ids:
+        return {}
+    return dict(db.session.execute(
+        db.select(Nomenclature.nomenclature_id, Nomenclature.nomenclature_name)
+        .filter(Nomenclature.nomenclature_id.in_(ids))
+    ).all())
+
 
 @app.route('/document/new', methods=['GET', 'POST'])
 def create_document():
-    # 1. Завантаження даних для списків
-    counterparties_data = db.session.execute(
-        db.select(Counterparty).order_by(Counterparty.counterparty_name)
-    ).scalars().all()
-    
-    nomenclatures_data = db.session.execute(
-        db.select(Nomenclature).order_by(Nomenclature.nomenclature_name)
-    ).scalars().all()
+    # 1. Довідник контрагентів (з кешу процесу, без запитів на кожен GET/POST).
+    # Номенклатура у рядках підвантажується пошуком (/api/nomenclature/search).
+    counterparties_data = reference_cache.counterparties(db.session)
 
     # Створюємо форму та заповнюємо динамічні choices
     form = DocumentForm(request.form)
     
     # Заповнення choices для контрагентів: [(id, name), ...]
-    form.counterparty_id.choices = [
-        ('', 'Оберіть контрагента')
-    ] + [
-        (str(cp.counterparty_id), cp.counterparty_name) 
-        for cp in counterparties_data
-    ]
+    form.counterparty_id.choices = counterparties_data.choices
 
     if form.validate_on_submit():
         try:
@@ -146,34 +414,64 @@ def create_document():
 
     return render_template('create_document.html', 
                             form=form, 
-                            nomenclatures=nomenclatures_data) 
+                            nomenclature_names=_nomenclature_names(form)) 
 
 
     
 @app.route('/document/<string:doc_id>')
 def view_document(doc_id):
-    # 1. Завантажуємо Заголовок Документа
-    # Використовуємо joinedload для завантаження пов'язаного Контрагента одним запитом
-    document = db.session.execute(
-        db.select(Document)
-        .filter_by(documents_id=doc_id)
-        .options(selectinload(Document.counterparty))
-    ).scalar_one_or_none()
+    return _document_page(doc_id, 'view_document.html', shows_flashes=True)
 
-    if document is None:
-        abort(404) 
+def _not_modified(etag):
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
-    # 2. Завантажуємо Рядки Документа (Номенклатуру)
-    # Використовуємо selectinload для завантаження пов'язаної Номенклатури для кожного рядка
-    lines = db.session.execute(
-        db.select(DocumentLine)
-        .filter_by(document_id=doc_id)
-        .options(selectinload(DocumentLine.nomenclature))
-        .order_by(DocumentLine.product_item_id) # Сортування за ID рядка
-    ).scalars().all()
-    
-    # 3. Передаємо дані в шаблон
-    return render_template('view_document.html', document=document, lines=lines)
+def _document_page(doc_id, template_name, shows_flashes=False):
+    """
+    Сторінка документа з умовним GET: ETag з версії документа і довідників.
+    Повторний запит з If-None-Match коштує один запит до БД, а HTML проведених
+    документів береться з кешу. Сторінка з повідомленнями (flash) не кешується.
+    """
+    state = db.session.execute(document_state_query(doc_id)).one_or_none()
+    if state is None:
+        abort(404)
+
+    etag = document_etag(doc_id, state)
+    cacheable = not (shows_flashes and flask_session.get('_flashes'))
+    if cacheable and request.if_none_match.contains(etag):
+        return _not_modified(etag)
+
+    cache_key = (template_name, etag)
+    html = document_html_cache.get(cache_key) if cacheable and state.is_posted else None
+    if html is None:
+        # 1. Заголовок документа разом з контрагентом (одним запитом)
+        document = db.session.execute(
+            db.select(Document)
+            .filter_by(documents_id=doc_id)
+            .options(joinedload(Document.counterparty))
+        ).scalar_one_or_none()
+        if document is None:
+            abort(404)
+
+        # 2. Рядки документа з номенклатурою
+        lines = db.session.execute(
+            db.select(DocumentLine)
+            .filter_by(document_id=doc_id)
+            .options(selectinload(DocumentLine.nomenclature))
+            .order_by(DocumentLine.product_item_id) # Сортування за ID рядка
+        ).scalars().all()
+
+        html = render_template(template_name, document=document, lines=lines)
+        if cacheable and state.is_posted:
+            document_html_cache.put(cache_key, html)
+
+    response = make_response(html)
+    if cacheable:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 
@@ -204,6 +502,111 @@ def post_document(doc_id):
 
     return redirect(url_for('view_document', doc_id=doc_id))
 
+@app.route('/document/<string:doc_id>/unpost', methods=['POST'])
+def unpost_document(doc_id):
+    posting_service = DocumentPostingService(db.session)
+
+    try:
+        posting_service.unpost_document(doc_id)
+        flash('Проведення документа скасовано.', 'success')
+
+    except InsufficientStockError as e:
+        # Прихід уже частково списано: залишку не вистачає
+        db.session.rollback()
+        flash(f'Помилка залишків: {str(e)}', 'error')
+
+    except PostingError as e:
+        db.session.rollback()
+        flash(f'Неможливо скасувати проведення: {str(e)}', 'warning')
+
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Системна помилка: {str(e)}', 'error')
+
+    return redirect(url_for('view_document', doc_id=doc_id))
+
+@app.route('/document/<string:doc_id>/repost', methods=['POST'])
+def repost_document(doc_id):
+    posting_service = DocumentPostingService(db.session)
+
+    try:
+        posting_service.repost_document(doc_id)
+        flash('Документ перепроведено.', 'success')
+
+    except InsufficientStockError as e:
+        db.session.rollback()
+        flash(f'Помилка залишків: {str(e)}', 'error')
+
+    except PostingError as e:
+        db.session.rollback()
+        flash(f'Неможливо перепровести документ: {str(e)}', 'warning')
+
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Системна помилка: {str(e)}', 'error')
+
+    return redirect(url_for('view_document', doc_id=doc_id))
+
+@app.route('/api/documents/post', methods=['POST'])
+def post_documents_api():
+    """
+    Пакетне проведення. Тіло JSON:
+    {"document_ids": [...]} або {"date_from": "YYYY-MM-DD", "date_to": "YYYY-MM-DD"},
+    необов'язково "chunk_size".
+    """
+    payload = request.get_json(silent=True) or {}
+    doc_ids = payload.get('document_ids')
+    try:
+        date_from = date.fromisoformat(payload['date_from']) if payload.get('date_from') else None
+        date_to = date.fromisoformat(payload['date_to']) if payload.get('date_to') else None
+        chunk_size = int(payload.get('chunk_size') or app.config['POSTING_CHUNK_SIZE'])
+    except (TypeError, ValueError):
+        abort(400, description='Некоректні параметри пакетного проведення.')
+
+    if doc_ids is None and date_from is None and date_to is None:
+        abort(400, description='Вкажіть document_ids або діапазон дат.')
+
+    posting_service = DocumentPostingService(db.session)
+    try:
+        results = posting_service.post_documents(
+            doc_ids=doc_ids,
+            date_from=datetime.combine(date_from, datetime.min.time()) if date_from else None,
+            date_to=datetime.combine(date_to, datetime.max.time()) if date_to else None,
+            chunk_size=max(chunk_size, 1),
+        )
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return jsonify({
+        'posted': sum(1 for r in results if r['status'] == 'posted'),
+        'failed': sum(1 for r in results if r['status'] == 'error'),
+        'results': results,
+    })
+
+@app.route('/api/documents/import', methods=['POST'])
+def import_documents_api():
+    """
+    Масовий імпорт документів. Тіло - NDJSON (application/x-ndjson) або CSV (text/csv),
+    формат можна вказати і параметром ?format=ndjson|csv.
+    Помилкові документи повертаються в "errors", решта імпортується.
+    """
+    fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+    if fmt not in IMPORT_FORMATS:
+        abort(400, description='Формат імпорту: ndjson або csv.')
+
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+    try:
+        report = DocumentImportService(db.session).import_stream(stream, fmt)
+    except UnicodeDecodeError:
+        db.session.rollback()
+        abort(400, description='Файл імпорту має бути в кодуванні UTF-8.')
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return jsonify(report)
+
 @app.route('/inventory')
 def inventory_list():
     # Отримуємо всі залишки. Завдяки lazy="joined" у моделі, 
@@ -216,6 +619,11 @@ def inventory_list():
 
     return render_template('inventory_list.html', balances=balances)
 
+@app.route('/api/inventory/changes')
+def inventory_changes_api():
+    """Залишки, змінені проведенням, скасуванням чи перерахунком після курсора since."""
+    return _changes_response(inventory_changes_query)
+
 
 
 
@@ -241,15 +649,9 @@ def _handle_document_creation_based_on(source_id, target_type, contract_name_gen
     if not source_doc:
         abort(404)
 
-    # Завантажуємо довідники (для форми)
-    counterparties = db.session.execute(db.select(Counterparty).order_by(Counterparty.counterparty_name)).scalars().all()
-    nomenclatures = db.session.execute(db.select(Nomenclature).order_by(Nomenclature.nomenclature_name)).scalars().all()
-
-
+    # Довідник контрагентів для форми (з кешу процесу)
     form = DocumentForm(request.form)
-    form.counterparty_id.choices = [('', 'Оберіть контрагента')] + [
-        (str(cp.counterparty_id), cp.counterparty_name) for cp in counterparties
-    ]
+    form.counterparty_id.choices = reference_cache.counterparties(db.session).choices
 
     #  GET: Заповнення форми даними з джерела
     if request.method == 'GET':
@@ -286,7 +688,7 @@ def _handle_document_creation_based_on(source_id, target_type, contract_name_gen
         except Exception as e:
             flash(f"Помилка при збереженні: {str(e)}", 'error')
 
-    return render_template('create_document.html', form=form, nomenclatures=nomenclatures)
+    return render_template('create_document.html', form=form, nomenclature_names=_nomenclature_names(form))
 
 
 
@@ -323,57 +725,185 @@ def create_tax_invoice_based_on(source_id):
 
 @app.route('/reports', methods=['GET', 'POST'])
 def reports():
-    form = ReportForm(request.form)
-    results = []
-    report_type = None
-    total_sum = 0.0
-    
-    report_service = ReportService(db.session)
-
-    if request.method == 'POST' and form.validate():
-        # Нормалізація дат
-        start_date = datetime.combine(form.start_date.data, datetime.min.time())
-        end_date = datetime.combine(form.end_date.data, datetime.max.time())
-        report_type = form.report_type.data
+    # GET з параметрами - деталізація рядка зведеного звіту (посилання з таблиці)
+    drill_down = request.method == 'GET' and 'report_type' in request.args
+    if drill_down:
+        form = ReportForm(request.args, meta={'csrf': False})
+    else:
+        form = ReportForm(request.form)
+
+    if (request.method == 'POST' or drill_down) and form.validate():
+        try:
+            params = make_params(
+                form.report_type.data, form.start_date.data, form.end_date.data,
+                group_by=form.group_by.data,
+                counterparty_id=request.args.get('counterparty_id'),
+                nomenclature_id=form.nomenclature_id.data or None,
+                step=form.step.data,
+            )
+        except ValueError as e:
+            flash(str(e), 'warning')
+        else:
+            # Звіт формує воркер (flask reports worker), сторінка завдання показує результат
+            job = ReportJobService(db.session).submit(params)
+            db.session.commit()
+            return redirect(url_for('report_job', job_id=job.job_id))
 
-        if report_type == 'sales':
-            results = report_service.get_sales_report(start_date, end_date)
-            # Рахуємо суму тут або теж можна винести в сервіс
-            total_sum = sum(row.total_amount for row in results)
+    return render_template(
+        'reports.html',
+        form=form,
+        job=None,
+        results=[],
+        report_type=None,
+        group_by='lines',
+        total_sum=0.0
+    )
 
-        elif report_type == 'inventory_date':
-            # Для цього звіту важлива тільки кінцева дата
-            results = report_service.get_inventory_on_date(end_date)
-            # Тут total_sum це загальна вартість складу
-            total_sum = sum(row.balance_sum for row in results)
+def _report_job_or_404(job_id):
+    job = ReportJobService(db.session).get(job_id)
+    if job is None:
+        abort(404)
+    return job
+
+@app.route('/reports/jobs/<string:job_id>')
+def report_job(job_id):
+    job = _report_job_or_404(job_id)
+    params = job.params
+    form = ReportForm(formdata=None, data={
+        'report_type': params['report_type'],
+        'group_by': params.get('group_by', 'lines'),
+        'step': params.get('step', 'day'),
+        'start_date': date.fromisoformat(params['start_date']),
+        'end_date': date.fromisoformat(params['end_date']),
+    })
+    # Фільтр по товару зберігається у формі лише для динаміки залишків
+    if params['report_type'] == 'inventory_series':
+        form.nomenclature_id.data = params.get('nomenclature_id')
+
+    results, total_sum = [], 0.0
+    if job.status == JOB_DONE:
+        results, total_sum = decode_result(job.result)
 
     return render_template(
-        'reports.html', 
-        form=form, 
-        results=results, 
-        report_type=report_type, 
+        'reports.html',
+        form=form,
+        job=job,
+        results=results,
+        report_type=params['report_type'],
+        group_by=params.get('group_by', 'lines'),
         total_sum=total_sum
     )
 
+@app.route('/api/reports/jobs', methods=['POST'])
+def submit_report_job_api():
+    """
+    Ставить звіт у чергу. Тіло JSON: {"report_type": "sales"|"inventory_date"|"inventory_series",
+    "start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD", необов'язково "group_by",
+    "step", "counterparty_id", "nomenclature_id"}. Відповідь 202 зі статусом завдання.
+    """
+    payload = request.get_json(silent=True) or {}
+    try:
+        params = make_params(
+            payload.get('report_type'),
+            date.fromisoformat(payload['start_date']),
+            date.fromisoformat(payload['end_date']),
+            group_by=payload.get('group_by') or 'lines',
+            counterparty_id=payload.get('counterparty_id'),
+            nomenclature_id=payload.get('nomenclature_id'),
+            step=payload.get('step') or 'day',
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        abort(400, description=f'Некоректні параметри звіту: {e}')
+
+    job = ReportJobService(db.session).submit(params)
+    db.session.commit()
+    return jsonify(_serialize_report_job(job)), 202
+
+@app.route('/api/reports/jobs/<string:job_id>')
+def report_job_status_api(job_id):
+    return jsonify(_serialize_report_job(_report_job_or_404(job_id)))
+
+def _serialize_report_job(job):
+    return {
+        'job_id': job.job_id,
+        'report_type': job.report_type,
+        'params': job.params,
+        'status': job.status,
+        'error': job.error,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'page_url': url_for('report_job', job_id=job.job_id),
+        'result_url': url_for('report_job_result', job_id=job.job_id) if job.status == JOB_DONE else None,
+    }
+
+@app.route('/reports/export')
+def export_report():
+    """
+    Потоковий експорт звіту (?format=csv|xlsx) з тими самими параметрами, що й форма звіту.
+    Рядки читаються напряму з БД, без черги і без збереження результату.
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        abort(400, description='Формат експорту: csv або xlsx.')
+    try:
+        params = make_params(
+            request.args.get('report_type'),
+            date.fromisoformat(request.args['start_date']),
+            date.fromisoformat(request.args['end_date']),
+            group_by=request.args.get('group_by') or 'lines',
+            counterparty_id=request.args.get('counterparty_id'),
+            nomenclature_id=request.args.get('nomenclature_id'),
+            step=request.args.get('step') or 'day',
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        abort(400, description=f'Некоректні параметри звіту: {e}')
+
+    filename = f"{params['report_type']}-{params['start_date']}-{params['end_date']}"
+    rows = stream_rows(db.session, report_query(db.session, params))
+    return _export_response(fmt, report_columns(params), rows, filename, 'Звіт')
+
+@app.route('/api/reports/inventory-series')
+def inventory_series_api():
+    """
+    Динаміка залишків для графіків, одразу (без черги): ?start_date=&end_date=&step=day|week|month,
+    необов'язково nomenclature_id і format=columnar. Результат береться з кешу звітів,
+    доки проведення не змінять залишки в цьому діапазоні.
+    """
+    fmt = payload_format()
+    try:
+        params = make_params(
+            'inventory_series',
+            date.fromisoformat(request.args['start_date']),
+            date.fromisoformat(request.args['end_date']),
+            nomenclature_id=request.args.get('nomenclature_id'),
+            step=request.args.get('step') or 'day',
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        abort(400, description=f'Некоректні параметри звіту: {e}')
+
+    rows, total_sum, _ = report_cache.get_or_compute(db.session, params_key(params), params, run_report)
+    columns = rows[0]._fields if rows else ()
+    return json_response({
+        'params': params,
+        'data': encode_rows(columns, rows, fmt),
+        'total_sum': total_sum,
+    })
+
+@app.route('/reports/jobs/<string:job_id>/result')
+def report_job_result(job_id):
+    """Завантаження готового результату (JSON: columns, rows, total_sum)."""
+    job = _report_job_or_404(job_id)
+    if job.status != JOB_DONE:
+        abort(409, description='Звіт ще не готовий.')
+
+    return app.response_class(
+        json.dumps(job.result, ensure_ascii=False),
+        mimetype='application/json',
+        headers={'Content-Disposition': f'attachment; filename=report-{job.job_id}.json'},
+    )
+
 @app.route('/document/<string:doc_id>/print')
 def print_document_page(doc_id):
-    # Завантажуємо документ з контрагентом
-    document = db.session.execute(
-        db.select(Document)
-        .filter_by(documents_id=doc_id)
-        .options(selectinload(Document.counterparty))
-    ).scalar_one_or_none()
-
-    if document is None:
-        abort(404) 
-
-    # Завантажуємо рядки
-    lines = db.session.execute(
-        db.select(DocumentLine)
-        .filter_by(document_id=doc_id)
-        .options(selectinload(DocumentLine.nomenclature))
-        .order_by(DocumentLine.product_item_id)
-    ).scalars().all()
-    
-    # Рендеримо спеціальний шаблон для друку
-    return render_template('print_document.html', document=document, lines=lines)
\ No newline at end of file
+    # Спеціальний шаблон для друку (з тим самим ETag і кешем, що й перегляд)
+    return _document_page(doc_id, 'print_document.html')
@@ -0,0 +1,61 @@
+# application/serialization.py
+"""
+Швидке JSON-кодування відповідей API зі списками.
+Рядки запитів (кортежі колонок) кодуються напряму, без ORM-об'єктів і jsonify.
+Якщо встановлено orjson (pip install orjson), використовується він, інакше - стандартний json.
+
+Формати відповіді:
+  rows     - список об'єктів {колонка: значення} (за замовчуванням);
+  columnar - {"columns": [...], "values": [[значення колонки], ...]}: назви колонок
+             не повторюються в кожному рядку, тож відповідь у кілька разів менша.
+"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import abort, request
+
+from application import app
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+PAYLOAD_FORMATS = ('rows', 'columnar')
+
+
+def _default(value):
+    # Decimal - рядком, як і в jsonify: без втрати точності
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Тип {type(value).__name__} не серіалізується в JSON')
+
+
+def dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default)
+    return json.dumps(payload, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def json_response(payload, status=200):
+    return app.response_class(dumps(payload), status=status, mimetype='application/json')
+
+
+def payload_format():
+    """Формат відповіді з ?format= (rows або columnar)."""
+    fmt = request.args.get('format', 'rows')
+    if fmt not in PAYLOAD_FORMATS:
+        abort(400, description=f"Невідомий формат відповіді: {fmt}. Допустимі: {', '.join(PAYLOAD_FORMATS)}.")
+    return fmt
+
+
+def encode_rows(columns, rows, fmt='rows'):
+    """Рядки (кортежі в порядку columns) -> дані відповіді у форматі fmt."""
+    if fmt == 'columnar':
+        values = [list(column) for column in zip(*rows)] if rows else [[] for _ in columns]
+        return {'columns': list(columns), 'values': values}
+    return [dict(zip(columns, row)) for row in rows]
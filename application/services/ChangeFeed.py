@@ -0,0 +1,75 @@
+# application/services/ChangeFeed.py
+from sqlalchemy import select, func
+
+from application.models import Document, Counterparty, InventoryBalance, Nomenclature, change_sequence
+
+
+# Ключ транзакційного advisory-блокування, під яким видаються значення change_seq
+CHANGE_SEQ_LOCK = 720501
+
+
+def lock_change_seq(session):
+    """
+    Блокує видачу change_seq до кінця транзакції.
+    Транзакції, що змінюють документи чи залишки, беруть номери по черзі і
+    тримають блокування до commit, тож номер, менший за вже видимий клієнту,
+    пізніше не з'явиться і курсор since нічого не пропускає.
+    Повторний виклик у тій самій транзакції не чекає.
+    """
+    session.execute(select(func.pg_advisory_xact_lock(CHANGE_SEQ_LOCK)))
+
+
+def next_change_seq():
+    return change_sequence.next_value()
+
+
+def document_changes_query(since):
+    """Документи, змінені після курсора since, у порядку змін. Назви колонок - як у відповіді API."""
+    return (
+        select(
+            Document.documents_id.label('id'),
+            Document.document_date.label('date'),
+            Document.operation_type.label('type'),
+            Document.counterparty_id,
+            Counterparty.counterparty_name,
+            Document.total_amount.label('amount'),
+            Document.currency,
+            Document.is_posted,
+            Document.version,
+            Document.last_updated,
+            Document.change_seq,
+        )
+        .outerjoin(Counterparty, Document.counterparty_id == Counterparty.counterparty_id)
+        .filter(Document.change_seq > since)
+        .order_by(Document.change_seq)
+    )
+
+
+def inventory_changes_query(since):
+    """Залишки, змінені після курсора since, у порядку змін. Назви колонок - як у відповіді API."""
+    return (
+        select(
+            InventoryBalance.nomenclature_id,
+            Nomenclature.nomenclature_name,
+            InventoryBalance.account,
+            InventoryBalance.quantity,
+            InventoryBalance.total_amount.label('amount'),
+            InventoryBalance.last_updated,
+            InventoryBalance.change_seq,
+        )
+        .join(Nomenclature, InventoryBalance.nomenclature_id == Nomenclature.nomenclature_id)
+        .filter(InventoryBalance.change_seq > since)
+        .order_by(InventoryBalance.change_seq)
+    )
+
+
+def read_changes(session, query, since, limit):
+    """
+    Одна сторінка змін: (рядки, курсор для наступного запиту, чи є ще зміни).
+    Без змін курсор лишається since.
+    """
+    rows = session.execute(query.limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    cursor = rows[-1].change_seq if rows else since
+    return rows, cursor, has_more
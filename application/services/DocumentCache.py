@@ -0,0 +1,128 @@
+# application/services/DocumentCache.py
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from application.models import Document, DocumentLine, ChangeCounter
+from application.services.ReferenceCache import bump_version
+from application.services.ChangeFeed import lock_change_seq, next_change_seq
+from config import Config
+
+
+# Лічильник у change_counters: версія журналу документів (ETag /api/documents)
+DOCUMENTS_COUNTER = 'documents'
+# Ключ session.info: ID документів, змінених у поточній транзакції
+_CHANGED_DOCUMENTS = 'changed_documents'
+
+
+def _counter_version(name):
+    return select(ChangeCounter.version).filter_by(name=name).scalar_subquery()
+
+
+def document_state_query(doc_id):
+    """
+    Один запит для умовного GET сторінки документа: версія документа, чи проведений,
+    та версії довідників (назви контрагента і товарів показуються на сторінці).
+    """
+    return select(
+        Document.version,
+        Document.is_posted,
+        _counter_version('counterparty').label('counterparty_version'),
+        _counter_version('nomenclature').label('nomenclature_version'),
+    ).filter(Document.documents_id == doc_id)
+
+
+def document_etag(doc_id, state):
+    return f'doc-{doc_id}-{state.version}-{state.counterparty_version or 0}-{state.nomenclature_version or 0}'
+
+
+def documents_list_etag(session):
+    """ETag журналу: версія документів і довідника контрагентів (назви в списку)."""
+    versions = dict(session.execute(
+        select(ChangeCounter.name, ChangeCounter.version)
+        .filter(ChangeCounter.name.in_((DOCUMENTS_COUNTER, 'counterparty')))
+    ).all())
+    return f"documents-{versions.get(DOCUMENTS_COUNTER, 0)}-{versions.get('counterparty', 0)}"
+
+
+class RenderedDocumentCache:
+    """
+    Готовий HTML сторінок проведених документів у пам'яті процесу (LRU).
+    Ключ містить ETag (версії документа і довідників), тож застарілі записи
+    просто перестають запитуватись і витісняються. max_entries=0 вимикає кеш.
+    """
+
+    def __init__(self, max_entries=500):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+            return html
+
+    def put(self, key, html):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+document_html_cache = RenderedDocumentCache(max_entries=Config.DOCUMENT_HTML_CACHE_SIZE)
+
+
+def mark_documents_changed(session, doc_ids):
+    """Документи, записані в обхід ORM (Core INSERT/UPDATE): версія і change_seq оновляться при commit."""
+    session.info.setdefault(_CHANGED_DOCUMENTS, set()).update(doc_ids)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_documents(session, flush_context):
+    """Запам'ятовує документи, змінені через ORM (сам документ або його рядки)."""
+    changed = session.info.setdefault(_CHANGED_DOCUMENTS, set())
+    dirty = [obj for obj in session.dirty if session.is_modified(obj, include_collections=False)]
+    for obj in list(session.new) + dirty + list(session.deleted):
+        if isinstance(obj, Document):
+            changed.add(obj.documents_id)
+        elif isinstance(obj, DocumentLine):
+            changed.add(obj.document_id)
+
+
+@event.listens_for(Session, 'before_commit')
+def _bump_document_versions(session):
+    """
+    Версії змінених документів, їх change_seq і лічильник журналу оновлюються
+    безпосередньо перед commit: блокування тримаються лише на час фіксації,
+    а не всієї транзакції.
+    """
+    session.flush()
+    changed = session.info.pop(_CHANGED_DOCUMENTS, None)
+    if not changed:
+        return
+    lock_change_seq(session)
+    connection = session.connection()
+    documents = Document.__table__
+    connection.execute(
+        update(documents)
+        .where(documents.c.documents_id.in_(sorted(changed)))
+        .values(version=documents.c.version + 1, change_seq=next_change_seq(), last_updated=datetime.now())
+    )
+    bump_version(connection, DOCUMENTS_COUNTER)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_documents(session):
+    session.info.pop(_CHANGED_DOCUMENTS, None)
@@ -0,0 +1,321 @@
+# application/services/DocumentImportService.py
+import csv
+import json
+import math
+import uuid
+from datetime import date, datetime
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import DBAPIError
+
+from application.forms import DocumentForm
+from application.models import Counterparty, Nomenclature, Document, DocumentLine
+from application.services.DocumentService import DocumentService
+from application.services.ReferenceCache import reference_cache
+from application.services.DocumentCache import mark_documents_changed
+
+
+IMPORT_FORMATS = ('ndjson', 'csv')
+
+# Колонки CSV: один рядок файлу - один рядок документа.
+# Рядки одного документа йдуть підряд і мають однаковий document_ref.
+CSV_HEADER_FIELDS = ('document_id', 'document_date', 'operation_type', 'counterparty_id', 'currency',
+                     'contract_name', 'incoming_number', 'incoming_date')
+CSV_LINE_FIELDS = ('nomenclature_id', 'quantity', 'price_with_vat', 'unit')
+# Необов'язкові текстові поля заголовка (перевіряються _check_text)
+TEXT_HEADER_FIELDS = ('currency', 'contract_name', 'incoming_number')
+
+# Межі колонок: кількість - Numeric(12), суми - Numeric(12, 2)
+QUANTITY_LIMIT = 10 ** 12
+AMOUNT_LIMIT = 10 ** 10
+
+
+class _RowError(ValueError):
+    """Помилка валідації одного документа (не зупиняє імпорт)."""
+    pass
+
+
+def _check_text(value, name):
+    """
+    Текстове поле: з NDJSON можуть прийти числа чи об'єкти, а колонки - varchar.
+    Символ NUL PostgreSQL у тексті не приймає (psycopg2 кидає ValueError ще до запиту).
+    """
+    if not isinstance(value, str):
+        raise _RowError(f'{name} має бути рядком.')
+    if '\x00' in value:
+        raise _RowError(f'{name} містить недопустимий символ NUL.')
+
+
+def iter_ndjson(stream):
+    """(номер рядка, ref, документ) з NDJSON: один JSON-документ з "lines" на рядок."""
+    for line_no, text in enumerate(stream, start=1):
+        text = text.strip()
+        if not text:
+            continue
+        try:
+            raw = json.loads(text)
+        except json.JSONDecodeError as e:
+            yield line_no, None, _RowError(f'Некоректний JSON: {e.msg}')
+            continue
+        if not isinstance(raw, dict):
+            yield line_no, None, _RowError('Очікується JSON-об\'єкт документа.')
+            continue
+        yield line_no, raw.get('document_ref') or raw.get('document_id'), raw
+
+
+def iter_csv(stream):
+    """(номер рядка, ref, документ) з CSV: рядки з однаковим document_ref збираються в документ."""
+    reader = csv.DictReader(stream)
+    current_ref, current, start_line = None, None, None
+
+    for row in reader:
+        ref = (row.get('document_ref') or row.get('document_id') or '').strip()
+        if current is not None and ref != current_ref:
+            yield start_line, current_ref, current
+            current = None
+        if current is None:
+            current_ref, start_line = ref, reader.line_num
+            current = {field: row.get(field) or None for field in CSV_HEADER_FIELDS}
+            current['lines'] = []
+        current['lines'].append({field: row.get(field) or None for field in CSV_LINE_FIELDS})
+
+    if current is not None:
+        yield start_line, current_ref, current
+
+
+class DocumentImportService:
+    """
+    Масовий імпорт документів (NDJSON або CSV).
+    Документи перевіряються по одному під час читання потоку, валідні
+    записуються порціями multi-row INSERT (заголовки та рядки окремими запитами).
+    Помилковий документ потрапляє у звіт і не зупиняє імпорт.
+    """
+    BATCH_SIZE = 1000
+
+    def __init__(self, db_session, batch_size=None):
+        self.db = db_session
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self._counterparty_ids = None
+        self._nomenclature_ids = None
+        self._seen_document_ids = set()
+
+    def import_stream(self, stream, fmt='ndjson'):
+        """
+        Імпортує документи з текстового потоку. Кожна порція комітиться окремо.
+        Повертає звіт: {'imported', 'failed', 'documents': [{'ref', 'document_id'}],
+                        'errors': [{'ref', 'line', 'error'}]}
+        """
+        if fmt not in IMPORT_FORMATS:
+            raise ValueError(f'Невідомий формат імпорту: {fmt}')
+
+        self._counterparty_ids = {item.counterparty_id for item in reference_cache.counterparties(self.db).items}
+        self._nomenclature_ids = {item.nomenclature_id for item in reference_cache.nomenclatures(self.db).items}
+
+        report = {'imported': 0, 'failed': 0, 'documents': [], 'errors': []}
+        batch = []
+        rows = iter_ndjson(stream) if fmt == 'ndjson' else iter_csv(stream)
+
+        for line_no, ref, raw in rows:
+            try:
+                if isinstance(raw, _RowError):
+                    raise raw
+                batch.append((line_no, ref, self._validate(raw)))
+            except _RowError as e:
+                self._fail(report, ref, line_no, str(e))
+                continue
+
+            if len(batch) >= self.batch_size:
+                self._flush(batch, report)
+
+        self._flush(batch, report)
+        return report
+
+    def _fail(self, report, ref, line_no, error):
+        report['failed'] += 1
+        report['errors'].append({'ref': ref, 'line': line_no, 'error': error})
+
+    def _validate(self, raw):
+        """Перевіряє документ і розраховує суми рядків. Повертає (заголовок, [рядки])."""
+        operation_type = raw.get('operation_type')
+        if operation_type not in DocumentForm.DOC_TYPES:
+            raise _RowError(f'Невідомий тип операції: {operation_type!r}')
+
+        counterparty_id = raw.get('counterparty_id')
+        if not counterparty_id:
+            raise _RowError('Не вказано контрагента.')
+        _check_text(counterparty_id, 'ID контрагента')
+
+        document_date = self._parse_date(raw.get('document_date'))
+        incoming_date = self._parse_incoming_date(raw.get('incoming_date'))
+
+        document_id = raw.get('document_id') or str(uuid.uuid4())
+        _check_text(document_id, 'ID документа')
+        if document_id in self._seen_document_ids:
+            raise _RowError(f'Документ {document_id} повторюється у файлі.')
+
+        for field in TEXT_HEADER_FIELDS:
+            if raw.get(field) is not None:
+                _check_text(raw[field], f'Поле {field}')
+
+        lines = raw.get('lines')
+        if not isinstance(lines, list) or not lines:
+            raise _RowError('Документ повинен містити хоча б один рядок.')
+
+        line_rows = []
+        total_without_vat = 0.0
+        for index, line in enumerate(lines, start=1):
+            if not isinstance(line, dict) or not line.get('nomenclature_id'):
+                raise _RowError(f'Рядок {index}: не вказано номенклатуру.')
+            _check_text(line['nomenclature_id'], f'Рядок {index}: ID номенклатури')
+            if line.get('unit') is not None:
+                _check_text(line['unit'], f'Рядок {index}: одиниця виміру')
+            try:
+                quantity = float(line.get('quantity'))
+                price_with_vat = float(line.get('price_with_vat'))
+            except (TypeError, ValueError):
+                raise _RowError(f'Рядок {index}: некоректна кількість або ціна.')
+            # float() приймає "nan" та "inf", а порівняння з NaN завжди хибне
+            if not (math.isfinite(quantity) and math.isfinite(price_with_vat)):
+                raise _RowError(f'Рядок {index}: некоректна кількість або ціна.')
+            if quantity < 0.001:
+                raise _RowError(f'Рядок {index}: кількість має бути більше 0.')
+            if price_with_vat < 0.01:
+                raise _RowError(f'Рядок {index}: ціна має бути більше 0.')
+            if round(quantity) >= QUANTITY_LIMIT:
+                raise _RowError(f'Рядок {index}: завелика кількість.')
+
+            amounts = DocumentService.calculate_line_amounts(quantity, price_with_vat)
+            if max(round(price_with_vat, 2), round(amounts['total_with_vat'], 2)) >= AMOUNT_LIMIT:
+                raise _RowError(f'Рядок {index}: завелика сума.')
+            total_without_vat += amounts['total_without_vat']
+            line_rows.append({
+                'product_item_id': str(uuid.uuid4()),
+                'document_id': document_id,
+                'nomenclature_id': line['nomenclature_id'],
+                'quantity': quantity,
+                'unit': line.get('unit') or 'шт.',
+                'price_with_vat': round(price_with_vat, 2),
+                'total_with_vat': round(amounts['total_with_vat'], 2),
+                'vat_amount': round(amounts['vat_amount'], 2),
+                'total_amount': round(amounts['total_without_vat'], 2),
+            })
+
+        if round(total_without_vat, 2) >= AMOUNT_LIMIT:
+            raise _RowError('Завелика сума документа.')
+
+        self._seen_document_ids.add(document_id)
+        header = {
+            'documents_id': document_id,
+            'document_date': document_date,
+            'operation_type': operation_type,
+            'total_amount': round(total_without_vat, 2),
+            'currency': raw.get('currency') or 'UAH',
+            'counterparty_id': counterparty_id,
+            'contract_name': raw.get('contract_name'),
+            'incoming_number': raw.get('incoming_number'),
+            'incoming_date': incoming_date,
+            'is_posted': False,
+        }
+        return header, line_rows
+
+    @staticmethod
+    def _parse_date(value):
+        """Дата без часу доповнюється поточним часом, як у формі документа."""
+        if not value:
+            raise _RowError('Не вказано дату документа.')
+        try:
+            if len(value) == 10:
+                return datetime.combine(date.fromisoformat(value), datetime.now().time())
+            return datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise _RowError(f'Некоректна дата документа: {value!r}')
+
+    @staticmethod
+    def _parse_incoming_date(value):
+        """Дата вхідного документа (необов'язкова) зберігається у форматі YYYY-MM-DD."""
+        if not value:
+            return None
+        try:
+            return date.fromisoformat(value[:10]).isoformat()
+        except (TypeError, ValueError):
+            raise _RowError(f'Некоректна дата вхідного документа: {value!r}')
+
+    def _missing_references(self, batch):
+        """
+        ID контрагентів і номенклатури порції, яких немає в довіднику.
+        Невідомі кешу ID перевіряються одним запитом (довідник міг змінитися щойно).
+        """
+        counterparty_ids = {header['counterparty_id'] for _, _, (header, _) in batch}
+        nomenclature_ids = {line['nomenclature_id'] for _, _, (_, lines) in batch for line in lines}
+
+        unknown_counterparties = counterparty_ids - self._counterparty_ids
+        if unknown_counterparties:
+            self._counterparty_ids.update(self.db.execute(
+                select(Counterparty.counterparty_id)
+                .filter(Counterparty.counterparty_id.in_(unknown_counterparties))
+            ).scalars())
+
+        unknown_nomenclatures = nomenclature_ids - self._nomenclature_ids
+        if unknown_nomenclatures:
+            self._nomenclature_ids.update(self.db.execute(
+                select(Nomenclature.nomenclature_id)
+                .filter(Nomenclature.nomenclature_id.in_(unknown_nomenclatures))
+            ).scalars())
+
+        return counterparty_ids - self._counterparty_ids, nomenclature_ids - self._nomenclature_ids
+
+    def _flush(self, batch, report):
+        if not batch:
+            return
+
+        missing_counterparties, missing_nomenclatures = self._missing_references(batch)
+        existing_ids = set(self.db.execute(
+            select(Document.documents_id)
+            .filter(Document.documents_id.in_([header['documents_id'] for _, _, (header, _) in batch]))
+        ).scalars())
+
+        valid = []
+        for line_no, ref, (header, lines) in batch:
+            missing = sorted({line['nomenclature_id'] for line in lines} & missing_nomenclatures)
+            if header['documents_id'] in existing_ids:
+                self._fail(report, ref, line_no, f"Документ {header['documents_id']} вже існує.")
+            elif header['counterparty_id'] in missing_counterparties:
+                self._fail(report, ref, line_no, f"Контрагента {header['counterparty_id']} не знайдено.")
+            elif missing:
+                self._fail(report, ref, line_no, f"Номенклатуру не знайдено: {', '.join(missing)}")
+            else:
+                valid.append((line_no, ref, header, lines))
+
+        if valid:
+            try:
+                self._insert(valid)
+            except DBAPIError:
+                # Конфлікт з паралельним записом або дані, які відхилила БД: документи порції
+                # записуються по одному, у звіт потрапляють лише ті, що справді не записались
+                inserted = []
+                for document in valid:
+                    line_no, ref, header, _ = document
+                    try:
+                        self._insert([document])
+                    except DBAPIError as e:
+                        self._fail(report, ref, line_no, f"Документ {header['documents_id']} не записано: {e.orig}")
+                    else:
+                        inserted.append(document)
+                valid = inserted
+
+        if valid:
+            # Core INSERT оминає ORM-події: change_seq і версію журналу оновить commit
+            mark_documents_changed(self.db, [header['documents_id'] for _, _, header, _ in valid])
+            report['imported'] += len(valid)
+            report['documents'].extend(
+                {'ref': ref, 'document_id': header['documents_id']} for _, ref, header, _ in valid
+            )
+
+        self.db.commit()
+        batch.clear()
+
+    def _insert(self, documents):
+        """Заголовки і рядки документів двома multi-row INSERT у власному SAVEPOINT."""
+        with self.db.begin_nested():
+            self.db.execute(insert(Document), [header for _, _, header, _ in documents])
+            self.db.execute(insert(DocumentLine), [line for _, _, _, lines in documents for line in lines])
@@ -0,0 +1,274 @@
+# application/services/ExportService.py
+import csv
+import io
+import re
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape, quoteattr
+
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# Скільки рядків читати з серверного курсора і віддавати клієнту за раз
+EXPORT_CHUNK_ROWS = 1000
+# Більше рядків Excel не відкриє
+XLSX_MAX_ROWS = 1048576
+
+# Колонки експорту: (заголовок, поле рядка запиту)
+DOCUMENT_COLUMNS = [
+    ('Дата', 'document_date'),
+    ('№ Документа', 'documents_id'),
+    ('Тип операції', 'operation_type'),
+    ('Контрагент', 'counterparty_name'),
+    ('Сума', 'total_amount'),
+    ('Валюта', 'currency'),
+    ('Проведено', 'is_posted'),
+]
+_SALES_LINE_COLUMNS = [
+    ('Дата', 'document_date'),
+    ('№ Документа', 'documents_id'),
+    ('Клієнт', 'counterparty_name'),
+    ('Товар', 'nomenclature_name'),
+    ('К-ть', 'quantity'),
+    ('Сума (грн)', 'total_amount'),
+]
+_SALES_SUMMARY_LABELS = {'day': 'Дата', 'counterparty': 'Клієнт', 'nomenclature': 'Товар'}
+_INVENTORY_COLUMNS = [
+    ('Товар', 'nomenclature_name'),
+    ('Залишок (К-ть)', 'balance_qty'),
+    ('Вартість (грн)', 'balance_sum'),
+]
+_INVENTORY_SERIES_COLUMNS = [
+    ('Період з', 'period_start'),
+    ('Період по', 'period_end'),
+    ('Товар', 'nomenclature_name'),
+    ('Залишок (К-ть)', 'balance_qty'),
+    ('Вартість (грн)', 'balance_sum'),
+]
+
+
+def report_columns(params):
+    """Колонки експорту звіту за його параметрами (як у таблицях reports.html)."""
+    if params['report_type'] == 'inventory_date':
+        return _INVENTORY_COLUMNS
+    if params['report_type'] == 'inventory_series':
+        return _INVENTORY_SERIES_COLUMNS
+    if params['group_by'] == 'lines':
+        return _SALES_LINE_COLUMNS
+    return [
+        (_SALES_SUMMARY_LABELS[params['group_by']], 'label'),
+        ('Рядків', 'lines_count'),
+        ('К-ть', 'quantity'),
+        ('Сума (грн)', 'total_amount'),
+    ]
+
+
+def stream_rows(session, query, batch_size=EXPORT_CHUNK_ROWS):
+    """
+    Рядки запиту з серверного курсора (yield_per вмикає stream_results):
+    в пам'яті одночасно лише одна порція, незалежно від розміру результату.
+    """
+    result = session.execute(query.execution_options(yield_per=batch_size))
+    try:
+        yield from result
+    finally:
+        result.close()
+
+
+def export_chunks(fmt, columns, rows, sheet_name='Експорт'):
+    if fmt == 'csv':
+        return csv_chunks(columns, rows)
+    if fmt == 'xlsx':
+        return xlsx_chunks(columns, rows, sheet_name)
+    raise ValueError(f'Невідомий формат експорту: {fmt}')
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'так' if value else 'ні'
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def csv_chunks(columns, rows, chunk_rows=EXPORT_CHUNK_ROWS):
+    """CSV (UTF-8 з BOM, щоб Excel правильно показав кирилицю) порціями байтів."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow([title for title, _ in columns])
+
+    fields = [field for _, field in columns]
+    for count, row in enumerate(rows, start=1):
+        writer.writerow([_csv_value(getattr(row, field)) for field in fields])
+        if count % chunk_rows == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+class _ChunkSink:
+    """Потік без seek для zipfile: записане забирається порціями (drain)."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+_XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+_XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name={name} sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+# Стилі комірок (s=...): 1 - дата, 2 - дата й час, 3 - заголовок (жирний)
+_XLSX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="2">'
+    '<numFmt numFmtId="164" formatCode="yyyy-mm-dd"/>'
+    '<numFmt numFmtId="165" formatCode="yyyy-mm-dd hh:mm:ss"/>'
+    '</numFmts>'
+    '<fonts count="2">'
+    '<font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font>'
+    '</fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="4">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+_XLSX_SHEET_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<sheetViews><sheetView workbookViewId="0">'
+    '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+    '</sheetView></sheetViews>'
+    '<sheetData>'
+)
+_XLSX_SHEET_FOOTER = '</sheetData></worksheet>'
+
+# Символи, заборонені в XML 1.0
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+
+
+def _xlsx_cell(value, style=None):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float, Decimal)):
+        return f'<c><v>{value}</v></c>'
+    if isinstance(value, datetime):
+        delta = value.replace(tzinfo=None) - _EXCEL_EPOCH
+        serial = delta.days + (delta.seconds + delta.microseconds / 1e6) / 86400
+        return f'<c s="2"><v>{serial!r}</v></c>'
+    if isinstance(value, date):
+        return f'<c s="1"><v>{(value - _EXCEL_EPOCH.date()).days}</v></c>'
+    text = escape(_XML_ILLEGAL.sub('', str(value)))
+    style_attr = f' s="{style}"' if style else ''
+    return f'<c t="inlineStr"{style_attr}><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(number, values, style=None):
+    return f'<row r="{number}">' + ''.join(_xlsx_cell(value, style) for value in values) + '</row>'
+
+
+def _sheet_name(name):
+    # Назва аркуша: до 31 символу, без []:*?/\
+    return re.sub(r'[\[\]:*?/\\]', ' ', name)[:31] or 'Аркуш1'
+
+
+def xlsx_chunks(columns, rows, sheet_name='Експорт', chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    XLSX (один аркуш, рядки inline без sharedStrings) порціями байтів.
+    Архів пишеться в потік без seek, тож весь файл у пам'яті не збирається.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', _XLSX_CONTENT_TYPES)
+        archive.writestr('_rels/.rels', _XLSX_ROOT_RELS)
+        archive.writestr('xl/workbook.xml', _XLSX_WORKBOOK.format(name=quoteattr(_sheet_name(sheet_name))))
+        archive.writestr('xl/_rels/workbook.xml.rels', _XLSX_WORKBOOK_RELS)
+        archive.writestr('xl/styles.xml', _XLSX_STYLES)
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            parts = [_XLSX_SHEET_HEADER, _xlsx_row(1, [title for title, _ in columns], style=3)]
+            fields = [field for _, field in columns]
+            for number, row in enumerate(rows, start=2):
+                if number > XLSX_MAX_ROWS:
+                    break
+                parts.append(_xlsx_row(number, [getattr(row, field) for field in fields]))
+                if len(parts) >= chunk_rows:
+                    sheet.write(''.join(parts).encode('utf-8'))
+                    parts = []
+                    data = sink.drain()
+                    if data:
+                        yield data
+            parts.append(_XLSX_SHEET_FOOTER)
+            sheet.write(''.join(parts).encode('utf-8'))
+    # Центральний каталог архіву записується при закритті
+    yield sink.drain()
@@ -0,0 +1,96 @@
+# application/services/ParallelPostingService.py
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import select
+
+from application import db
+from application.models import DocumentLine
+from application.services.services import DocumentPostingService
+
+
+class ParallelPostingService:
+    """
+    Паралельне пакетне проведення.
+    Документи діляться на групи, що не мають спільної номенклатури
+    (документи зі спільним товаром - в одній групі, транзитивно).
+    Кожна група проводиться в хронологічному порядку в окремому потоці
+    з власним контекстом застосунку і сесією, тож FIFO в межах товару
+    не залежить від паралельності, а блокування залишків не конкурують.
+    """
+    # Скільки ID документів передавати в одному IN (...) при читанні рядків
+    LINES_QUERY_BATCH = 10000
+
+    def __init__(self, app, workers=4, chunk_size=500):
+        self.app = app
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+    def post_documents(self, doc_ids=None, date_from=None, date_to=None):
+        """Той самий звіт, що й DocumentPostingService.post_documents."""
+        with self.app.app_context():
+            ordered_ids = DocumentPostingService(db.session).select_for_posting(doc_ids, date_from, date_to)
+            pairs = []
+            for offset in range(0, len(ordered_ids), self.LINES_QUERY_BATCH):
+                pairs.extend(db.session.execute(
+                    select(DocumentLine.document_id, DocumentLine.nomenclature_id)
+                    .filter(DocumentLine.document_id.in_(ordered_ids[offset:offset + self.LINES_QUERY_BATCH]))
+                ).all())
+            db.session.remove()
+
+        report = []
+        if doc_ids is not None:
+            found = set(ordered_ids)
+            report.extend(
+                {'document_id': doc_id, 'status': 'error', 'error': "Документ не знайдено."}
+                for doc_id in doc_ids if doc_id not in found
+            )
+
+        # Великі групи - першими, щоб потоки завершувались приблизно одночасно
+        groups = sorted(self.partition(ordered_ids, pairs), key=len, reverse=True)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for group_report in pool.map(self._post_group, groups):
+                report.extend(group_report)
+        return report
+
+    @staticmethod
+    def partition(ordered_ids, pairs):
+        """
+        Групи документів без спільної номенклатури (union-find по товарах).
+        pairs - [(document_id, nomenclature_id), ...]. Порядок документів у групі зберігається.
+        """
+        parent = {}
+
+        def find(item):
+            root = item
+            while parent[root] != root:
+                root = parent[root]
+            while parent[item] != root:
+                parent[item], item = root, parent[item]
+            return root
+
+        document_items = {}
+        for document_id, nomenclature_id in pairs:
+            parent.setdefault(nomenclature_id, nomenclature_id)
+            document_items.setdefault(document_id, []).append(nomenclature_id)
+
+        for items in document_items.values():
+            first = find(items[0])
+            for item in items[1:]:
+                root = find(item)
+                if root != first:
+                    parent[root] = first
+
+        groups = {}
+        for document_id in ordered_ids:
+            items = document_items.get(document_id)
+            # Документ без рядків - окрема група
+            key = find(items[0]) if items else ('document', document_id)
+            groups.setdefault(key, []).append(document_id)
+        return list(groups.values())
+
+    def _post_group(self, doc_ids):
+        with self.app.app_context():
+            try:
+                return DocumentPostingService(db.session).post_documents(doc_ids=doc_ids, chunk_size=self.chunk_size)
+            finally:
+                db.session.remove()
@@ -0,0 +1,251 @@
+# application/services/ReconciliationService.py
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
+
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from application import app, db
+from application.models import Document, DocumentLine, InventoryBalance, Nomenclature, CostLayer
+from application.services.operations import OperationType, to_decimal
+from application.services.services import DocumentPostingService, replay_fifo
+from application.services.ChangeFeed import lock_change_seq, next_change_seq
+
+
+Discrepancy = namedtuple('Discrepancy', [
+    'nomenclature_id', 'nomenclature_name', 'account',
+    'ledger_quantity', 'stored_quantity', 'ledger_amount', 'recorded_amount', 'stored_amount', 'layers_match',
+])
+
+# Колонки звіту розбіжностей (ExportService.csv_chunks)
+DISCREPANCY_COLUMNS = [
+    ('ID товару', 'nomenclature_id'),
+    ('Товар', 'nomenclature_name'),
+    ('Рахунок', 'account'),
+    ('К-ть за документами', 'ledger_quantity'),
+    ('К-ть у залишках', 'stored_quantity'),
+    ('Вартість за FIFO', 'ledger_amount'),
+    ('Вартість за собівартістю рядків', 'recorded_amount'),
+    ('Вартість у залишках', 'stored_amount'),
+    ('Партії FIFO збігаються', 'layers_match'),
+]
+
+_ZERO = Decimal(0)
+
+
+def _ledger_totals(movements):
+    """
+    Залишок одного товару за історією: рухи (account, operation_type, quantity,
+    total_amount, total_cost) у хронологічному порядку. Собівартість списань
+    перераховується replay_fifo - тим самим FIFO, що й у rebuild_layers.
+    Повертає ({account: [кількість, вартість за FIFO, вартість за total_cost рядків]},
+    залишок кількості у відкритих партіях).
+    """
+    totals = {}
+    layers = []
+    write_offs = []
+    for account, operation_type, quantity, amount, total_cost in movements:
+        total = totals.setdefault(account, [_ZERO, _ZERO, _ZERO])
+        quantity = to_decimal(quantity)
+        if operation_type in OperationType.INCOMING:
+            amount = to_decimal(amount)
+            layers.append((quantity, amount))
+            total[0] += quantity
+            total[1] += amount
+            total[2] += amount
+        else:
+            write_offs.append((account, quantity))
+            total[0] -= quantity
+            total[2] -= to_decimal(total_cost)
+
+    taken, remaining = replay_fifo(layers, [quantity for _, quantity in write_offs])
+    for (account, _), parts in zip(write_offs, taken):
+        # Собівартість рядка округлюється до копійок, як при проведенні
+        totals[account][1] -= sum((cost for _, _, cost in parts), _ZERO).quantize(Decimal('0.01'))
+    return totals, sum(remaining, _ZERO)
+
+
+def compare_balances(session, nomenclature_ids):
+    """
+    Розбіжності між InventoryBalance і історією проведених документів для набору товарів.
+    Залишок за документами рахується по всій історії (без знімків): кількість -
+    прихід мінус розхід, вартість - сума приходів мінус собівартість списань,
+    перерахована за FIFO заново (а не взята з total_cost рядків).
+    Розбіжністю є і залишок, що не збігається з FIFO, і собівартість рядків,
+    що розійшлася з FIFO (recorded_amount), і відкриті партії товару (CostLayer),
+    кількість яких не збігається з FIFO (layers_match), і рядок залишку без рухів
+    чи рухи без рядка залишку.
+    """
+    movements = session.execute(
+        select(
+            DocumentLine.nomenclature_id,
+            DocumentLine.account,
+            Document.operation_type,
+            DocumentLine.quantity,
+            DocumentLine.total_amount,
+            DocumentLine.total_cost,
+        )
+        .join(DocumentLine.document)
+        .filter(
+            Document.is_posted == True,
+            Document.operation_type.in_(OperationType.INCOMING + OperationType.OUTGOING),
+            DocumentLine.nomenclature_id.in_(nomenclature_ids),
+        )
+        # Порядок черги - як у rebuild_layers
+        .order_by(DocumentLine.nomenclature_id, Document.document_date,
+                  Document.documents_id, DocumentLine.product_item_id)
+    ).all()
+
+    ledger = {}
+    open_quantity = {}
+    for nomenclature_id, rows in groupby(movements, key=itemgetter(0)):
+        totals, open_quantity[nomenclature_id] = _ledger_totals(row[1:] for row in rows)
+        for account, total in totals.items():
+            ledger[(nomenclature_id, account)] = total
+
+    layer_quantity = dict(session.execute(
+        select(CostLayer.nomenclature_id, func.sum(CostLayer.remaining_quantity))
+        .filter(CostLayer.nomenclature_id.in_(nomenclature_ids))
+        .group_by(CostLayer.nomenclature_id)
+    ).all())
+
+    stored = {
+        (nomenclature_id, account): (quantity, amount)
+        for nomenclature_id, account, quantity, amount in session.execute(
+            select(InventoryBalance.nomenclature_id, InventoryBalance.account,
+                   InventoryBalance.quantity, InventoryBalance.total_amount)
+            .filter(InventoryBalance.nomenclature_id.in_(nomenclature_ids))
+        )
+    }
+
+    found = []
+    for key in stored.keys() | ledger.keys():
+        ledger_quantity, ledger_amount, recorded_amount = ledger.get(key, (_ZERO, _ZERO, _ZERO))
+        stored_quantity, stored_amount = stored.get(key, (_ZERO, _ZERO))
+        layers_match = layer_quantity.get(key[0], _ZERO) == open_quantity.get(key[0], _ZERO)
+        if (ledger_quantity, ledger_amount, recorded_amount, layers_match) != \
+                (stored_quantity, stored_amount, stored_amount, True):
+            found.append((key, ledger_quantity, stored_quantity, ledger_amount, recorded_amount, stored_amount,
+                          layers_match))
+    if not found:
+        return []
+
+    names = dict(session.execute(
+        select(Nomenclature.nomenclature_id, Nomenclature.nomenclature_name)
+        .filter(Nomenclature.nomenclature_id.in_({key[0] for key, *_ in found}))
+    ).all())
+    # За товаром і рахунком (рядок без рахунку - першим)
+    found.sort(key=lambda item: (item[0][0], item[0][1] is not None, item[0][1] or ''))
+    return [
+        Discrepancy(key[0], names.get(key[0]), key[1], *values)
+        for key, *values in found
+    ]
+
+
+def _init_worker():
+    # Дочірній процес успадковує з'єднання батьківського пулу (fork): їх не можна
+    # використовувати спільно, тож пул лише забувається, не закриваючи з'єднання батька
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def _compare_shard(nomenclature_ids):
+    with app.app_context():
+        try:
+            return compare_balances(db.session, nomenclature_ids)
+        finally:
+            db.session.remove()
+
+
+class ReconciliationService:
+    """
+    Звірка залишків (InventoryBalance) з історією проведених документів.
+    Товари діляться на шарди по shard_size, шарди звіряються в пулі з workers процесів
+    (агрегація по документах - робота БД і CPU, а не очікування, тому процеси, а не потоки).
+    Виправлення (repair) виконується в основному процесі.
+    """
+
+    def __init__(self, workers=4, shard_size=500):
+        self.workers = workers
+        self.shard_size = shard_size
+
+    def shards(self, nomenclature_ids=None):
+        if nomenclature_ids is None:
+            nomenclature_ids = db.session.execute(
+                select(Nomenclature.nomenclature_id).order_by(Nomenclature.nomenclature_id)
+            ).scalars().all()
+        else:
+            nomenclature_ids = sorted(nomenclature_ids)
+        return [
+            nomenclature_ids[offset:offset + self.shard_size]
+            for offset in range(0, len(nomenclature_ids), self.shard_size)
+        ]
+
+    def find_discrepancies(self, nomenclature_ids=None):
+        """Розбіжності по всіх (або вказаних) товарах, упорядковані за ID товару."""
+        shards = self.shards(nomenclature_ids)
+        # До створення процесів з'єднання повертається в пул, щоб не було активного під час fork
+        db.session.remove()
+
+        if self.workers <= 1 or len(shards) <= 1:
+            results = [_compare_shard(shard) for shard in shards]
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker) as pool:
+                results = list(pool.map(_compare_shard, shards))
+        return [discrepancy for shard_result in results for discrepancy in shard_result]
+
+    def repair(self, discrepancies):
+        """
+        Записує в залишки значення за FIFO одним upsert на шард.
+        Якщо собівартість рядків або партії розійшлися з FIFO, партії товару перебудовуються
+        (DocumentPostingService.rebuild_layers: total_cost рядків, партії, знімки).
+        Розбіжності перераховуються під тими самими блокуваннями і в тому самому порядку,
+        що й при проведенні (рядки залишків, потім change_seq до commit): паралельне
+        проведення або вже враховане в історії, або застосує свою дельту після виправлення.
+        Повертає кількість виправлених розбіжностей.
+        """
+        nomenclature_ids = sorted({d.nomenclature_id for d in discrepancies})
+        repaired = 0
+        for shard in self.shards(nomenclature_ids):
+            posting_service = DocumentPostingService(db.session)
+            posting_service.inventory_manager.preload(shard, for_update=True)
+            lock_change_seq(db.session)
+            current = compare_balances(db.session, shard)
+
+            drifted = sorted({
+                d.nomenclature_id for d in current
+                if d.recorded_amount != d.ledger_amount or not d.layers_match
+            })
+            if drifted:
+                # Дельти залишків від перебудови не застосовуються: нижче записуються значення за FIFO
+                posting_service.rebuild_layers(drifted)
+
+            balances = [d for d in current if (d.stored_quantity, d.stored_amount) != (d.ledger_quantity, d.ledger_amount)]
+            if balances:
+                now = datetime.now()
+                stmt = pg_insert(InventoryBalance).values([
+                    {
+                        'nomenclature_id': d.nomenclature_id,
+                        'account': d.account,
+                        'quantity': d.ledger_quantity,
+                        'total_amount': d.ledger_amount,
+                        'last_updated': now,
+                    }
+                    for d in balances
+                ])
+                db.session.execute(stmt.on_conflict_do_update(
+                    constraint='uix_nomenclature_account',
+                    set_={
+                        'quantity': stmt.excluded.quantity,
+                        'total_amount': stmt.excluded.total_amount,
+                        'last_updated': stmt.excluded.last_updated,
+                        'change_seq': next_change_seq(),
+                    }
+                ))
+            repaired += len(current)
+            posting_service.commit_changes()
+        return repaired
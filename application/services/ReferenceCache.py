@@ -0,0 +1,120 @@
+# application/services/ReferenceCache.py
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import event, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from application.models import Counterparty, Nomenclature, ChangeCounter
+from config import Config
+
+
+CounterpartyRef = namedtuple('CounterpartyRef', ['counterparty_id', 'counterparty_name'])
+NomenclatureRef = namedtuple('NomenclatureRef', ['nomenclature_id', 'nomenclature_name'])
+
+# Готові дані довідника: впорядкований список та choices для SelectField
+ReferenceData = namedtuple('ReferenceData', ['version', 'items', 'choices'])
+
+
+def bump_version(connection, *names):
+    """Збільшує версії довідників у поточній транзакції."""
+    for name in names:
+        stmt = pg_insert(ChangeCounter).values(name=name, version=1)
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=['name'],
+            set_={'version': ChangeCounter.version + 1}
+        ))
+
+
+class ReferenceDataCache:
+    """
+    Кеш довідників (контрагенти, номенклатура) в пам'яті процесу.
+    Актуальність перевіряється за версією в change_counters не частіше,
+    ніж раз на check_interval секунд, тож форми документів не читають
+    довідники з БД на кожен запит.
+    """
+    LOADERS = {
+        'counterparty': (
+            lambda session: [
+                CounterpartyRef(*row) for row in session.execute(
+                    select(Counterparty.counterparty_id, Counterparty.counterparty_name)
+                    .order_by(Counterparty.counterparty_name)
+                )
+            ],
+            lambda items: [('', 'Оберіть контрагента')] + [
+                (str(item.counterparty_id), item.counterparty_name) for item in items
+            ],
+        ),
+        'nomenclature': (
+            lambda session: [
+                NomenclatureRef(*row) for row in session.execute(
+                    select(Nomenclature.nomenclature_id, Nomenclature.nomenclature_name)
+                    .order_by(Nomenclature.nomenclature_name)
+                )
+            ],
+            lambda items: [('', 'Оберіть номенклатуру')] + [
+                (str(item.nomenclature_id), item.nomenclature_name) for item in items
+            ],
+        ),
+    }
+
+    def __init__(self, check_interval=2.0):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._checked_at = {}
+
+    def counterparties(self, session) -> ReferenceData:
+        return self._get(session, 'counterparty')
+
+    def nomenclatures(self, session) -> ReferenceData:
+        return self._get(session, 'nomenclature')
+
+    def invalidate(self, *names):
+        """Змушує наступне звернення перевірити версію в БД."""
+        with self._lock:
+            for name in names or self.LOADERS:
+                self._checked_at.pop(name, None)
+
+    def _get(self, session, name) -> ReferenceData:
+        now = time.monotonic()
+        entry = self._entries.get(name)
+        if entry is not None and now - self._checked_at.get(name, 0) < self.check_interval:
+            return entry
+
+        # Версію читаємо ДО даних: зміна між двома запитами дасть лише зайве перезавантаження
+        version = session.execute(
+            select(ChangeCounter.version).filter_by(name=name)
+        ).scalar() or 0
+
+        if entry is None or entry.version != version:
+            load_items, build_choices = self.LOADERS[name]
+            items = load_items(session)
+            entry = ReferenceData(version, items, build_choices(items))
+
+        with self._lock:
+            self._entries[name] = entry
+            self._checked_at[name] = now
+        return entry
+
+
+reference_cache = ReferenceDataCache(check_interval=Config.REFERENCE_CACHE_CHECK_SECONDS)
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_reference_versions(session, flush_context):
+    """Зміна контрагентів чи номенклатури через ORM збільшує версію довідника."""
+    changed = set()
+    # Зміна лише колекцій (наприклад, Nomenclature.document_lines) довідник не змінює
+    dirty = [obj for obj in session.dirty if session.is_modified(obj, include_collections=False)]
+    for obj in list(session.new) + dirty + list(session.deleted):
+        if isinstance(obj, Counterparty):
+            changed.add('counterparty')
+        elif isinstance(obj, Nomenclature):
+            changed.add('nomenclature')
+
+    if changed:
+        bump_version(session.connection(), *sorted(changed))
+        reference_cache.invalidate(*changed)
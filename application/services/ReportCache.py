@@ -0,0 +1,187 @@
+# application/services/ReportCache.py
+import threading
+from collections import OrderedDict, deque, namedtuple
+from datetime import date, datetime
+
+from sqlalchemy import insert, select, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from application.models import ChangeCounter, PostingEvent
+from config import Config
+
+
+# Лічильник у change_counters, з якого видаються event_id (водяний знак проведень)
+POSTINGS_COUNTER = 'postings'
+
+CachedReport = namedtuple('CachedReport', ['watermark', 'date_from', 'date_to', 'rows', 'total_sum'])
+
+
+def record_posting_events(session, date_ranges):
+    """
+    Записує зміни проведених даних [(date_from, date_to), ...] у поточній транзакції.
+    Рядок лічильника блокується до commit, тож викликати безпосередньо перед commit.
+    """
+    date_ranges = list(dict.fromkeys(date_ranges))
+    if not date_ranges:
+        return None
+
+    count = len(date_ranges)
+    stmt = pg_insert(ChangeCounter).values(name=POSTINGS_COUNTER, version=count)
+    last_id = session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=['name'],
+            set_={'version': ChangeCounter.version + count}
+        ).returning(ChangeCounter.version)
+    ).scalar_one()
+
+    now = datetime.now()
+    session.execute(insert(PostingEvent), [
+        {'event_id': last_id - count + index + 1, 'date_from': date_from, 'date_to': date_to, 'created_at': now}
+        for index, (date_from, date_to) in enumerate(date_ranges)
+    ])
+    return last_id
+
+
+def current_watermark(session):
+    return session.execute(
+        select(ChangeCounter.version).filter_by(name=POSTINGS_COUNTER)
+    ).scalar() or 0
+
+
+def report_range(params):
+    """
+    Діапазон дат, від яких залежить результат звіту: (date_from, date_to).
+    Залишки (на дату і їх динаміка) накопичувальні - залежать від усієї історії до дати.
+    """
+    date_to = date.fromisoformat(params['end_date'])
+    if params['report_type'] in ('inventory_date', 'inventory_series'):
+        return None, date_to
+    return date.fromisoformat(params['start_date']), date_to
+
+
+def ranges_overlap(event_from, event_to, date_from, date_to):
+    """Перетин діапазонів дат (None - відкрита межа)."""
+    return (event_from is None or date_to is None or event_from <= date_to) and \
+        (event_to is None or date_from is None or event_to >= date_from)
+
+
+def overlapping_events(date_from, date_to):
+    """Умова SQL: подія проведення перетинається з діапазоном [date_from, date_to]."""
+    conditions = []
+    if date_to is not None:
+        conditions.append(or_(PostingEvent.date_from.is_(None), PostingEvent.date_from <= date_to))
+    if date_from is not None:
+        conditions.append(or_(PostingEvent.date_to.is_(None), PostingEvent.date_to >= date_from))
+    return conditions
+
+
+class ReportResultCache:
+    """
+    Кеш результатів звітів у пам'яті процесу (воркера звітів).
+    Кожен запис позначений водяним знаком проведень, на якому його сформовано.
+    Перед зверненням кеш дочитує нові події проведень (posting_events) і видаляє
+    лише записи, діапазон дат яких перетинається з ними. Розмір обмежений
+    кількістю записів і сумарною кількістю рядків (витісняються давно не використані).
+    """
+    # Скільки останніх подій пам'ятати для перевірки результатів, сформованих паралельно з синхронізацією
+    RECENT_EVENTS = 1000
+
+    def __init__(self, max_entries=128, max_rows=200000):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._rows = 0
+        self._watermark = None
+        self._recent_events = deque(maxlen=self.RECENT_EVENTS)
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, session, key, params, compute):
+        """
+        Результат звіту з кешу або compute(session, params) -> (рядки, сума).
+        Повертає (рядки, сума, водяний знак).
+        """
+        # Водяний знак читаємо ДО даних: зміна між запитами дасть лише зайву інвалідацію
+        watermark = self._sync(session)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.rows, entry.total_sum, entry.watermark
+            self.misses += 1
+
+        rows, total_sum = compute(session, params)
+        date_from, date_to = report_range(params)
+        self._store(key, CachedReport(watermark, date_from, date_to, rows, total_sum))
+        return rows, total_sum, watermark
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._rows = 0
+
+    def _sync(self, session):
+        current = current_watermark(session)
+        with self._lock:
+            known = self._watermark
+        if known is not None and current <= known:
+            return current
+
+        events = []
+        if known is not None:
+            events = session.execute(
+                select(PostingEvent.event_id, PostingEvent.date_from, PostingEvent.date_to)
+                .filter(PostingEvent.event_id > known, PostingEvent.event_id <= current)
+                .order_by(PostingEvent.event_id)
+            ).all()
+
+        with self._lock:
+            if self._watermark is not None and current <= self._watermark:
+                return current
+            if known is None or len(events) != current - known:
+                # Перший запуск або події вже видалено (purge): перевірити нічого, кеш скидається
+                self._entries.clear()
+                self._rows = 0
+                self._recent_events.clear()
+            else:
+                self._recent_events.extend(events)
+                for entry_key, entry in list(self._entries.items()):
+                    if any(ranges_overlap(e.date_from, e.date_to, entry.date_from, entry.date_to) for e in events):
+                        self._evict(entry_key)
+            self._watermark = current
+        return current
+
+    def _store(self, key, entry):
+        size = len(entry.rows)
+        if size > self.max_rows:
+            return
+        with self._lock:
+            if self._watermark is None or entry.watermark < self._watermark:
+                # Поки звіт формувався, кеш уже врахував новіші події: перевіряємо їх для цього запису
+                newer = [e for e in self._recent_events if e.event_id > entry.watermark]
+                covered = self._watermark is not None and \
+                    len(newer) == self._watermark - entry.watermark
+                if not covered or any(
+                    ranges_overlap(e.date_from, e.date_to, entry.date_from, entry.date_to) for e in newer
+                ):
+                    return
+                entry = entry._replace(watermark=self._watermark)
+
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = entry
+            self._rows += size
+            while len(self._entries) > self.max_entries or self._rows > self.max_rows:
+                self._evict(next(iter(self._entries)))
+
+    def _evict(self, key):
+        entry = self._entries.pop(key)
+        self._rows -= len(entry.rows)
+
+
+report_cache = ReportResultCache(
+    max_entries=Config.REPORT_CACHE_MAX_ENTRIES,
+    max_rows=Config.REPORT_CACHE_MAX_ROWS,
+)
@@ -0,0 +1,312 @@
+# application/services/ReportJobService.py
+import hashlib
+import json
+import uuid
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import select, update, delete, func, exists, or_, and_
+
+from application.models import ReportJob, PostingEvent
+from application.services.ReportServices import ReportService, SERIES_STEPS, series_period_start
+from application.services.ReportCache import report_cache, report_range, overlapping_events
+from config import Config
+
+
+REPORT_TYPES = ('sales', 'inventory_date', 'inventory_series')
+SALES_GROUPINGS = ('lines', 'day', 'counterparty', 'nomenclature')
+# Найбільша кількість точок сітки динаміки залишків (приблизно три роки по днях)
+SERIES_MAX_POINTS = 1100
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+def make_params(report_type, start_date, end_date, group_by='lines', counterparty_id=None, nomenclature_id=None,
+                step='day'):
+    """
+    Канонічні параметри звіту (JSON-сумісні). Поля, що не впливають
+    на результат, відкидаються, щоб однакові запити мали однаковий ключ.
+    """
+    if report_type not in REPORT_TYPES:
+        raise ValueError(f'Невідомий тип звіту: {report_type}')
+    if start_date > end_date:
+        raise ValueError('Дата початку пізніша за дату кінця.')
+
+    if report_type == 'inventory_date':
+        # Залишки залежать лише від кінцевої дати
+        return {'report_type': report_type, 'start_date': start_date.isoformat(), 'end_date': end_date.isoformat()}
+
+    if report_type == 'inventory_series':
+        if step not in SERIES_STEPS:
+            raise ValueError(f'Невідомий крок: {step}')
+        if step == 'day':
+            points = (end_date - start_date).days + 1
+        elif step == 'week':
+            points = (series_period_start(end_date, step) - series_period_start(start_date, step)).days // 7 + 1
+        else:
+            points = (end_date.year - start_date.year) * 12 + end_date.month - start_date.month + 1
+        if points > SERIES_MAX_POINTS:
+            raise ValueError(f'Забагато точок динаміки ({points}), максимум {SERIES_MAX_POINTS}: збільште крок.')
+        params = {
+            'report_type': report_type,
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'step': step,
+        }
+        if nomenclature_id:
+            params['nomenclature_id'] = nomenclature_id
+        return params
+
+    if group_by not in SALES_GROUPINGS:
+        raise ValueError(f'Невідоме групування: {group_by}')
+    params = {
+        'report_type': report_type,
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'group_by': group_by,
+    }
+    # Фільтри деталізації діють лише для рядкового режиму
+    if group_by == 'lines':
+        if counterparty_id:
+            params['counterparty_id'] = counterparty_id
+        if nomenclature_id:
+            params['nomenclature_id'] = nomenclature_id
+    return params
+
+
+def params_key(params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def report_query(session, params):
+    """Запит звіту за параметрами (для формування результату та потокового експорту)."""
+    report_service = ReportService(session)
+    start_date = datetime.combine(date.fromisoformat(params['start_date']), datetime.min.time())
+    end_date = datetime.combine(date.fromisoformat(params['end_date']), datetime.max.time())
+
+    if params['report_type'] == 'sales':
+        if params['group_by'] == 'lines':
+            return report_service.sales_report_query(
+                start_date, end_date,
+                counterparty_id=params.get('counterparty_id'),
+                nomenclature_id=params.get('nomenclature_id')
+            )
+        return report_service.sales_summary_query(start_date, end_date, params['group_by'])
+
+    if params['report_type'] == 'inventory_series':
+        return report_service.inventory_series_query(
+            start_date.date(), end_date.date(), params['step'], nomenclature_id=params.get('nomenclature_id')
+        )
+
+    return report_service.inventory_on_date_query(end_date)
+
+
+def run_report(session, params):
+    """Формує звіт за параметрами. Повертає (рядки, загальна сума)."""
+    rows = session.execute(report_query(session, params)).all()
+    if params['report_type'] == 'sales':
+        return rows, sum(row.total_amount for row in rows)
+    if params['report_type'] == 'inventory_series':
+        # Вартість залишків на кінець останнього періоду
+        last_period = max((row.period_start for row in rows), default=None)
+        return rows, sum(row.balance_sum for row in rows if row.period_start == last_period)
+    return rows, sum(row.balance_sum for row in rows)
+
+
+def _value_type(value):
+    if isinstance(value, datetime):
+        return 'datetime'
+    if isinstance(value, date):
+        return 'date'
+    if isinstance(value, Decimal):
+        return 'decimal'
+    return 'json'
+
+
+_ENCODERS = {
+    'datetime': lambda value: value.isoformat(),
+    'date': lambda value: value.isoformat(),
+    'decimal': str,
+    'json': lambda value: value,
+}
+_DECODERS = {
+    'datetime': datetime.fromisoformat,
+    'date': date.fromisoformat,
+    'decimal': Decimal,
+    'json': lambda value: value,
+}
+
+
+def encode_result(rows, total_sum):
+    """Рядки звіту -> JSON: назви колонок, їх типи (для відновлення дат і Decimal) та значення."""
+    columns = list(rows[0]._fields) if rows else []
+    types = []
+    for index in range(len(columns)):
+        sample = next((row[index] for row in rows if row[index] is not None), None)
+        types.append(_value_type(sample))
+
+    return {
+        'columns': columns,
+        'types': types,
+        'rows': [
+            [None if value is None else _ENCODERS[kind](value) for value, kind in zip(row, types)]
+            for row in rows
+        ],
+        'total_sum': str(total_sum),
+    }
+
+
+def decode_result(result):
+    """Збережений результат -> (рядки з доступом за атрибутами, як у Row, загальна сума)."""
+    row_type = namedtuple('ReportRow', result['columns'])
+    rows = [
+        row_type(*(None if value is None else _DECODERS[kind](value) for value, kind in zip(row, result['types'])))
+        for row in result['rows']
+    ]
+    return rows, Decimal(result['total_sum'])
+
+
+class ReportJobService:
+    """
+    Черга звітів у БД. Веб-запит лише ставить завдання (submit),
+    воркер (flask reports worker) забирає його через FOR UPDATE SKIP LOCKED,
+    тож кілька воркерів не беруть одне й те саме завдання.
+    Готові результати зберігаються REPORT_JOB_RETENTION_HOURS і повторно
+    використовуються для однакових параметрів, доки після їх водяного знака
+    не з'явилось проведення, що перетинається з датами звіту.
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    def submit(self, params):
+        """Повертає наявне завдання з тими самими параметрами (в черзі, в роботі, актуальне готове) або створює нове."""
+        key = params_key(params)
+        # Готовий результат актуальний, якщо після нього не проводились документи в його діапазоні дат
+        changed_since = exists().where(
+            PostingEvent.event_id > ReportJob.watermark,
+            *overlapping_events(*report_range(params))
+        )
+        reusable = self.session.execute(
+            select(ReportJob)
+            .filter(
+                ReportJob.params_key == key,
+                or_(
+                    ReportJob.status.in_((JOB_QUEUED, JOB_RUNNING)),
+                    and_(ReportJob.status == JOB_DONE, ReportJob.watermark.is_not(None), ~changed_since),
+                ),
+            )
+            .order_by(ReportJob.created_at.desc())
+            .limit(1)
+        ).scalar_one_or_none()
+        if reusable is not None:
+            return reusable
+
+        job = ReportJob(
+            job_id=str(uuid.uuid4()),
+            report_type=params['report_type'],
+            params=params,
+            params_key=key,
+            status=JOB_QUEUED,
+            attempts=0,
+            created_at=datetime.now(),
+        )
+        self.session.add(job)
+        self.session.flush()
+        return job
+
+    def get(self, job_id):
+        return self.session.get(ReportJob, job_id)
+
+    def claim_next(self):
+        """Забирає найстаріше завдання з черги (або None) і фіксує статус running."""
+        job = self.session.execute(
+            select(ReportJob)
+            .filter(ReportJob.status == JOB_QUEUED)
+            .order_by(ReportJob.created_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).scalar_one_or_none()
+        if job is None:
+            self.session.rollback()
+            return None
+
+        job.status = JOB_RUNNING
+        job.started_at = datetime.now()
+        job.attempts += 1
+        self.session.commit()
+        return job
+
+    def run(self, job):
+        """Формує звіт завдання і зберігає результат або помилку."""
+        try:
+            rows, total_sum, watermark = report_cache.get_or_compute(
+                self.session, job.params_key, job.params, run_report
+            )
+            result = encode_result(rows, total_sum)
+        except Exception as e:
+            self.session.rollback()
+            job.status = JOB_FAILED
+            job.error = str(e)
+        else:
+            job.status = JOB_DONE
+            job.result = result
+            job.watermark = watermark
+            job.error = None
+        job.finished_at = datetime.now()
+        self.session.commit()
+
+    def run_next(self):
+        """Виконує одне завдання з черги. Повертає його або None, якщо черга порожня."""
+        job = self.claim_next()
+        if job is not None:
+            self.run(job)
+        return job
+
+    def requeue_stale(self):
+        """
+        Завдання, що "зависли" в running (воркер упав), повертаються в чергу,
+        а після REPORT_JOB_MAX_ATTEMPTS спроб позначаються як помилкові.
+        """
+        stale_before = datetime.now() - timedelta(seconds=Config.REPORT_JOB_TIMEOUT_SECONDS)
+        stale = and_(ReportJob.status == JOB_RUNNING, ReportJob.started_at < stale_before)
+
+        failed = self.session.execute(
+            update(ReportJob)
+            .filter(stale, ReportJob.attempts >= Config.REPORT_JOB_MAX_ATTEMPTS)
+            .values(status=JOB_FAILED, error='Перевищено час виконання.', finished_at=datetime.now())
+        ).rowcount
+        requeued = self.session.execute(
+            update(ReportJob)
+            .filter(stale)
+            .values(status=JOB_QUEUED, started_at=None)
+        ).rowcount
+        self.session.commit()
+        return requeued, failed
+
+    def purge_expired(self):
+        """
+        Видаляє завершені завдання, старші за REPORT_JOB_RETENTION_HOURS, і старі події
+        проведень, які вже не потрібні для перевірки жодного збереженого результату.
+        Повертає кількість видалених завдань.
+        """
+        cutoff = datetime.now() - timedelta(hours=Config.REPORT_JOB_RETENTION_HOURS)
+        deleted = self.session.execute(
+            delete(ReportJob)
+            .filter(ReportJob.status.in_((JOB_DONE, JOB_FAILED)), ReportJob.finished_at < cutoff)
+        ).rowcount
+
+        oldest_watermark = self.session.execute(
+            select(func.min(ReportJob.watermark)).filter(ReportJob.status == JOB_DONE)
+        ).scalar()
+        events = delete(PostingEvent).filter(PostingEvent.created_at < cutoff)
+        if oldest_watermark is not None:
+            events = events.filter(PostingEvent.event_id <= oldest_watermark)
+        self.session.execute(events)
+
+        self.session.commit()
+        return deleted
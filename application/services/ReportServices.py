@@ -1,13 +1,37 @@
-from sqlalchemy import func, case, select, literal_column
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import func, select, literal_column, union, cast, true, Date
 from application import db
-from application.models import Document, DocumentLine, Counterparty, Nomenclature
+from application.models import Document, DocumentLine, Counterparty, Nomenclature, SalesDaily
+from application.services.SnapshotService import SnapshotService, movement_quantity, movement_amount
+from application.services.SalesRollupService import SALES_OPERATION_TYPE
+
+
+# Крок сітки для динаміки залишків (одиниця date_trunc / interval)
+SERIES_STEPS = ('day', 'week', 'month')
+
+
+def series_period_start(value, step):
+    """Початок періоду сітки, що містить дату value (тиждень - з понеділка, як date_trunc)."""
+    if step == 'week':
+        return value - timedelta(days=value.weekday())
+    if step == 'month':
+        return value.replace(day=1)
+    return value
+
 
 class ReportService:
     def __init__(self, session):
         self.session = session
 
-    def get_sales_report(self, start_date, end_date):
-        """Звіт про продажі: показує виручку."""
+    def get_sales_report(self, start_date, end_date, counterparty_id=None, nomenclature_id=None):
+        """Звіт про продажі: показує виручку (деталізація по рядках)."""
+        return self.session.execute(
+            self.sales_report_query(start_date, end_date, counterparty_id, nomenclature_id)
+        ).all()
+
+    def sales_report_query(self, start_date, end_date, counterparty_id=None, nomenclature_id=None):
+        """Запит детального звіту про продажі (для get_sales_report та потокового експорту)."""
         query = select(
             Document.document_date,
             Document.documents_id,
@@ -20,46 +44,148 @@ class ReportService:
          .join(Document.counterparty)\
          .filter(
             Document.is_posted == True,
-            Document.operation_type == 'Видаткова накладна',
+            Document.operation_type == SALES_OPERATION_TYPE,
             Document.document_date.between(start_date, end_date)
         ).order_by(Document.document_date)
 
-        return self.session.execute(query).all()
+        # Фільтри для деталізації рядка зведеного звіту
+        if counterparty_id:
+            query = query.filter(Document.counterparty_id == counterparty_id)
+        if nomenclature_id:
+            query = query.filter(DocumentLine.nomenclature_id == nomenclature_id)
+
+        return query
+
+    def get_sales_summary(self, start_date, end_date, group_by):
+        """
+        Зведений звіт про продажі: читає лише денний підсумок SalesDaily.
+        group_by: 'day' | 'counterparty' | 'nomenclature'.
+        Рядки мають поля key (для деталізації), label, quantity, total_amount, lines_count.
+        """
+        return self.session.execute(self.sales_summary_query(start_date, end_date, group_by)).all()
+
+    def sales_summary_query(self, start_date, end_date, group_by):
+        totals = (
+            func.sum(SalesDaily.quantity).label('quantity'),
+            func.sum(SalesDaily.total_amount).label('total_amount'),
+            func.sum(SalesDaily.lines_count).label('lines_count'),
+        )
+
+        if group_by == 'day':
+            key, label = SalesDaily.sale_date, SalesDaily.sale_date
+        elif group_by == 'counterparty':
+            key, label = Counterparty.counterparty_id, Counterparty.counterparty_name
+        elif group_by == 'nomenclature':
+            key, label = Nomenclature.nomenclature_id, Nomenclature.nomenclature_name
+        else:
+            raise ValueError(f'Невідоме групування: {group_by}')
+
+        # Як і детальний звіт, враховуємо лише продажі з контрагентом
+        query = select(key.label('key'), label.label('label'), *totals)\
+            .select_from(SalesDaily)\
+            .join(Counterparty, Counterparty.counterparty_id == SalesDaily.counterparty_id)
+        if group_by == 'nomenclature':
+            query = query.join(Nomenclature, Nomenclature.nomenclature_id == SalesDaily.nomenclature_id)
+
+        query = query.filter(
+            SalesDaily.sale_date.between(start_date.date(), end_date.date())
+        ).group_by(key, label).order_by(label)
+
+        return query
 
     def get_inventory_on_date(self, target_date):
         """
         Залишки на дату (Розрахунковий метод).
-        УВАГА: Для коректної суми треба використовувати собівартість (total_cost) для списань.
+        Стартує з найближчого попереднього знімка періоду (SnapshotService)
+        і додає лише рухи, проведені після нього. Для списань сума береться
+        за собівартістю (total_cost).
         """
-        INCOMING = ['Purchase', 'Incoming', 'Прибуткова накладна']
-        OUTGOING = ['Sale', 'Outgoing', 'Видаткова накладна']
+        return self.session.execute(self.inventory_on_date_query(target_date)).all()
 
-        
-        outgoing_cost_column = DocumentLine.total_cost if hasattr(DocumentLine, 'total_cost') else DocumentLine.total_amount
+    def inventory_on_date_query(self, target_date):
+        balances = SnapshotService(self.session).balances_query(target_date).subquery()
+        balance_qty = func.sum(balances.c.quantity)
 
-        query = select(
+        return select(
             Nomenclature.nomenclature_name,
-            #  Сальдо кількості (Прихід - Розхід)
-            func.sum(case(
-                (Document.operation_type.in_(INCOMING), DocumentLine.quantity),
-                (Document.operation_type.in_(OUTGOING), -DocumentLine.quantity),
-                else_=0
-            )).label('balance_qty'),
-            
-            # Сальдо вартості (Прихідна вартість - Собівартість списання)
-            func.sum(case(
-                (Document.operation_type.in_(INCOMING), DocumentLine.total_amount), 
-                (Document.operation_type.in_(OUTGOING), -outgoing_cost_column), 
-                else_=0
-            )).label('balance_sum')
+            balance_qty.label('balance_qty'),
+            func.sum(balances.c.total_amount).label('balance_sum')
+        ).join(balances, balances.c.nomenclature_id == Nomenclature.nomenclature_id)\
+         .group_by(Nomenclature.nomenclature_id, Nomenclature.nomenclature_name)\
+         .having(balance_qty != 0)  # Фільтруємо нульові залишки
+
+    def get_inventory_series(self, start_date, end_date, step, nomenclature_id=None):
+        """Динаміка залишків: рядки (period_start, period_end, товар, balance_qty, balance_sum)."""
+        return self.session.execute(self.inventory_series_query(start_date, end_date, step, nomenclature_id)).all()
+
+    def inventory_series_query(self, start_date, end_date, step, nomenclature_id=None):
+        """
+        Залишки кожного товару на кінець кожного періоду сітки (day | week | month)
+        від start_date до end_date (date) одним запитом: залишок на початок першого
+        періоду (знімок + рухи після нього, як у залишках на дату) плюс наростаючий
+        підсумок рухів по періодах (віконна функція), замість окремого запиту на кожну дату.
+        """
+        if step not in SERIES_STEPS:
+            raise ValueError(f'Невідомий крок: {step}')
+
+        first_start = series_period_start(start_date, step)
+        opening_bound = datetime.combine(first_start - timedelta(days=1), time.max)
+        end_bound = datetime.combine(end_date, time.max)
+        step_interval = literal_column(f"interval '1 {step}'")
+
+        grid = select(
+            cast(func.generate_series(first_start, series_period_start(end_date, step), step_interval), Date)
+            .label('period_start')
+        ).subquery('grid')
+
+        balances = SnapshotService(self.session).balances_query(opening_bound).subquery()
+        opening = select(
+            balances.c.nomenclature_id,
+            func.sum(balances.c.quantity).label('quantity'),
+            func.sum(balances.c.total_amount).label('total_amount'),
+        ).group_by(balances.c.nomenclature_id)\
+         .having((func.sum(balances.c.quantity) != 0) | (func.sum(balances.c.total_amount) != 0))
+
+        bucket = cast(func.date_trunc(step, Document.document_date), Date)
+        movements = select(
+            DocumentLine.nomenclature_id,
+            bucket.label('period_start'),
+            func.sum(movement_quantity).label('quantity'),
+            func.sum(movement_amount).label('total_amount'),
         ).join(DocumentLine.document)\
-         .join(DocumentLine.nomenclature)\
          .filter(
             Document.is_posted == True,
-            Document.document_date <= target_date
-        ).group_by(Nomenclature.nomenclature_id, Nomenclature.nomenclature_name)
+            Document.document_date > opening_bound,
+            Document.document_date <= end_bound
+        ).group_by(DocumentLine.nomenclature_id, bucket)
 
-        results = self.session.execute(query).all()
-        
-        # Фільтруємо нульові залишки 
-        return [r for r in results if r.balance_qty != 0]
\ No newline at end of file
+        if nomenclature_id:
+            opening = opening.filter(balances.c.nomenclature_id == nomenclature_id)
+            movements = movements.filter(DocumentLine.nomenclature_id == nomenclature_id)
+        opening = opening.subquery('opening')
+        movements = movements.subquery('movements')
+
+        # Товари із залишком на початок або з рухами в межах сітки
+        items = union(
+            select(opening.c.nomenclature_id),
+            select(movements.c.nomenclature_id)
+        ).subquery('items')
+
+        window = {'partition_by': items.c.nomenclature_id, 'order_by': grid.c.period_start}
+        return select(
+            grid.c.period_start,
+            func.least(cast(grid.c.period_start + step_interval - literal_column("interval '1 day'"), Date),
+                       end_date).label('period_end'),
+            Nomenclature.nomenclature_id,
+            Nomenclature.nomenclature_name,
+            (func.coalesce(opening.c.quantity, 0) +
+             func.sum(func.coalesce(movements.c.quantity, 0)).over(**window)).label('balance_qty'),
+            (func.coalesce(opening.c.total_amount, 0) +
+             func.sum(func.coalesce(movements.c.total_amount, 0)).over(**window)).label('balance_sum'),
+        ).select_from(grid)\
+         .join(items, true())\
+         .join(Nomenclature, Nomenclature.nomenclature_id == items.c.nomenclature_id)\
+         .outerjoin(opening, opening.c.nomenclature_id == items.c.nomenclature_id)\
+         .outerjoin(movements, (movements.c.nomenclature_id == items.c.nomenclature_id) &
+                               (movements.c.period_start == grid.c.period_start))\
+         .order_by(Nomenclature.nomenclature_name, Nomenclature.nomenclature_id, grid.c.period_start)
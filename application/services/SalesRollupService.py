@@ -0,0 +1,93 @@
+# application/services/SalesRollupService.py
+from decimal import Decimal
+
+from sqlalchemy import select, delete, func, cast, Date
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from application.models import Document, DocumentLine, SalesDaily
+
+
+# Тип документа, який вважається продажем у звіті про продажі
+SALES_OPERATION_TYPE = 'Видаткова накладна'
+
+
+class SalesRollupService:
+    """
+    Підтримує денний підсумок продажів (SalesDaily) для зведених режимів звіту.
+    Проведення видаткової накладної додає її рядки одним upsert.
+    """
+    def __init__(self, session):
+        self.session = session
+
+    def apply_document(self, document: Document, sign: int = 1):
+        """Додає (sign=1) або віднімає (sign=-1) рядки проведеного продажу з підсумку."""
+        if document.operation_type != SALES_OPERATION_TYPE or document.document_date is None:
+            return
+
+        totals = {}
+        for line in document.lines:
+            total = totals.setdefault(line.nomenclature_id, [Decimal(0), Decimal(0), 0])
+            total[0] += sign * Decimal(line.quantity or 0)
+            total[1] += sign * Decimal(line.total_amount or 0)
+            total[2] += sign
+        if not totals:
+            return
+
+        stmt = pg_insert(SalesDaily).values([
+            {
+                'sale_date': document.document_date.date(),
+                'counterparty_id': document.counterparty_id,
+                'nomenclature_id': nomenclature_id,
+                'quantity': quantity,
+                'total_amount': amount,
+                'lines_count': lines_count,
+            }
+            for nomenclature_id, (quantity, amount, lines_count) in totals.items()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            constraint='uix_sales_daily_key',
+            set_={
+                'quantity': SalesDaily.quantity + stmt.excluded.quantity,
+                'total_amount': SalesDaily.total_amount + stmt.excluded.total_amount,
+                'lines_count': SalesDaily.lines_count + stmt.excluded.lines_count,
+            }
+        )
+        self.session.execute(stmt)
+
+    def rebuild(self, date_from=None, date_to=None) -> int:
+        """Перераховує підсумок з рядків проведених продажів (date_from/date_to - дати, включно)."""
+        sale_date = cast(Document.document_date, Date)
+
+        cleanup = delete(SalesDaily)
+        if date_from is not None:
+            cleanup = cleanup.filter(SalesDaily.sale_date >= date_from)
+        if date_to is not None:
+            cleanup = cleanup.filter(SalesDaily.sale_date <= date_to)
+        self.session.execute(cleanup)
+
+        source = select(
+            sale_date,
+            Document.counterparty_id,
+            DocumentLine.nomenclature_id,
+            func.coalesce(func.sum(DocumentLine.quantity), 0),
+            func.coalesce(func.sum(DocumentLine.total_amount), 0),
+            func.count(),
+        ).join(DocumentLine.document).filter(
+            Document.is_posted == True,
+            Document.operation_type == SALES_OPERATION_TYPE,
+            # Як і apply_document: продаж без дати до підсумку не входить
+            Document.document_date.isnot(None)
+        )
+        if date_from is not None:
+            source = source.filter(sale_date >= date_from)
+        if date_to is not None:
+            source = source.filter(sale_date <= date_to)
+        source = source.group_by(sale_date, Document.counterparty_id, DocumentLine.nomenclature_id)
+
+        result = self.session.execute(
+            pg_insert(SalesDaily).from_select(
+                ['sale_date', 'counterparty_id', 'nomenclature_id', 'quantity', 'total_amount', 'lines_count'],
+                source
+            )
+        )
+        return result.rowcount
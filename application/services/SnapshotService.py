@@ -0,0 +1,248 @@
+# application/services/SnapshotService.py
+from bisect import bisect_left
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from sqlalchemy import select, delete, func, case, union_all, values, column, String, Numeric, literal, true
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from application.models import Document, DocumentLine, InventorySnapshot, InventorySnapshotPeriod
+from application.services.operations import OperationType, to_decimal
+
+
+# Рух одного рядка проведеного документа: прихід додає кількість і суму,
+# розхід віднімає кількість і собівартість списання (total_cost).
+movement_quantity = case(
+    (Document.operation_type.in_(OperationType.INCOMING), DocumentLine.quantity),
+    (Document.operation_type.in_(OperationType.OUTGOING), -DocumentLine.quantity),
+    else_=0
+)
+movement_amount = case(
+    (Document.operation_type.in_(OperationType.INCOMING), DocumentLine.total_amount),
+    (Document.operation_type.in_(OperationType.OUTGOING), -DocumentLine.total_cost),
+    else_=0
+)
+
+
+def period_upper_bound(period_end: date) -> datetime:
+    """Знімок на period_end включає всі документи до кінця цього дня."""
+    return datetime.combine(period_end, time.max)
+
+
+class SnapshotService:
+    """
+    Знімки залишків на кінець періоду (зазвичай місяця).
+    Звіт "залишки на дату" стартує з найближчого попереднього знімка
+    і додає лише рухи, проведені після нього.
+    """
+    def __init__(self, session):
+        self.session = session
+        self._max_period = None
+        self._max_period_loaded = False
+
+    def latest_period_for(self, target_date):
+        """Останній знімок, який повністю покривається target_date (datetime або date)."""
+        if isinstance(target_date, datetime):
+            limit = target_date.date()
+            if target_date.time() != time.max:
+                limit -= timedelta(days=1)
+        else:
+            limit = target_date
+
+        return self.session.execute(
+            select(func.max(InventorySnapshotPeriod.period_end))
+            .filter(InventorySnapshotPeriod.period_end <= limit)
+        ).scalar()
+
+    def movements_query(self, date_from=None, date_to=None):
+        """Рухи проведених документів у (date_from, date_to], згруповані по товару та рахунку."""
+        query = select(
+            DocumentLine.nomenclature_id,
+            DocumentLine.account,
+            func.sum(movement_quantity).label('quantity'),
+            func.sum(movement_amount).label('total_amount'),
+        ).join(DocumentLine.document).filter(Document.is_posted == True)
+
+        if date_from is not None:
+            query = query.filter(Document.document_date > date_from)
+        if date_to is not None:
+            query = query.filter(Document.document_date <= date_to)
+        return query.group_by(DocumentLine.nomenclature_id, DocumentLine.account)
+
+    def balances_query(self, target_date):
+        """
+        Залишки по (товар, рахунок) на target_date: знімок + рухи після нього.
+        Повертає select з колонками nomenclature_id, account, quantity, total_amount.
+        """
+        return self._balances_since(self.latest_period_for(target_date), target_date)
+
+    def _balances_since(self, period_end, target_date):
+        if period_end is None:
+            return self.movements_query(date_to=target_date)
+
+        snapshot = select(
+            InventorySnapshot.nomenclature_id,
+            InventorySnapshot.account,
+            InventorySnapshot.quantity,
+            InventorySnapshot.total_amount,
+        ).filter(InventorySnapshot.period_end == period_end)
+        delta = self.movements_query(date_from=period_upper_bound(period_end), date_to=target_date)
+
+        combined = union_all(snapshot, delta).subquery()
+        return select(
+            combined.c.nomenclature_id,
+            combined.c.account,
+            func.sum(combined.c.quantity).label('quantity'),
+            func.sum(combined.c.total_amount).label('total_amount'),
+        ).group_by(combined.c.nomenclature_id, combined.c.account)
+
+    def create_snapshot(self, period_end: date) -> int:
+        """Створює (або перераховує) знімок на кінець дня period_end. Повертає кількість рядків."""
+        previous_period = self.session.execute(
+            select(func.max(InventorySnapshotPeriod.period_end))
+            .filter(InventorySnapshotPeriod.period_end < period_end)
+        ).scalar()
+
+        self.session.execute(
+            pg_insert(InventorySnapshotPeriod)
+            .values(period_end=period_end, created_at=datetime.now())
+            .on_conflict_do_nothing()
+        )
+        self.session.execute(delete(InventorySnapshot).filter(InventorySnapshot.period_end == period_end))
+
+        balances = self._balances_since(previous_period, period_upper_bound(period_end)).subquery()
+        source = select(
+            literal(period_end).label('period_end'),
+            balances.c.nomenclature_id,
+            balances.c.account,
+            balances.c.quantity,
+            balances.c.total_amount,
+        ).filter((balances.c.quantity != 0) | (balances.c.total_amount != 0))
+
+        result = self.session.execute(
+            pg_insert(InventorySnapshot).from_select(
+                ['period_end', 'nomenclature_id', 'account', 'quantity', 'total_amount'], source
+            )
+        )
+        self._max_period_loaded = False
+        return result.rowcount
+
+    def close_months(self, until: date) -> list:
+        """
+        Створює знімки на кінець кожного місяця до until включно, починаючи
+        після останнього наявного знімка (або з місяця першого проведеного документа).
+        """
+        last_period = self.session.execute(select(func.max(InventorySnapshotPeriod.period_end))).scalar()
+        if last_period is not None:
+            month_start = last_period + timedelta(days=1)
+        else:
+            first_date = self.session.execute(
+                select(func.min(Document.document_date)).filter(Document.is_posted == True)
+            ).scalar()
+            if first_date is None:
+                return []
+            month_start = first_date.date().replace(day=1)
+
+        created = []
+        while True:
+            period_end = (month_start.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+            if period_end > until:
+                return created
+            self.create_snapshot(period_end)
+            created.append(period_end)
+            month_start = period_end + timedelta(days=1)
+
+    def _latest_period(self):
+        if not self._max_period_loaded:
+            self._max_period = self.session.execute(select(func.max(InventorySnapshotPeriod.period_end))).scalar()
+            self._max_period_loaded = True
+        return self._max_period
+
+    def apply_document(self, document: Document, sign: int = 1):
+        """Інкрементно оновлює знімки, які вже покривають дату проведеного документа."""
+        if OperationType.get_modifier(document.operation_type) == 1:
+            direction = 1
+            amount_field = 'total_amount'
+        else:
+            direction = -1
+            amount_field = 'total_cost'
+
+        deltas = {}
+        for line in document.lines:
+            delta = deltas.setdefault((line.nomenclature_id, line.account), [Decimal(0), Decimal(0)])
+            delta[0] += sign * direction * to_decimal(line.quantity)
+            delta[1] += sign * direction * to_decimal(getattr(line, amount_field))
+
+        self.apply_deltas(document.document_date, deltas)
+
+    def apply_deltas(self, document_date: datetime, deltas: dict):
+        """
+        Додає дельти {(nomenclature_id, account): (кількість, сума)} до всіх знімків
+        з period_end >= дати документа. Звичайне проведення поточною датою
+        не зачіпає жодного знімка і коштує один (кешований) запит.
+        Документ без дати до знімків не входить (movements_query фільтрує за датою).
+        """
+        if document_date is None:
+            return
+        latest = self._latest_period()
+        if latest is None or not deltas or document_date.date() > latest:
+            return
+
+        rows = values(
+            column('nomenclature_id', String),
+            column('account', String),
+            column('quantity', Numeric),
+            column('total_amount', Numeric),
+            name='deltas'
+        ).data([(key[0], key[1], quantity, amount) for key, (quantity, amount) in deltas.items()])
+
+        source = select(
+            InventorySnapshotPeriod.period_end,
+            rows.c.nomenclature_id,
+            rows.c.account,
+            rows.c.quantity,
+            rows.c.total_amount,
+        ).select_from(InventorySnapshotPeriod).join(rows, true())\
+         .filter(InventorySnapshotPeriod.period_end >= document_date.date())
+
+        stmt = pg_insert(InventorySnapshot).from_select(
+            ['period_end', 'nomenclature_id', 'account', 'quantity', 'total_amount'], source
+        )
+        stmt = stmt.on_conflict_do_update(
+            constraint='uix_snapshot_period_item',
+            set_={
+                'quantity': InventorySnapshot.quantity + stmt.excluded.quantity,
+                'total_amount': InventorySnapshot.total_amount + stmt.excluded.total_amount,
+            }
+        )
+        self.session.execute(stmt)
+
+    def apply_dated_deltas(self, dated_deltas):
+        """
+        Дельти кількох дат [(дата, {(nomenclature_id, account): (кількість, сума)}), ...]
+        (наприклад, після перерахунку собівартості). Дельти групуються за першим
+        знімком, що покриває дату, тож запитів не більше, ніж знімків.
+        """
+        latest = self._latest_period()
+        if latest is None:
+            return
+
+        periods = self.session.execute(
+            select(InventorySnapshotPeriod.period_end).order_by(InventorySnapshotPeriod.period_end)
+        ).scalars().all()
+
+        grouped = {}
+        for document_date, deltas in dated_deltas:
+            if document_date is None:
+                continue
+            index = bisect_left(periods, document_date.date())
+            if index == len(periods):
+                continue
+            target = grouped.setdefault(periods[index], {})
+            for key, (quantity, amount) in deltas.items():
+                delta = target.setdefault(key, [Decimal(0), Decimal(0)])
+                delta[0] += quantity
+                delta[1] += amount
+
+        for period_end, deltas in sorted(grouped.items()):
+            self.apply_deltas(datetime.combine(period_end, time()), deltas)
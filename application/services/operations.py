@@ -0,0 +1,25 @@
+# application/services/operations.py
+from decimal import Decimal
+
+from application.services.exceptions import PostingError
+
+
+class OperationType:
+    """Константи для типів операцій, щоб уникнути магічних рядків."""
+    INCOMING = ['Purchase', 'Incoming', 'Прибуткова накладна']
+    OUTGOING = ['Sale', 'Outgoing', 'Видаткова накладна']
+
+    @classmethod
+    def get_modifier(cls, op_type: str) -> int:
+        if op_type in cls.INCOMING:
+            return 1
+        if op_type in cls.OUTGOING:
+            return -1
+        raise PostingError(f"Невідомий тип операції: {op_type}")
+
+
+def to_decimal(value) -> Decimal:
+    """Numeric з БД приходить як Decimal, а з форм - як float."""
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value or 0))
@@ -1,134 +1,603 @@
+import random
+import time
+from bisect import insort
 from decimal import Decimal
 from datetime import datetime
-from sqlalchemy import func, select
+from sqlalchemy import func, select, delete, tuple_, and_, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import selectinload
 
 from application import db
-from application.models import Document, DocumentLine, InventoryBalance
+from application.models import Document, DocumentLine, InventoryBalance, CostLayer, CostLayerConsumption
 from application.services.exceptions import PostingError, InsufficientStockError
+from application.services.operations import OperationType, to_decimal
+from application.services.SnapshotService import SnapshotService
+from application.services.SalesRollupService import SalesRollupService
+from application.services.ReportCache import record_posting_events
+from application.services.ChangeFeed import lock_change_seq, next_change_seq
+from config import Config
 
 
-class OperationType:
-    """Константи для типів операцій, щоб уникнути магічних рядків."""
-    INCOMING = ['Purchase', 'Incoming', 'Прибуткова накладна']
-    OUTGOING = ['Sale', 'Outgoing', 'Видаткова накладна']
+# serialization_failure та deadlock_detected: транзакцію можна безпечно повторити
+RETRYABLE_SQLSTATES = ('40001', '40P01')
 
-    @classmethod
-    def get_modifier(cls, op_type: str) -> int:
-        if op_type in cls.INCOMING:
-            return 1
-        if op_type in cls.OUTGOING:
-            return -1
-        raise PostingError(f"Невідомий тип операції: {op_type}")
+
+def _layer_order(layer: CostLayer):
+    # Порядок FIFO як в ORDER BY layer_date (NULLS LAST), document_id
+    return (layer.layer_date is None, layer.layer_date or 0, layer.document_id)
+
+
+def layer_cost(layer_quantity, layer_amount, take: Decimal) -> Decimal:
+    """Вартість take одиниць партії (ціна одиниці саме цієї партії), до 6 знаків."""
+    layer_quantity = to_decimal(layer_quantity)
+    if not layer_quantity:
+        return Decimal(0)
+    return (take * to_decimal(layer_amount) / layer_quantity).quantize(Decimal('0.000001'))
+
+
+def replay_fifo(layers, write_offs):
+    """
+    FIFO по всій історії одного товару (rebuild_layers, звірка залишків).
+    Усі партії приходів (layers - [(кількість, сума)] у порядку черги) утворюють чергу
+    ще до списань, а списання (write_offs - кількості в хронологічному порядку) забирають
+    кількість з її голови - як і при проведенні, списання може забрати і з партії,
+    датованої пізніше за нього.
+    Повертає ([[(індекс партії, кількість, вартість), ...] для кожного списання],
+              [залишок кожної партії]).
+    """
+    remaining = [to_decimal(quantity) for quantity, _ in layers]
+    taken = []
+    head = 0
+    for quantity in write_offs:
+        qty_to_write_off = to_decimal(quantity)
+        parts = []
+        while qty_to_write_off > 0 and head < len(layers):
+            take = min(qty_to_write_off, remaining[head])
+            if take > 0:
+                parts.append((head, take, layer_cost(*layers[head], take)))
+                remaining[head] -= take
+                qty_to_write_off -= take
+            if remaining[head] <= 0:
+                head += 1
+        taken.append(parts)
+    return taken, remaining
 
 
 class FifoCostCalculator:
     """
     Відповідає виключно за розрахунок собівартості списання (FIFO).
-    Ізолює складну логіку запитів до історії партій.
+    Стан черги зберігається в партіях (CostLayer): кожен рядок приходу відкриває
+    партію, а списання забирає кількість з голови черги. Тому вартість списання
+    залежить лише від кількості відкритих партій, які воно реально вичерпує,
+    а не від усієї історії товару.
     """
+    # Скільки відкритих партій читати за один запит
+    LAYER_FETCH_SIZE = 16
+
     def __init__(self, session):
         self.session = session
-
-    def calculate_cost(self, document: Document, line: DocumentLine) -> Decimal:
-        #  Скільки цього товару ми вже продали/списали раніше (до цього документа)
-        # Це потрібно, щоб зрозуміти, які партії "вже з'їли" попередні продажі
-        prev_sold_query = select(func.sum(DocumentLine.quantity)).join(Document).filter(
-            Document.is_posted == True,
-            Document.operation_type.in_(OperationType.OUTGOING),
-            DocumentLine.nomenclature_id == line.nomenclature_id,
-            (Document.document_date < document.document_date) |
-            ((Document.document_date == document.document_date) & (Document.documents_id < document.documents_id))
-        )
-        total_sold_previously = self.session.execute(prev_sold_query).scalar() or 0
-
-        # Отримуємо всі вхідні партії (приходи), відсортовані за часом (FIFO)
-        incoming_batches = self.session.execute(
-            select(DocumentLine).join(Document).filter(
-                Document.is_posted == True,
-                Document.operation_type.in_(OperationType.INCOMING),
-                DocumentLine.nomenclature_id == line.nomenclature_id
-            ).order_by(Document.document_date.asc(), Document.documents_id.asc())
+        # Попередньо завантажені відкриті партії: nomenclature_id -> [CostLayer, ...]
+        self._layer_cache = {}
+
+    def preload(self, nomenclature_ids):
+        """Завантажує відкриті партії для набору товарів одним запитом."""
+        layers = self.session.execute(
+            select(CostLayer).filter(
+                CostLayer.nomenclature_id.in_(nomenclature_ids),
+                CostLayer.remaining_quantity > 0
+            ).order_by(CostLayer.nomenclature_id, CostLayer.layer_date, CostLayer.document_id, CostLayer.layer_id)
         ).scalars().all()
 
+        for nomenclature_id in nomenclature_ids:
+            self._layer_cache[nomenclature_id] = []
+        for layer in layers:
+            self._layer_cache[layer.nomenclature_id].append(layer)
+
+    def forget(self, nomenclature_ids=None):
+        """Скидає кеш партій (усіх або для вказаних товарів)."""
+        if nomenclature_ids is None:
+            self._layer_cache.clear()
+            return
+        for nomenclature_id in nomenclature_ids:
+            self._layer_cache.pop(nomenclature_id, None)
+
+    def add_layer(self, document: Document, line: DocumentLine) -> CostLayer:
+        """Прихід: відкриває нову партію на всю кількість рядка."""
+        layer = CostLayer(
+            nomenclature_id=line.nomenclature_id,
+            line_id=line.product_item_id,
+            document_id=document.documents_id,
+            layer_date=document.document_date,
+            quantity=line.quantity,
+            remaining_quantity=line.quantity,
+            total_amount=line.total_amount or 0,
+        )
+        self.session.add(layer)
 
-        qty_to_write_off = float(line.quantity)
-        fifo_cost = 0.0
-        # Скільки товару з початку черги треба пропустити, бо він вже був проданий раніше
-        items_to_skip = float(total_sold_previously)
+        cached = self._layer_cache.get(line.nomenclature_id)
+        if cached is not None:
+            insort(cached, layer, key=_layer_order)
+        return layer
 
-        for batch in incoming_batches:
+    def calculate_cost(self, document: Document, line: DocumentLine) -> Decimal:
+        """
+        Списує кількість рядка з відкритих партій (FIFO) і повертає собівартість.
+        Зменшує remaining_quantity партій та записує CostLayerConsumption.
+        """
+        qty_to_write_off = to_decimal(line.quantity)
+        fifo_cost = Decimal(0)
+
+        for layer in self._open_layers(line.nomenclature_id):
             if qty_to_write_off <= 0:
                 break
 
-            batch_qty = float(batch.quantity)
-            # Розраховуємо ціну одиниці в цій конкретній партії
-            batch_price = (float(batch.total_amount) / batch_qty) if batch_qty else 0
+            take = min(qty_to_write_off, to_decimal(layer.remaining_quantity))
+            cost = self._layer_cost(layer, take)
 
-            # Якщо ця партія вже повністю вичерпана попередніми продажами
-            if items_to_skip >= batch_qty:
-                items_to_skip -= batch_qty
-                continue
+            layer.remaining_quantity = to_decimal(layer.remaining_quantity) - take
+            self.session.add(CostLayerConsumption(
+                layer=layer,
+                line_id=line.product_item_id,
+                quantity=take,
+                cost=cost,
+            ))
 
-            # Скільки доступно в цій партії зараз
-            available_in_batch = batch_qty - items_to_skip
-            items_to_skip = 0  # Ми знайшли "живу" партію, далі пропускати не треба
-
-            # Скільки беремо з цієї партії
-            take = min(qty_to_write_off, available_in_batch)
-            
-            fifo_cost += take * batch_price
+            fifo_cost += cost
             qty_to_write_off -= take
 
-        return Decimal(str(round(fifo_cost, 2)))
+        return fifo_cost.quantize(Decimal('0.01'))
+
+    @staticmethod
+    def _layer_cost(layer: CostLayer, take: Decimal) -> Decimal:
+        return layer_cost(layer.quantity, layer.total_amount, take)
+
+    def _open_layers(self, nomenclature_id: str):
+        """Відкриті партії товару в порядку FIFO, порціями по LAYER_FETCH_SIZE."""
+        cached = self._layer_cache.get(nomenclature_id)
+        if cached is not None:
+            # Вичерпані партії з голови черги більше не потрібні
+            drained = 0
+            while drained < len(cached) and cached[drained].remaining_quantity <= 0:
+                drained += 1
+            del cached[:drained]
+            yield from (layer for layer in list(cached) if layer.remaining_quantity > 0)
+            return
+
+        last_key = None
+
+        while True:
+            query = select(CostLayer).filter(
+                CostLayer.nomenclature_id == nomenclature_id,
+                CostLayer.remaining_quantity > 0
+            )
+            if last_key is not None:
+                query = query.filter(self._after_layer(*last_key))
+
+            layers = self.session.execute(
+                query.order_by(CostLayer.layer_date, CostLayer.document_id, CostLayer.layer_id)
+                .limit(self.LAYER_FETCH_SIZE)
+            ).scalars().all()
+
+            yield from layers
+
+            if len(layers) < self.LAYER_FETCH_SIZE:
+                return
+            last = layers[-1]
+            last_key = (last.layer_date, last.document_id, last.layer_id)
+
+    @staticmethod
+    def _after_layer(layer_date, document_id, layer_id):
+        """
+        Партії після (layer_date, document_id, layer_id) у порядку FIFO.
+        Партії без дати (документи, проведені до обов'язкової дати) - в кінці черги,
+        як у ORDER BY; порівняння кортежу з NULL їх би пропускало.
+        """
+        tail = tuple_(CostLayer.document_id, CostLayer.layer_id) > tuple_(document_id, layer_id)
+        if layer_date is None:
+            return and_(CostLayer.layer_date.is_(None), tail)
+        return or_(
+            tuple_(CostLayer.layer_date, CostLayer.document_id, CostLayer.layer_id)
+            > tuple_(layer_date, document_id, layer_id),
+            CostLayer.layer_date.is_(None),
+        )
+
+    def rebuild_layers(self, nomenclature_ids=None) -> list:
+        """
+        Перебудовує партії та списання з історії проведених документів (replay_fifo):
+        усі приходи утворюють чергу, а списання в хронологічному порядку забирають
+        кількість з її голови.
+        Собівартість рядків списання приводиться у відповідність до нових списань з партій.
+
+        Повертає змінені рядки: [(DocumentLine, document_date, зміна total_cost), ...]
+        """
+        if nomenclature_ids is None:
+            nomenclature_ids = self.session.execute(
+                select(DocumentLine.nomenclature_id).distinct()
+            ).scalars().all()
+
+        layer_ids = select(CostLayer.layer_id).filter(CostLayer.nomenclature_id.in_(nomenclature_ids))
+        self.session.execute(
+            delete(CostLayerConsumption).filter(CostLayerConsumption.layer_id.in_(layer_ids))
+        )
+        self.session.execute(
+            delete(CostLayer).filter(CostLayer.nomenclature_id.in_(nomenclature_ids))
+        )
+
+        changes = []
+        for nomenclature_id in nomenclature_ids:
+            movements = self.session.execute(
+                select(DocumentLine, Document.operation_type, Document.document_date)
+                .join(Document)
+                .filter(
+                    Document.is_posted == True,
+                    DocumentLine.nomenclature_id == nomenclature_id
+                ).order_by(Document.document_date, Document.documents_id, DocumentLine.product_item_id)
+            ).all()
+
+            incoming = [
+                (line, document_date) for line, operation_type, document_date in movements
+                if operation_type in OperationType.INCOMING
+            ]
+            outgoing = [
+                (line, document_date) for line, operation_type, document_date in movements
+                if operation_type in OperationType.OUTGOING
+            ]
+            layers = [
+                CostLayer(
+                    nomenclature_id=nomenclature_id,
+                    line_id=line.product_item_id,
+                    document_id=line.document_id,
+                    layer_date=document_date,
+                    quantity=line.quantity,
+                    remaining_quantity=line.quantity,
+                    total_amount=line.total_amount or 0,
+                )
+                for line, document_date in incoming
+            ]
+            self.session.add_all(layers)
+            self.session.flush()
+
+            taken, remaining = replay_fifo(
+                [(layer.quantity, layer.total_amount) for layer in layers],
+                [line.quantity for line, _ in outgoing]
+            )
+            for layer, quantity in zip(layers, remaining):
+                layer.remaining_quantity = quantity
+
+            for (line, document_date), parts in zip(outgoing, taken):
+                fifo_cost = Decimal(0)
+                for index, take, cost in parts:
+                    self.session.add(CostLayerConsumption(
+                        layer_id=layers[index].layer_id,
+                        line_id=line.product_item_id,
+                        quantity=take,
+                        cost=cost,
+                    ))
+                    fifo_cost += cost
+
+                # Інакше скасування проведення повернуло б на залишок іншу суму, ніж забрали партії
+                new_cost = fifo_cost.quantize(Decimal('0.01'))
+                old_cost = to_decimal(line.total_cost)
+                if new_cost != old_cost:
+                    line.total_cost = new_cost
+                    changes.append((line, document_date, new_cost - old_cost))
+            self.session.flush()
+
+        self.forget(nomenclature_ids)
+        return changes
+
+    def remove_layers(self, document: Document) -> dict:
+        """
+        Скасування приходу: видаляє партії документа разом зі списаннями з них.
+        Повертає {nomenclature_id: (document_date, documents_id) найранішого списання,
+        яке забирало з цих партій} - собівартість таких списань треба перерахувати.
+        """
+        consumers = self.session.execute(
+            select(CostLayer.nomenclature_id, Document.document_date, Document.documents_id)
+            .join(CostLayerConsumption, CostLayerConsumption.layer_id == CostLayer.layer_id)
+            .join(DocumentLine, DocumentLine.product_item_id == CostLayerConsumption.line_id)
+            .join(Document, Document.documents_id == DocumentLine.document_id)
+            .filter(CostLayer.document_id == document.documents_id)
+            .distinct(CostLayer.nomenclature_id)
+            .order_by(CostLayer.nomenclature_id, Document.document_date, Document.documents_id)
+        ).all()
+
+        layer_ids = select(CostLayer.layer_id).filter(CostLayer.document_id == document.documents_id)
+        self.session.execute(
+            delete(CostLayerConsumption).filter(CostLayerConsumption.layer_id.in_(layer_ids))
+        )
+        self.session.execute(
+            delete(CostLayer).filter(CostLayer.document_id == document.documents_id)
+        )
+
+        self.forget({line.nomenclature_id for line in document.lines})
+        return {nomenclature_id: (document_date, doc_id) for nomenclature_id, document_date, doc_id in consumers}
+
+    def release_consumptions(self, document: Document):
+        """Скасування списання: повертає забрані кількості в партії та видаляє списання документа."""
+        line_ids = [line.product_item_id for line in document.lines]
+        restored = dict(self.session.execute(
+            select(CostLayerConsumption.layer_id, func.sum(CostLayerConsumption.quantity))
+            .filter(CostLayerConsumption.line_id.in_(line_ids))
+            .group_by(CostLayerConsumption.layer_id)
+        ).all())
+
+        if restored:
+            layers = self.session.execute(
+                select(CostLayer).filter(CostLayer.layer_id.in_(list(restored)))
+            ).scalars().all()
+            for layer in layers:
+                layer.remaining_quantity = to_decimal(layer.remaining_quantity) + restored[layer.layer_id]
+            self.session.execute(
+                delete(CostLayerConsumption).filter(CostLayerConsumption.line_id.in_(line_ids))
+            )
+
+        self.forget({line.nomenclature_id for line in document.lines})
+
+    def recost(self, nomenclature_id: str, from_key) -> list:
+        """
+        Інкрементний перерахунок FIFO товару після проведення "заднім числом".
+        from_key = (document_date, documents_id) першого зміненого документа.
+
+        Списання з ключем >= from_key повертають забрані кількості в партії і
+        повторюються в хронологічному порядку з голови черги. Вікно розширюється
+        до найранішого списання, яке вже забирало з партій з ключем >= from_key,
+        тож результат збігається з повним перерахунком історії, а робота
+        пропорційна лише зміненому вікну.
+
+        Повертає змінені рядки: [(DocumentLine, document_date, зміна total_cost), ...]
+        """
+        self.session.flush()
+        from_key = tuple(from_key)
+
+        earlier_consumer = self.session.execute(
+            select(Document.document_date, Document.documents_id)
+            .join(DocumentLine, DocumentLine.document_id == Document.documents_id)
+            .join(CostLayerConsumption, CostLayerConsumption.line_id == DocumentLine.product_item_id)
+            .join(CostLayer, CostLayer.layer_id == CostLayerConsumption.layer_id)
+            .filter(
+                CostLayer.nomenclature_id == nomenclature_id,
+                tuple_(CostLayer.layer_date, CostLayer.document_id) >= tuple_(*from_key),
+                tuple_(Document.document_date, Document.documents_id) < tuple_(*from_key),
+            )
+            .order_by(Document.document_date, Document.documents_id)
+            .limit(1)
+        ).first()
+        if earlier_consumer is not None:
+            from_key = tuple(earlier_consumer)
+
+        window_filter = (
+            DocumentLine.nomenclature_id == nomenclature_id,
+            Document.is_posted == True,
+            Document.operation_type.in_(OperationType.OUTGOING),
+            tuple_(Document.document_date, Document.documents_id) >= tuple_(*from_key),
+        )
+        window_line_ids = select(DocumentLine.product_item_id).join(Document).filter(*window_filter)
+
+        # 1. Повертаємо в партії все, що списали рядки вікна
+        restored = dict(self.session.execute(
+            select(CostLayerConsumption.layer_id, func.sum(CostLayerConsumption.quantity))
+            .filter(CostLayerConsumption.line_id.in_(window_line_ids))
+            .group_by(CostLayerConsumption.layer_id)
+        ).all())
+
+        layers = self.session.execute(
+            select(CostLayer).filter(
+                CostLayer.nomenclature_id == nomenclature_id,
+                (CostLayer.remaining_quantity > 0) | CostLayer.layer_id.in_(list(restored))
+            ).order_by(CostLayer.layer_date, CostLayer.document_id, CostLayer.layer_id)
+        ).scalars().all()
+
+        for layer in layers:
+            if layer.layer_id in restored:
+                layer.remaining_quantity = to_decimal(layer.remaining_quantity) + restored[layer.layer_id]
+
+        self.session.execute(
+            delete(CostLayerConsumption).filter(CostLayerConsumption.line_id.in_(window_line_ids))
+        )
+
+        # 2. Повторюємо списання вікна з голови черги
+        lines = self.session.execute(
+            select(DocumentLine, Document.document_date).join(Document).filter(*window_filter)
+            .order_by(Document.document_date, Document.documents_id, DocumentLine.product_item_id)
+        ).all()
+
+        open_layers = [layer for layer in layers if layer.remaining_quantity > 0]
+        head = 0
+        changes = []
+        for line, document_date in lines:
+            qty_to_write_off = to_decimal(line.quantity)
+            fifo_cost = Decimal(0)
+            while qty_to_write_off > 0 and head < len(open_layers):
+                layer = open_layers[head]
+                take = min(qty_to_write_off, to_decimal(layer.remaining_quantity))
+                cost = self._layer_cost(layer, take)
+                layer.remaining_quantity = to_decimal(layer.remaining_quantity) - take
+                self.session.add(CostLayerConsumption(
+                    layer=layer,
+                    line_id=line.product_item_id,
+                    quantity=take,
+                    cost=cost,
+                ))
+                fifo_cost += cost
+                qty_to_write_off -= take
+                if layer.remaining_quantity <= 0:
+                    head += 1
+
+            # Переписуємо лише рядки, собівартість яких змінилась
+            new_cost = fifo_cost.quantize(Decimal('0.01'))
+            old_cost = to_decimal(line.total_cost)
+            if new_cost != old_cost:
+                line.total_cost = new_cost
+                changes.append((line, document_date, new_cost - old_cost))
+
+        # Кешовані партії товару більше не відповідають БД
+        self.forget([nomenclature_id])
+        return changes
 
 
 class InventoryManager:
     """
     Відповідає за безпосередню зміну стану складу (InventoryBalance).
-    Приховує логіку пошуку або створення запису залишків.
+    Рухи накопичуються як дельти по (nomenclature_id, account) і застосовуються
+    одним INSERT ... ON CONFLICT DO UPDATE на документ або на пакет документів.
     """
     def __init__(self, session):
         self.session = session
-
-    def _get_or_create_balance(self, nomenclature_id: str, account: str) -> InventoryBalance:
-        balance = self.session.execute(
-            select(InventoryBalance).filter_by(
-                nomenclature_id=nomenclature_id,
-                account=account
-            )
+        # (nomenclature_id, account) -> [дельта кількості, дельта суми]
+        self._deltas = {}
+        # Кількість у БД до застосування дельт: (nomenclature_id, account) -> Decimal
+        self._quantities = {}
+        self._preloaded_items = set()
+        # Журнал дельт від останнього checkpoint() (для відкату одного документа)
+        self._journal = []
+
+    def preload(self, nomenclature_ids, for_update=False):
+        """
+        Завантажує кількісні залишки для набору товарів одним запитом.
+        for_update=True блокує рядки залишків до кінця транзакції (SELECT ... FOR UPDATE)
+        у детермінованому порядку, тож паралельні проведення тих самих товарів
+        чекають одне на одне, а не взаємоблокуються.
+        """
+        query = (
+            select(InventoryBalance.nomenclature_id, InventoryBalance.account, InventoryBalance.quantity)
+            .filter(InventoryBalance.nomenclature_id.in_(nomenclature_ids))
+        )
+        if for_update:
+            query = query.order_by(InventoryBalance.nomenclature_id, InventoryBalance.balance_id).with_for_update()
+        rows = self.session.execute(query).all()
+
+        for nomenclature_id, account, quantity in rows:
+            self._quantities[(nomenclature_id, account)] = quantity
+        self._preloaded_items.update(nomenclature_ids)
+
+    def forget(self, nomenclature_ids=None):
+        """Скидає кеш залишків (усіх або для вказаних товарів)."""
+        if nomenclature_ids is None:
+            self._quantities.clear()
+            self._preloaded_items.clear()
+            return
+        for key in [key for key in self._quantities if key[0] in nomenclature_ids]:
+            del self._quantities[key]
+        self._preloaded_items.difference_update(nomenclature_ids)
+
+    def _stored_quantity(self, key) -> Decimal:
+        if key in self._quantities:
+            return self._quantities[key]
+        if key[0] in self._preloaded_items:
+            return Decimal(0)
+
+        quantity = self.session.execute(
+            select(InventoryBalance.quantity).filter_by(nomenclature_id=key[0], account=key[1])
         ).scalar_one_or_none()
-
-        if not balance:
-            balance = InventoryBalance(
-                nomenclature_id=nomenclature_id,
-                account=account,
-                quantity=0,
-                total_amount=0
-            )
-            self.session.add(balance)
-        return balance
+        self._quantities[key] = quantity or Decimal(0)
+        return self._quantities[key]
+
+    def _add_delta(self, key, quantity: Decimal, amount: Decimal):
+        delta = self._deltas.setdefault(key, [Decimal(0), Decimal(0)])
+        delta[0] += quantity
+        delta[1] += amount
+        self._journal.append((key, quantity, amount))
+
+    def checkpoint(self):
+        """Початок документа в пакеті: наступні дельти можна відкотити."""
+        self._journal = []
+
+    def rollback_to_checkpoint(self):
+        """Відкочує дельти, додані після останнього checkpoint()."""
+        for key, quantity, amount in reversed(self._journal):
+            delta = self._deltas[key]
+            delta[0] -= quantity
+            delta[1] -= amount
+            if not delta[0] and not delta[1]:
+                del self._deltas[key]
+        self._journal = []
 
     def add_stock(self, line: DocumentLine):
         """Оприбуткування (кількість + сума з документа)"""
-        balance = self._get_or_create_balance(line.nomenclature_id, line.account)
-        balance.quantity += line.quantity
-        balance.total_amount += line.total_amount
-        balance.last_updated = datetime.now()
+        self._add_delta(
+            (line.nomenclature_id, line.account),
+            to_decimal(line.quantity),
+            to_decimal(line.total_amount)
+        )
+
+    def return_stock(self, line: DocumentLine, cost_amount: Decimal):
+        """Скасування списання: кількість і собівартість повертаються на залишок."""
+        self._add_delta(
+            (line.nomenclature_id, line.account),
+            to_decimal(line.quantity),
+            to_decimal(cost_amount)
+        )
+
+    def adjust_amount(self, key, amount: Decimal):
+        """Зміна лише сумового залишку (перерахунок собівартості)."""
+        self._add_delta(key, Decimal(0), amount)
 
     def remove_stock(self, line: DocumentLine, cost_amount: Decimal):
         """Списання (кількість - розрахована собівартість)"""
-        balance = self._get_or_create_balance(line.nomenclature_id, line.account)
+        key = (line.nomenclature_id, line.account)
+        pending = self._deltas.get(key, (Decimal(0), Decimal(0)))[0]
+        available = self._stored_quantity(key) + pending
 
-        if balance.quantity < line.quantity:
+        if available < to_decimal(line.quantity):
             raise InsufficientStockError(
                 f'Недостатньо товару "{line.nomenclature.nomenclature_name}". '
-                f'На залишку: {balance.quantity}, Потрібно: {line.quantity}'
+                f'На залишку: {available}, Потрібно: {line.quantity}'
             )
 
-        balance.quantity -= line.quantity
-        balance.total_amount -= cost_amount
-        balance.last_updated = datetime.now()
+        self._add_delta(key, -to_decimal(line.quantity), -to_decimal(cost_amount))
+
+    def apply_deltas(self):
+        """
+        Застосовує накопичені дельти одним INSERT ... ON CONFLICT DO UPDATE.
+        Умова WHERE не дає оновленню зробити залишок від'ємним: якщо рядок
+        встигли змінити паралельно, він не повернеться з RETURNING.
+        Викликається безпосередньо перед commit: change_seq видається під блокуванням до кінця транзакції.
+        """
+        if not self._deltas:
+            return
+
+        lock_change_seq(self.session)
+
+        now = datetime.now()
+        rows = [
+            {
+                'nomenclature_id': nomenclature_id,
+                'account': account,
+                'quantity': quantity,
+                'total_amount': amount,
+                'last_updated': now,
+            }
+            for (nomenclature_id, account), (quantity, amount) in self._deltas.items()
+        ]
+
+        stmt = pg_insert(InventoryBalance).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            constraint='uix_nomenclature_account',
+            set_={
+                'quantity': InventoryBalance.quantity + stmt.excluded.quantity,
+                'total_amount': InventoryBalance.total_amount + stmt.excluded.total_amount,
+                'last_updated': stmt.excluded.last_updated,
+                'change_seq': next_change_seq(),
+            },
+            where=(InventoryBalance.quantity + stmt.excluded.quantity >= 0)
+        ).returning(InventoryBalance.nomenclature_id, InventoryBalance.account, InventoryBalance.quantity)
+
+        updated = {
+            (nomenclature_id, account): quantity
+            for nomenclature_id, account, quantity in self.session.execute(stmt)
+        }
+
+        missing = [key for key in self._deltas if key not in updated]
+        if missing:
+            raise InsufficientStockError(
+                f'Залишки товару {missing[0][0]} змінились під час проведення, недостатньо кількості.'
+            )
+
+        self._quantities.update(updated)
+        self._deltas.clear()
+        self._journal = []
 
 
 class DocumentPostingService:
@@ -136,23 +605,210 @@ class DocumentPostingService:
     Фасадний сервіс (Orchestrator).
     Він знає ЛИШЕ послідовність дій для проведення документа.
     """
-    def __init__(self, db_session):
-        self.db = db_session
-        self.inventory_manager = InventoryManager(db_session)
-        self.fifo_calculator = FifoCostCalculator(db_session)
+    # Пауза перед повтором (сек.), подвоюється з кожною спробою
+    RETRY_BACKOFF = 0.05
 
-    def post_document(self, doc_id: str):
+    def __init__(self, db_session, max_retries=None):
+        self.db = db_session
+        self.max_retries = Config.POSTING_MAX_RETRIES if max_retries is None else max_retries
+        self._reset_state()
+
+    def _reset_state(self):
+        self.inventory_manager = InventoryManager(self.db)
+        self.fifo_calculator = FifoCostCalculator(self.db)
+        self.snapshot_service = SnapshotService(self.db)
+        self.sales_rollup = SalesRollupService(self.db)
+        # Діапазони дат, змінені поточною транзакцією (для інвалідації кешу звітів)
+        self._changed_ranges = []
+
+    def _retrying(self, action, *args):
+        """
+        Виконує транзакцію action, повторюючи її при конфлікті серіалізації
+        або взаємоблокуванні (з експоненційною паузою та випадковим зсувом).
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return action(*args)
+            except DBAPIError as e:
+                if getattr(e.orig, 'pgcode', None) not in RETRYABLE_SQLSTATES or attempt == self.max_retries:
+                    raise
+                self.db.rollback()
+                # Кеші залишків і партій належали відкоченій транзакції
+                self._reset_state()
+                time.sleep(self.RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    def _commit(self):
+        """Фіксує транзакцію разом з подіями проведення (водяний знак для кешу звітів)."""
+        # Блокування change_seq береться першим (до лічильника проведень), щоб порядок блокувань був один
+        lock_change_seq(self.db)
+        record_posting_events(self.db, self._changed_ranges)
+        self._changed_ranges = []
+        self.db.commit()
+
+    def _changed(self, document: Document):
+        document_date = document.document_date.date() if document.document_date else None
+        self._changed_ranges.append((document_date, document_date))
+
+    def _load_document(self, doc_id: str) -> Document:
+        """
+        Документ блокується до commit (FOR UPDATE) і перечитується з БД, тож перевірка
+        is_posted бачить стан після блокування: друга сесія, що проводить той самий
+        документ, дочекається commit першої і отримає "вже проведений".
+        """
         document = self.db.execute(
             select(Document)
             .filter_by(documents_id=doc_id)
             .options(selectinload(Document.lines).selectinload(DocumentLine.nomenclature))
+            .with_for_update(of=Document)
+            .execution_options(populate_existing=True)
         ).scalar_one_or_none()
 
         if not document:
             raise PostingError("Документ не знайдено.")
-        
+        return document
+
+    def post_document(self, doc_id: str):
+        self._retrying(self._post_document, doc_id)
+
+    def _post_document(self, doc_id: str):
+        document = self._load_document(doc_id)
+
+        nomenclature_ids = {line.nomenclature_id for line in document.lines}
+        self.inventory_manager.preload(nomenclature_ids, for_update=True)
+        later_sales = self._latest_sales_after(nomenclature_ids, (document.document_date, document.documents_id))
+        self._post_loaded(document)
+        self._recost_if_backdated(document, later_sales)
+        self.inventory_manager.apply_deltas()
+        self._changed(document)
+        self._commit()
+
+    def unpost_document(self, doc_id: str):
+        """
+        Скасовує проведення: віднімає рівно ті дельти, які документ додав
+        до залишків, партій FIFO, знімків і підсумку продажів.
+        Собівартість інших документів перераховується лише там, де вона залежала від нього.
+        """
+        self._retrying(self._unpost_document, doc_id)
+
+    def _unpost_document(self, doc_id: str):
+        document = self._load_document(doc_id)
+        self._unpost_loaded(document)
+        self.inventory_manager.apply_deltas()
+        self._changed(document)
+        self._commit()
+
+    def repost_document(self, doc_id: str):
+        """Перепроведення (скасування і повторне проведення) в одній транзакції."""
+        self._retrying(self._repost_document, doc_id)
+
+    def _repost_document(self, doc_id: str):
+        document = self._load_document(doc_id)
+        self._unpost_loaded(document)
+
+        later_sales = self._latest_sales_after(
+            {line.nomenclature_id for line in document.lines},
+            (document.document_date, document.documents_id)
+        )
+        self._post_loaded(document)
+        self._recost_if_backdated(document, later_sales)
+        self.inventory_manager.apply_deltas()
+        self._changed(document)
+        self._commit()
+
+    def post_documents(self, doc_ids=None, date_from=None, date_to=None, chunk_size=500):
+        """
+        Пакетне проведення: документи проводяться в хронологічному порядку,
+        порціями по chunk_size з одним commit на порцію.
+        Залишки та відкриті партії FIFO для порції завантажуються одним запитом.
+        Помилка одного документа відкочує лише його (SAVEPOINT).
+
+        Повертає звіт: [{'document_id', 'status': 'posted' | 'error', 'error'}, ...]
+        """
+        ordered_ids = self.select_for_posting(doc_ids, date_from, date_to)
+
+        report = []
+        if doc_ids is not None:
+            found = set(ordered_ids)
+            report.extend(
+                {'document_id': doc_id, 'status': 'error', 'error': "Документ не знайдено."}
+                for doc_id in doc_ids if doc_id not in found
+            )
+
+        for offset in range(0, len(ordered_ids), chunk_size):
+            chunk_ids = ordered_ids[offset:offset + chunk_size]
+            report.extend(self._retrying(self._post_chunk, chunk_ids))
+
+        return report
+
+    def select_for_posting(self, doc_ids=None, date_from=None, date_to=None):
+        """ID документів для пакетного проведення в хронологічному порядку."""
+        query = select(Document.documents_id)
+        if doc_ids is not None:
+            query = query.filter(Document.documents_id.in_(doc_ids))
+        else:
+            query = query.filter(
+                Document.is_posted == False,
+                Document.operation_type.in_(OperationType.INCOMING + OperationType.OUTGOING)
+            )
+        if date_from is not None:
+            query = query.filter(Document.document_date >= date_from)
+        if date_to is not None:
+            query = query.filter(Document.document_date <= date_to)
+
+        return self.db.execute(
+            query.order_by(Document.document_date, Document.documents_id)
+        ).scalars().all()
+
+    def _post_chunk(self, chunk_ids):
+        # Документи порції блокуються першими (як у _load_document), у порядку проведення
+        documents = self.db.execute(
+            select(Document)
+            .filter(Document.documents_id.in_(chunk_ids))
+            .options(selectinload(Document.lines).selectinload(DocumentLine.nomenclature))
+            .order_by(Document.document_date, Document.documents_id)
+            .with_for_update(of=Document)
+            .execution_options(populate_existing=True)
+        ).scalars().all()
+
+        nomenclature_ids = {line.nomenclature_id for doc in documents for line in doc.lines}
+        # Залишки всіх товарів порції блокуються до commit
+        self.inventory_manager.preload(nomenclature_ids, for_update=True)
+        self.fifo_calculator.preload(nomenclature_ids)
+        later_sales = self._latest_sales_after(
+            nomenclature_ids, (documents[0].document_date, documents[0].documents_id)
+        ) if documents else {}
+
+        report = []
+        for document in documents:
+            doc_id = document.documents_id
+            doc_items = {line.nomenclature_id for line in document.lines}
+            self.inventory_manager.checkpoint()
+            try:
+                with self.db.begin_nested():
+                    self._post_loaded(document)
+                    self._recost_if_backdated(document, later_sales)
+                self._changed(document)
+                report.append({'document_id': doc_id, 'status': 'posted', 'error': None})
+            except PostingError as e:
+                # SAVEPOINT відкочено: дельти та кешовані партії цих товарів більше не актуальні
+                self.inventory_manager.rollback_to_checkpoint()
+                self.fifo_calculator.forget(doc_items)
+                report.append({'document_id': doc_id, 'status': 'error', 'error': str(e)})
+
+        # Залишки всієї порції - одним upsert
+        self.inventory_manager.apply_deltas()
+        self._commit()
+        # Після commit об'єкти прострочені (expire_on_commit), кеш наступної порції - свій
+        self.inventory_manager.forget()
+        self.fifo_calculator.forget()
+        return report
+
+    def _post_loaded(self, document: Document):
         if document.is_posted:
             raise PostingError("Документ вже проведений!")
+        # Дата визначає місце документа в черзі FIFO і в знімках залишків
+        if document.document_date is None:
+            raise PostingError("Документ без дати не можна провести.")
 
         # Визначення напрямку руху (Прихід/Розхід)
         modifier = OperationType.get_modifier(document.operation_type)
@@ -162,6 +818,8 @@ class DocumentPostingService:
             if modifier == 1:
 
                 self.inventory_manager.add_stock(line)
+                # Прихід відкриває нову партію FIFO
+                self.fifo_calculator.add_layer(document, line)
             else:
                 # Розхід: складний процес
                 # А. Рахуємо собівартість
@@ -174,7 +832,139 @@ class DocumentPostingService:
                 # В. Списуємо зі складу
                 self.inventory_manager.remove_stock(line, cost_to_write_off)
 
+        # Знімки закритих періодів, які вже покривають дату документа
+        self.snapshot_service.apply_document(document)
+        # Денний підсумок продажів для зведених звітів
+        self.sales_rollup.apply_document(document)
 
         document.is_posted = True
         document.last_updated = datetime.now()
-        self.db.commit()
\ No newline at end of file
+
+    def _unpost_loaded(self, document: Document):
+        if not document.is_posted:
+            raise PostingError("Документ не проведений.")
+
+        key = (document.document_date, document.documents_id)
+        nomenclature_ids = {line.nomenclature_id for line in document.lines}
+        self.inventory_manager.preload(nomenclature_ids, for_update=True)
+        later_sales = self._latest_sales_after(nomenclature_ids, key)
+
+        # Знімки та підсумок продажів - з тими самими сумами, з якими документ проводився
+        self.snapshot_service.apply_document(document, sign=-1)
+        self.sales_rollup.apply_document(document, sign=-1)
+
+        if OperationType.get_modifier(document.operation_type) == 1:
+            for line in document.lines:
+                # Залишку має вистачати, щоб забрати прихід назад
+                self.inventory_manager.remove_stock(line, to_decimal(line.total_amount))
+            # Списання, що забирали з партій цього приходу, перераховуються
+            recost_from = {
+                nomenclature_id: min(key, consumer_key)
+                for nomenclature_id, consumer_key in self.fifo_calculator.remove_layers(document).items()
+            }
+        else:
+            for line in document.lines:
+                self.inventory_manager.return_stock(line, line.total_cost)
+                line.total_cost = 0
+            self.fifo_calculator.release_consumptions(document)
+            # Пізніші списання тепер можуть забрати повернені партії
+            recost_from = {nomenclature_id: key for nomenclature_id in nomenclature_ids if nomenclature_id in later_sales}
+
+        document.is_posted = False
+        document.last_updated = datetime.now()
+
+        for nomenclature_id, from_key in sorted(recost_from.items()):
+            self._recost([nomenclature_id], from_key)
+
+    def _latest_sales_after(self, nomenclature_ids, key):
+        """
+        Останнє проведене списання кожного товару з ключем (дата, ID) > key.
+        Для звичайного проведення поточною датою таких документів немає,
+        і запит читає лише порожній діапазон індексу за датою.
+        """
+        if not nomenclature_ids:
+            return {}
+        rows = self.db.execute(
+            select(DocumentLine.nomenclature_id, Document.document_date, Document.documents_id)
+            .join(Document)
+            .filter(
+                Document.is_posted == True,
+                Document.operation_type.in_(OperationType.OUTGOING),
+                tuple_(Document.document_date, Document.documents_id) > tuple_(*key),
+                DocumentLine.nomenclature_id.in_(nomenclature_ids),
+            )
+            .distinct(DocumentLine.nomenclature_id)
+            .order_by(DocumentLine.nomenclature_id, Document.document_date.desc(), Document.documents_id.desc())
+        ).all()
+        return {nomenclature_id: (document_date, doc_id) for nomenclature_id, document_date, doc_id in rows}
+
+    def _recost_if_backdated(self, document: Document, later_sales: dict):
+        """
+        Документ проведено раніше за вже проведені списання тих самих товарів:
+        собівартість цих списань перераховується (лише вікно після документа).
+        later_sales оновлюється, щоб наступні документи пакета бачили це списання.
+        """
+        key = (document.document_date, document.documents_id)
+        nomenclature_ids = {line.nomenclature_id for line in document.lines}
+        affected = sorted(
+            nomenclature_id for nomenclature_id in nomenclature_ids
+            if nomenclature_id in later_sales and later_sales[nomenclature_id] > key
+        )
+
+        if OperationType.get_modifier(document.operation_type) == -1:
+            for nomenclature_id in nomenclature_ids:
+                if later_sales.get(nomenclature_id, key) <= key:
+                    later_sales[nomenclature_id] = key
+
+        if affected:
+            self._recost(affected, key)
+
+    def recost(self, nomenclature_ids, from_key) -> int:
+        """
+        Перераховує собівартість списань товарів починаючи з from_key = (дата, ID документа)
+        і коригує сумові залишки та знімки на різницю. Залишки застосовуються
+        разом з рештою дельт (inventory_manager.apply_deltas), подія для кешу звітів
+        записується при commit (commit_changes). Повертає кількість змінених рядків.
+        """
+        from_date = from_key[0].date() if from_key[0] else None
+        self._changed_ranges.append((from_date, None))
+        return self._recost(nomenclature_ids, from_key)
+
+    def rebuild_layers(self, nomenclature_ids=None) -> int:
+        """
+        Перебудовує партії FIFO з історії проведених документів і коригує сумові
+        залишки та знімки на зміну собівартості списань. Залишки блокуються і
+        застосовуються так само, як у recost. Повертає кількість змінених рядків.
+        """
+        if nomenclature_ids is None:
+            nomenclature_ids = self.db.execute(
+                select(DocumentLine.nomenclature_id).distinct()
+            ).scalars().all()
+        self.inventory_manager.preload(nomenclature_ids, for_update=True)
+        changes = self.fifo_calculator.rebuild_layers(nomenclature_ids)
+        if changes:
+            self._changed_ranges.append((None, None))
+        return self._apply_cost_changes(changes)
+
+    def commit_changes(self):
+        """Commit для змін, зроблених напряму (recost з консолі)."""
+        self._commit()
+
+    def _recost(self, nomenclature_ids, from_key) -> int:
+        # Перерахунок у межах проведення покривається подією самого документа:
+        # собівартість впливає лише на залишки після його дати
+        changed = 0
+        for nomenclature_id in sorted(nomenclature_ids):
+            changed += self._apply_cost_changes(self.fifo_calculator.recost(nomenclature_id, from_key))
+        return changed
+
+    def _apply_cost_changes(self, changes) -> int:
+        """Коригує сумові залишки та знімки на зміну собівартості рядків [(line, document_date, delta), ...]."""
+        dated_deltas = []
+        for line, document_date, cost_delta in changes:
+            key = (line.nomenclature_id, line.account)
+            # Більша собівартість списання - менший сумовий залишок
+            self.inventory_manager.adjust_amount(key, -cost_delta)
+            dated_deltas.append((document_date, {key: (Decimal(0), -cost_delta)}))
+        self.snapshot_service.apply_dated_deltas(dated_deltas)
+        return len(dated_deltas)
@@ -42,6 +42,57 @@ function removeLine(button) {
     if (row) row.remove();
 }
 
+// 2.1 Пошук номенклатури в рядках документа (замість повного списку в кожному рядку)
+var nomenclatureSearch = {
+    timer: null,
+    idsByName: {},
+
+    load: function(input) {
+        var text = input.value.trim();
+        if (text.length < 1) return;
+
+        fetch("/api/nomenclature/search?limit=20&q=" + encodeURIComponent(text))
+            .then(function(response) { return response.json(); })
+            .then(function(items) {
+                var datalist = document.getElementById("nomenclature-options");
+                datalist.innerHTML = "";
+                items.forEach(function(item) {
+                    nomenclatureSearch.idsByName[item.name] = item.id;
+                    var option = document.createElement("option");
+                    option.value = item.name;
+                    datalist.appendChild(option);
+                });
+                nomenclatureSearch.select(input);
+            });
+    },
+
+    // Записує ID обраного товару в приховане поле рядка
+    select: function(input) {
+        var hidden = input.parentElement.querySelector(".nomenclature-id");
+        if (!hidden) return;
+        hidden.value = nomenclatureSearch.idsByName[input.value] || "";
+        input.setCustomValidity(hidden.value ? "" : "Оберіть товар зі списку");
+    },
+};
+
+document.addEventListener("input", function(event) {
+    if (!event.target.classList.contains("nomenclature-search")) return;
+    var input = event.target;
+    nomenclatureSearch.select(input);
+    clearTimeout(nomenclatureSearch.timer);
+    nomenclatureSearch.timer = setTimeout(function() { nomenclatureSearch.load(input); }, 250);
+});
+
+// Назви рядків, заповнених сервером (створення на підставі), вже відповідають своїм ID
+document.addEventListener("DOMContentLoaded", function() {
+    document.querySelectorAll(".nomenclature-search").forEach(function(input) {
+        var hidden = input.parentElement.querySelector(".nomenclature-id");
+        if (hidden && hidden.value && input.value) {
+            nomenclatureSearch.idsByName[input.value] = hidden.value;
+        }
+    });
+});
+
 // 3. Функція показу повідомлень (Toasts)
 function showFlashToasts(messages) {
     const container = document.getElementById('toastContainer');
@@ -106,12 +157,46 @@ document.addEventListener("DOMContentLoaded", function() {
         `;
     };
 
+    // Курсори keyset-пагінації: номер сторінки -> курсор, який повернув сервер.
+    // Tabulator (progressiveLoad) запитує сторінки послідовно, тож курсор завжди відомий.
+    var pageCursors = {};
+
     var table = new Tabulator("#documents-table", {
         ajaxURL: "/api/documents",
         layout: "fitColumns",
-        pagination: "local",
-        paginationSize: 10,
+        height: "600px",
+        progressiveLoad: "scroll",
+        paginationSize: 50,
+        sortMode: "remote",
+        filterMode: "remote",
+        initialSort: [{column: "date", dir: "desc"}],
         placeholder:"Немає даних",
+
+        ajaxURLGenerator: function(url, config, params) {
+            var query = new URLSearchParams();
+            query.set("size", params.size);
+
+            if (params.page > 1 && pageCursors[params.page]) {
+                query.set("after", pageCursors[params.page]);
+            }
+            if (params.sort && params.sort.length) {
+                query.set("sort", params.sort[0].field);
+                query.set("dir", params.sort[0].dir);
+            }
+            (params.filter || []).forEach(function(f) {
+                query.set("filter_" + f.field, f.value);
+            });
+            return url + "?" + query.toString();
+        },
+
+        ajaxResponse: function(url, params, response) {
+            if (params.page === 1) pageCursors = {};
+            pageCursors[params.page + 1] = response.next_cursor;
+            return {
+                last_page: response.next_cursor ? params.page + 1 : params.page,
+                data: response.data,
+            };
+        },
         
         columns: [
             {title: "ID", field: "id", width: 80, sorter: "string"},
@@ -122,12 +207,40 @@ document.addEventListener("DOMContentLoaded", function() {
                 sorter: "datetime",
                 sorterParams: { format: "yyyy-MM-dd HH:mm:ss" },
                 headerFilter: "input", 
+                headerFilterPlaceholder: "РРРР-ММ-ДД",
+            },
+            {
+                title: "Тип Операції",
+                field: "type",
+                sorter: "string",
+                headerFilter: "list",
+                headerFilterParams: {
+                    values: ["Замовлення", "Рахунок фактура", "Прибуткова накладна", "Видаткова накладна", "Податкова накладна"],
+                    clearable: true,
+                },
             },
-            {title: "Тип Операції", field: "type", sorter: "string"},
-            {title: "Контрагент", field: "counterparty_name", sorter: "string"},
+            {title: "Контрагент", field: "counterparty_name", sorter: "string", headerFilter: "input"},
             {title: "Сума", field: "amount", sorter: "number", hozAlign: "right"},
-            {title: "Валюта", field: "currency", width: 80, hozAlign: "center"},
+            {title: "Валюта", field: "currency", width: 80, hozAlign: "center", headerSort: false},
             {title: "Дії", field: "id", formatter: actionsFormatter, width: 120, hozAlign: "center", headerSort: false},
         ],
     });
+
+    // Експорт журналу: ті самі сортування та фільтри, що й у таблиці
+    document.querySelectorAll(".document-export").forEach(function(link) {
+        link.addEventListener("click", function(event) {
+            event.preventDefault();
+            var query = new URLSearchParams();
+            query.set("format", link.dataset.format);
+            var sorters = table.getSorters();
+            if (sorters.length) {
+                query.set("sort", sorters[0].field);
+                query.set("dir", sorters[0].dir);
+            }
+            table.getHeaderFilters().forEach(function(f) {
+                query.set("filter_" + f.field, f.value);
+            });
+            window.location = "/documents/export?" + query.toString();
+        });
+    });
 });
\ No newline at end of file
@@ -0,0 +1,192 @@
+# application/test/benchmarks.py
+"""
+Бенчмарки проведення, FIFO, звітів та JSON/HTML сторінок.
+Наповнює базу генератором (test_data_generator), виконує кожен сценарій
+repeat разів і рахує перцентилі часу, кількість SQL-запитів та пік пам'яті.
+Результат зберігається в JSON; порівняння з попереднім запуском (baseline)
+показує регресії.
+
+Запуск (на окремій базі, наприклад з docker-compose.yml!):
+    DATABASE_URL=postgresql+psycopg2://... flask bench run --documents 20000 --output bench.json
+"""
+import math
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from application import app, db
+from application.instrumentation import record_queries
+from application.models import Document, DocumentLine
+from application.services.operations import OperationType
+from application.services.services import DocumentPostingService, FifoCostCalculator
+from application.services.ReportServices import ReportService
+from application.test.test_data_generator import OUTGOING_TYPE, generate
+
+
+def percentile(values, q):
+    """Перцентиль методом найближчого рангу (q від 0 до 100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+def measure(calls):
+    """
+    Виконує виклики з calls по черзі і повертає статистику сценарію.
+    Пік пам'яті міряється на останньому виклику: tracemalloc суттєво
+    сповільнює виконання, тому решта викликів іде без нього.
+    """
+    timings, queries, db_timings = [], [], []
+
+    def timed(call):
+        with record_queries() as recorder:
+            started = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(recorder.count)
+        db_timings.append(recorder.db_ms)
+
+    for call in calls[:-1]:
+        timed(call)
+
+    tracemalloc.start()
+    try:
+        timed(calls[-1])
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'runs': len(timings),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'max_ms': round(max(timings), 3),
+        'queries': max(queries),
+        'db_ms_p50': round(percentile(db_timings, 50), 3),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def _sample(query, limit):
+    return db.session.execute(query.limit(limit)).scalars().all()
+
+
+def _scenarios(repeat):
+    """Назва сценарію -> список викликів (по одному на повтор)."""
+    scenarios = {}
+    client = app.test_client()
+
+    # Проведення: останні непроведені документи по одному, в хронологічному порядку
+    pending = db.session.execute(
+        select(Document.documents_id)
+        .filter(Document.is_posted == False,
+                Document.operation_type.in_(OperationType.INCOMING + OperationType.OUTGOING))
+        .order_by(Document.document_date, Document.documents_id)
+    ).scalars().all()[-repeat:]
+    if pending:
+        def post(doc_id):
+            return lambda: DocumentPostingService(db.session).post_document(doc_id)
+        scenarios['post_document'] = [post(doc_id) for doc_id in pending]
+
+    # FIFO: розрахунок собівартості для останніх проведених рядків продажу
+    # (зміни партій відкочуються після кожного виклику)
+    line_ids = _sample(
+        select(DocumentLine.product_item_id).join(Document)
+        .filter(Document.operation_type == OUTGOING_TYPE, Document.is_posted == True)
+        .order_by(Document.document_date.desc()),
+        repeat
+    )
+    if line_ids:
+        def calculate_cost(line_id):
+            def call():
+                line = db.session.get(DocumentLine, line_id)
+                FifoCostCalculator(db.session).calculate_cost(line.document, line)
+                db.session.flush()
+                db.session.rollback()
+            return call
+        scenarios['fifo_calculate_cost'] = [calculate_cost(line_id) for line_id in line_ids]
+
+    end = datetime.now()
+    start = end - timedelta(days=30)
+    scenarios['report_sales'] = [
+        lambda: ReportService(db.session).get_sales_report(start, end)
+    ] * repeat
+    scenarios['report_inventory_on_date'] = [
+        lambda: ReportService(db.session).get_inventory_on_date(end)
+    ] * repeat
+    # Динаміка за місяць по днях - один запит замість 30 викликів get_inventory_on_date
+    scenarios['report_inventory_series'] = [
+        lambda: ReportService(db.session).get_inventory_series(start.date(), end.date(), 'day')
+    ] * repeat
+
+    def get(url):
+        def call():
+            response = client.get(url)
+            if response.status_code != 200:
+                raise RuntimeError(f'{url}: HTTP {response.status_code}')
+        return call
+
+    scenarios['documents_api_page'] = [get('/api/documents?size=100')] * repeat
+    scenarios['documents_api_sorted'] = [get('/api/documents?size=100&sort=counterparty_name&dir=desc')] * repeat
+    scenarios['documents_api_columnar'] = [get('/api/documents?size=500&format=columnar')] * repeat
+
+    doc_ids = _sample(select(Document.documents_id).order_by(Document.document_date.desc()), repeat)
+    scenarios['print_document_page'] = [get(f'/document/{doc_id}/print') for doc_id in doc_ids]
+
+    return {name: calls for name, calls in scenarios.items() if calls}
+
+
+def run(documents=20000, seed=42, repeat=50, skip_seed=False):
+    """Повертає {'meta': {...}, 'scenarios': {сценарій: статистика}}."""
+    if not skip_seed:
+        if db.session.execute(select(Document.documents_id).limit(1)).first():
+            raise RuntimeError('База вже містить документи: використайте порожню базу або --no-seed.')
+        generate(documents=documents, seed=seed)
+        # Усе, крім останніх repeat документів, проводимо заздалегідь:
+        # їх проведення і буде сценарієм post_document
+        ordered_ids = db.session.execute(
+            select(Document.documents_id).order_by(Document.document_date, Document.documents_id)
+        ).scalars().all()
+        DocumentPostingService(db.session).post_documents(
+            doc_ids=ordered_ids[:-repeat], chunk_size=app.config['POSTING_CHUNK_SIZE']
+        )
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+
+    results = {}
+    for name, calls in _scenarios(repeat).items():
+        results[name] = measure(calls)
+        db.session.rollback()
+
+    return {
+        'meta': {
+            'documents': db.session.execute(select(db.func.count()).select_from(Document)).scalar(),
+            'seed': seed,
+            'repeat': repeat,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+        },
+        'scenarios': results,
+    }
+
+
+def compare(results, baseline, tolerance=0.25, min_ms=2.0):
+    """
+    Регресії відносно baseline: p95 повільніший більш ніж на tolerance (частка)
+    і на min_ms мілісекунд, або сценарій виконує більше SQL-запитів.
+    """
+    regressions = []
+    old_scenarios = baseline.get('scenarios', {})
+    for name, stats in results['scenarios'].items():
+        old = old_scenarios.get(name)
+        if old is None:
+            continue
+        slower = stats['p95_ms'] - old['p95_ms']
+        if slower > min_ms and stats['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {old['p95_ms']} ms -> {stats['p95_ms']} ms")
+        if stats['queries'] > old['queries']:
+            regressions.append(f"{name}: запитів {old['queries']} -> {stats['queries']}")
+    return regressions
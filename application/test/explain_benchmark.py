@@ -0,0 +1,131 @@
+# application/test/explain_benchmark.py
+"""
+Бенчмарк планів запитів.
+Наповнює базу синтетичними даними, виконує запити сервісів проведення та звітів
+і записує EXPLAIN ANALYZE для кожного SELECT. Порівняння з попереднім JSON
+дозволяє помітити регресію (повільніший запит або новий Seq Scan).
+
+Запуск (на окремій базі!):
+    DATABASE_URL=postgresql+psycopg2://... flask bench explain --documents 20000 --output explain.json
+"""
+import json
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, select
+
+from application import db
+from application.models import Nomenclature, Document, DocumentLine
+from application.services.services import DocumentPostingService, FifoCostCalculator
+from application.services.ReportServices import ReportService
+from application.services.SnapshotService import SnapshotService
+from application.test.test_data_generator import OUTGOING_TYPE, generate
+
+
+@contextmanager
+def capture_selects():
+    """Збирає (sql, params) усіх SELECT, виконаних у блоці."""
+    captured = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')) and not executemany:
+            captured.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield captured
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def _seq_scans(plan):
+    """Таблиці, які план читає повним скануванням."""
+    tables = []
+    if plan.get('Node Type') == 'Seq Scan':
+        tables.append(plan.get('Relation Name'))
+    for child in plan.get('Plans', []):
+        tables.extend(_seq_scans(child))
+    return tables
+
+
+def explain(statement, parameters):
+    connection = db.session.connection()
+    raw = connection.exec_driver_sql('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + statement, parameters).scalar()
+    plan = (raw if isinstance(raw, list) else json.loads(raw))[0]
+    return {
+        'sql': ' '.join(statement.split())[:300],
+        'planning_ms': round(plan['Planning Time'], 3),
+        'execution_ms': round(plan['Execution Time'], 3),
+        'seq_scans': sorted(set(_seq_scans(plan['Plan']))),
+    }
+
+
+def _scenarios():
+    """Назва сценарію -> функція, яка виконує запити сервісу."""
+    def sample_outgoing_line(session):
+        return session.execute(
+            select(DocumentLine).join(Document)
+            .filter(Document.operation_type == OUTGOING_TYPE, Document.is_posted == True)
+            .order_by(Document.document_date.desc()).limit(1)
+        ).scalar_one()
+
+    def fifo_calculate_cost(session):
+        line = sample_outgoing_line(session)
+        FifoCostCalculator(session).calculate_cost(line.document, line)
+
+    def last_month():
+        end = datetime.now()
+        return end - timedelta(days=30), end
+
+    return {
+        'fifo_calculate_cost': fifo_calculate_cost,
+        'report_inventory_on_date': lambda session: ReportService(session).get_inventory_on_date(datetime.now()),
+        'report_sales_lines': lambda session: ReportService(session).get_sales_report(*last_month()),
+        'report_sales_by_day': lambda session: ReportService(session).get_sales_summary(*last_month(), 'day'),
+        'posting_preload': lambda session: DocumentPostingService(session).inventory_manager.preload(
+            session.execute(select(Nomenclature.nomenclature_id).limit(50)).scalars().all()
+        ),
+    }
+
+
+def run(documents=20000, seed=42, skip_seed=False):
+    """Повертає {сценарій: [план, ...]}."""
+    if not skip_seed:
+        if db.session.execute(select(Document.documents_id).limit(1)).first():
+            raise RuntimeError('База вже містить документи: використайте порожню базу або --no-seed.')
+        generate(documents=documents, seed=seed, post=True)
+        SnapshotService(db.session).close_months(datetime.now().date())
+        db.session.commit()
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+
+    results = {}
+    for name, scenario in _scenarios().items():
+        with capture_selects() as captured:
+            scenario(db.session)
+        db.session.flush()
+        results[name] = [explain(statement, parameters) for statement, parameters in captured]
+        # Сценарії не повинні змінювати дані (наприклад, списання партій FIFO)
+        db.session.rollback()
+    return results
+
+
+def compare(results, baseline, tolerance=0.5, min_ms=1.0):
+    """
+    Регресії відносно baseline: запит повільніший більш ніж на tolerance (частка)
+    і на min_ms мілісекунд, або з'явився новий Seq Scan.
+    """
+    regressions = []
+    for name, plans in results.items():
+        for index, plan in enumerate(plans):
+            try:
+                old = baseline[name][index]
+            except (KeyError, IndexError):
+                continue
+            slower = plan['execution_ms'] - old['execution_ms']
+            if slower > min_ms and plan['execution_ms'] > old['execution_ms'] * (1 + tolerance):
+                regressions.append(f"{name}#{index}: {old['execution_ms']} ms -> {plan['execution_ms']} ms")
+            new_scans = set(plan['seq_scans']) - set(old['seq_scans'])
+            if new_scans:
+                regressions.append(f"{name}#{index}: новий Seq Scan {', '.join(sorted(new_scans))}")
+    return regressions
@@ -0,0 +1,155 @@
+# application/test/query_budget.py
+"""
+Бюджет SQL-запитів для сторінок та сервісів.
+Кожна перевірка виконується на наявних (або згенерованих) даних і не повинна
+перевищувати max_queries. Запити, виконані під час рендерингу шаблону
+(ліниві завантаження зв'язків), рахуються окремо і мають свій ліміт.
+Сторінки документа перевіряються на документі з найменшою та найбільшою
+кількістю рядків: кількість запитів не повинна залежати від кількості рядків (N+1).
+
+Запуск (на окремій базі!):
+    flask bench queries --seed-data
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from flask import before_render_template, template_rendered
+from sqlalchemy import func, select
+
+from application import app, db
+from application.instrumentation import record_queries
+from application.models import Document, DocumentLine, InventoryBalance
+from application.services.DocumentCache import document_html_cache
+from application.services.ReportServices import ReportService
+from application.test.test_data_generator import generate
+
+
+# scaling=True: перевірка виконується для малого і великого документа, запитів має бути однаково.
+# Бюджети сторінок з довідниками враховують один запит перевірки версії кешу,
+# сторінок документа та API журналу - один запит версії для ETag.
+Check = namedtuple('Check', 'name max_queries max_render_queries scaling run')
+
+
+def _get(url_template):
+    def run(client, doc_id):
+        url = url_template.format(doc_id=doc_id)
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f'{url}: HTTP {response.status_code}')
+    return run
+
+
+def _service(call):
+    def run(client, doc_id):
+        call()
+    return run
+
+
+def _balances_repr():
+    balances = db.session.execute(select(InventoryBalance)).scalars().all()
+    for balance in balances:
+        repr(balance)
+
+
+def _last_month():
+    end = datetime.now()
+    return end - timedelta(days=30), end
+
+
+CHECKS = [
+    Check('view_document', 4, 0, True, _get('/document/{doc_id}')),
+    Check('print_document_page', 4, 0, True, _get('/document/{doc_id}/print')),
+    Check('create_invoice_based_on', 4, 0, True, _get('/document/{doc_id}/create_invoice')),
+    Check('create_outgoing_based_on', 4, 0, True, _get('/document/{doc_id}/create_outgoing')),
+    Check('create_document', 1, 0, False, _get('/document/new')),
+    Check('documents_list', 0, 0, False, _get('/documents')),
+    Check('documents_api', 2, 0, False, _get('/api/documents?size=100')),
+    Check('inventory_list', 1, 0, False, _get('/inventory')),
+    Check('balance_repr', 1, 0, False, _service(_balances_repr)),
+    Check('report_sales', 1, 0, False,
+          _service(lambda: ReportService(db.session).get_sales_report(*_last_month()))),
+    Check('report_sales_summary', 1, 0, False,
+          _service(lambda: ReportService(db.session).get_sales_summary(*_last_month(), 'nomenclature'))),
+    Check('report_inventory_on_date', 2, 0, False,
+          _service(lambda: ReportService(db.session).get_inventory_on_date(datetime.now()))),
+    Check('report_inventory_series', 2, 0, False,
+          _service(lambda: ReportService(db.session).get_inventory_series(
+              *(moment.date() for moment in _last_month()), 'day'))),
+]
+
+
+def measure(run, client, doc_id):
+    """Повертає (усього запитів, запитів під час рендерингу шаблонів) для одного виклику."""
+    render_queries = []
+
+    def before_render(sender, template, context, **extra):
+        render_queries.append(-recorder.count)
+
+    def after_render(sender, template, context, **extra):
+        render_queries[-1] += recorder.count
+
+    # Порожня identity map: ліниві завантаження не повинні ховатися за кешем сесії,
+    # а сторінки документів - за кешем HTML
+    db.session.remove()
+    document_html_cache.clear()
+    with before_render_template.connected_to(before_render, app), \
+            template_rendered.connected_to(after_render, app), \
+            record_queries() as recorder:
+        run(client, doc_id)
+    db.session.rollback()
+    return recorder.count, sum(render_queries)
+
+
+def _documents_by_line_count():
+    """ID документів з найменшою та найбільшою кількістю рядків (серед документів з рядками)."""
+    line_count = func.count(DocumentLine.product_item_id)
+    query = (
+        select(Document.documents_id)
+        .join(DocumentLine, DocumentLine.document_id == Document.documents_id)
+        .group_by(Document.documents_id)
+    )
+    smallest = db.session.execute(query.order_by(line_count, Document.documents_id).limit(1)).scalar()
+    largest = db.session.execute(query.order_by(line_count.desc(), Document.documents_id).limit(1)).scalar()
+    return smallest, largest
+
+
+def run(seed_data=False):
+    """
+    Виконує всі перевірки. Повертає список результатів:
+    {'check', 'document_id', 'queries', 'render_queries', 'max_queries', 'max_render_queries', 'errors'}.
+    """
+    if seed_data and not db.session.execute(select(Document.documents_id).limit(1)).first():
+        generate(documents=300, items=40, counterparties=10, max_lines=8, other_ratio=0.1, post=True)
+
+    smallest, largest = _documents_by_line_count()
+    if smallest is None:
+        raise RuntimeError('У базі немає документів з рядками: використайте --seed-data на порожній базі.')
+
+    client = app.test_client()
+    # Прогрів кешів процесу (довідники), щоб перевірки були детермінованими
+    for check in CHECKS:
+        measure(check.run, client, largest)
+
+    results = []
+    for check in CHECKS:
+        doc_ids = (smallest, largest) if check.scaling and smallest != largest else (largest,)
+        measured = [(doc_id, *measure(check.run, client, doc_id)) for doc_id in doc_ids]
+
+        for doc_id, queries, render_queries in measured:
+            errors = []
+            if queries > check.max_queries:
+                errors.append(f'запитів {queries} > {check.max_queries}')
+            if render_queries > check.max_render_queries:
+                errors.append(f'запитів під час рендерингу {render_queries} > {check.max_render_queries}')
+            if check.scaling and queries != measured[0][1]:
+                errors.append(f'кількість запитів залежить від кількості рядків ({measured[0][1]} -> {queries})')
+            results.append({
+                'check': check.name,
+                'document_id': doc_id if check.scaling else None,
+                'queries': queries,
+                'render_queries': render_queries,
+                'max_queries': check.max_queries,
+                'max_render_queries': check.max_render_queries,
+                'errors': errors,
+            })
+    return results
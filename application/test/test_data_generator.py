@@ -1,95 +1,243 @@
-# app/test_data_generator.py
-import uuid
+# application/test/test_data_generator.py
+"""
+Генератор синтетичних даних для навантажувального тестування.
+Результат детермінований: однаковий seed дає ті самі ID, дати та суми.
+Документи пишуться порціями через COPY (або multi-row INSERT), тож
+мільйони рядків генеруються без ORM.
+
+Запуск (на окремій базі!):
+    flask testdata generate --documents 1000000 --items 5000 --post
+"""
+import csv
+import io
 import random
-from datetime import date, timedelta,datetime
-from application import db 
-from application.models import Counterparty, Nomenclature, Document, DocumentLine 
+import uuid
+from bisect import bisect_left
+from datetime import date, datetime, time, timedelta
+from itertools import accumulate
+
+from sqlalchemy import insert, select
+
+from application import db
+from application.models import Counterparty, Nomenclature, Document, DocumentLine
+from application.services.services import DocumentPostingService
+from application.services.ReferenceCache import bump_version
+from application.services.DocumentCache import DOCUMENTS_COUNTER
+
+
+INCOMING_TYPE = 'Прибуткова накладна'
+OUTGOING_TYPE = 'Видаткова накладна'
+# Документи, що не впливають на залишки (не проводяться)
+OTHER_TYPES = ['Замовлення', 'Рахунок фактура']
+
+VAT_RATES = {'20%': 0.2, '7%': 0.07, '0%': 0.0}
+# Відносна кількість документів за днями тижня (Пн..Нд)
+WEEKDAY_WEIGHTS = (1.0, 1.0, 1.0, 1.0, 0.9, 0.3, 0.1)
+# Робочий час: документи датуються між 8:00 та 19:00, пік об 11:00
+WORKDAY_START, WORKDAY_END, WORKDAY_PEAK = 8 * 3600, 19 * 3600, 11 * 3600
+
+DOCUMENT_COLUMNS = ('documents_id', 'document_date', 'operation_type', 'total_amount',
+                    'currency', 'counterparty_id', 'is_posted')
+LINE_COLUMNS = ('product_item_id', 'document_id', 'nomenclature_id', 'quantity', 'unit',
+                'price_with_vat', 'total_with_vat', 'vat_amount', 'total_amount', 'total_cost')
+
 
 def create_test_data():
-    """Створює тестові дані (контрагенти, номенклатура, 100 документів) 
+    """Створює тестові дані (контрагенти, номенклатура, 100 документів)
     у базі даних, якщо вони ще не існують.
     """
     # Перевірка, чи база даних вже містить дані (щоб не дублювати)
     if Counterparty.query.first() or Nomenclature.query.first():
         print("У базі вже є дані (Контрагенти або Номенклатура). Генерацію скасовано задля безпеки.")
         return
-    
+
     print("Генерація 100 тестових документів...")
+    generate(documents=100, items=10, counterparties=5, other_ratio=0.2)
 
-    # 1. Створення 5 Тестових Контрагентів
-    counterparties = []
-    for i in range(1, 6):
-        cp_id = str(uuid.uuid4())
-        cp = Counterparty(counterparty_id=cp_id, counterparty_name=f"Контрагент {i} ТОВ")
-        db.session.add(cp)
-        counterparties.append(cp)
-
-    # 2. Створення 10 Тестових Товарів/Послуг (Номенклатура)
-    nomenclatures = []
-    vat_rates = ["20%", "7%", "0%"]
-    for i in range(1, 11):
-        n_id = str(uuid.uuid4())
-        is_service = i > 7 
-        name = f"Послуга Доставки {i-7}" if is_service else f"Товар {i}"
-        
-        n = Nomenclature(
-            nomenclature_id=n_id, 
-            nomenclature_name=name, 
-            vat_rate=random.choice(vat_rates)
-        )
-        db.session.add(n)
-        nomenclatures.append(n)
-        
-    db.session.commit() 
-
-    # 3. Створення 100 Документів
-    doc_types = ["Замовлення", "Рахунок фактура", "Прибуткова накладна", "Видаткова накладна"]
-    
-    # for i in range(1, 10):
-    #     doc_id = str(uuid.uuid4())
-    #     current_dt = datetime.now()
-        
-    #     doc_datetime = current_dt - timedelta(
-    #         days=random.randint(0, 90),
-    #         hours=random.randint(0, 23),
-    #         minutes=random.randint(0, 59)
-    #     )
-    #     operation = random.choice(doc_types)
-    #     counterparty = random.choice(counterparties)
-    #     total_amount = round(random.uniform(500, 50000), 2)
-        
-    #     doc = Document(
-    #         documents_id=doc_id,
-    #         document_date=doc_datetime,
-    #         operation_type=operation,
-    #         total_amount=str(total_amount),
-    #         currency="UAH",
-    #         counterparty_id=counterparty.counterparty_id,
-    #     )
-    #     db.session.add(doc)
-        
-    #     # 4. Створення Рядків Документа
-    #     num_lines = random.randint(1, 5)
-        
-    #     for j in range(num_lines):
-    #         line_id = str(uuid.uuid4())
-    #         nomenclature = random.choice(nomenclatures)
-    #         qty = random.randint(1, 20)
-    #         price = round(random.uniform(10, 500), 2)
-    #         total = round(qty * price * 1.2, 2)
-            
-    #         line = DocumentLine(
-    #             product_item_id=line_id,
-    #             document_id=doc_id,
-    #             nomenclature_id=nomenclature.nomenclature_id,
-    #             quantity=str(qty),
-    #             unit="шт" if "Товар" in nomenclature.nomenclature_name else "послуга",
-    #             price_with_vat=str(price * 1.2),
-    #             total_with_vat=str(total),
-    #             vat_amount=str("20%"), 
-    #             total_amount=str(total / 1.2),
-    #         )
-    #         db.session.add(line)
 
+def generate(documents=10000, items=500, counterparties=50, max_lines=5,
+             incoming_ratio=0.45, other_ratio=0.0, date_from=None, date_to=None,
+             seed=42, batch_size=5000, use_copy=True, post=False, chunk_size=500):
+    """
+    Генерує довідники та документи з рядками.
+
+    Документи розподілені по днях з урахуванням дня тижня та робочих годин.
+    Продажі не перевищують змодельований залишок, тож після генерації
+    всі документи проводяться в хронологічному порядку без помилок.
+    Товари обираються нерівномірно (популярні частіше), як у реальних продажах.
+
+    Повертає статистику: {'counterparties', 'nomenclatures', 'documents', 'lines', 'posted', 'errors'}.
+    """
+    if db.session.execute(select(Document.documents_id).limit(1)).first():
+        raise RuntimeError('База вже містить документи: генерація можлива лише в порожню базу.')
+
+    date_to = date_to or date.today()
+    date_from = date_from or date_to - timedelta(days=365)
+    if date_from > date_to:
+        raise ValueError('Дата початку пізніша за дату кінця.')
+
+    rng = random.Random(seed)
+
+    def new_id():
+        return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+    counterparty_rows = [
+        {'counterparty_id': new_id(), 'counterparty_name': f'Контрагент {i} ТОВ'}
+        for i in range(1, counterparties + 1)
+    ]
+    nomenclature_rows = [
+        {
+            'nomenclature_id': new_id(),
+            'nomenclature_name': f'Товар {i}',
+            'vat_rate': rng.choices(list(VAT_RATES), weights=(8, 1, 1))[0],
+        }
+        for i in range(1, items + 1)
+    ]
+    db.session.execute(insert(Counterparty), counterparty_rows)
+    db.session.execute(insert(Nomenclature), nomenclature_rows)
+    # Core INSERT оминає ORM-події, тому версію довідників збільшуємо явно
+    bump_version(db.session.connection(), 'counterparty', 'nomenclature', DOCUMENTS_COUNTER)
+
+    counterparty_ids = [row['counterparty_id'] for row in counterparty_rows]
+    item_ids = [row['nomenclature_id'] for row in nomenclature_rows]
+    vat_rate = {row['nomenclature_id']: VAT_RATES[row['vat_rate']] for row in nomenclature_rows}
+    base_price = {item_id: round(rng.uniform(10, 500), 2) for item_id in item_ids}
+    # Закон Ципфа: i-й за популярністю товар обирається з вагою 1 / i^0.8
+    cum_weights = list(accumulate(1 / (rank ** 0.8) for rank in range(1, items + 1)))
+    stock = dict.fromkeys(item_ids, 0)
+
+    def pick_items(count):
+        # dict.fromkeys прибирає повтори, зберігаючи порядок (детермінованість)
+        return list(dict.fromkeys(
+            item_ids[bisect_left(cum_weights, rng.random() * cum_weights[-1])]
+            for _ in range(count)
+        ))
+
+    writer = _CopyWriter() if use_copy else _InsertWriter()
+    stats = {'counterparties': counterparties, 'nomenclatures': items, 'documents': 0, 'lines': 0}
+    doc_rows, line_rows = [], []
+
+    for document_date in _document_dates(rng, documents, date_from, date_to):
+        doc_id = new_id()
+        roll = rng.random()
+        if roll < other_ratio:
+            operation_type = rng.choice(OTHER_TYPES)
+        elif roll < other_ratio + (1 - other_ratio) * incoming_ratio:
+            operation_type = INCOMING_TYPE
+        else:
+            operation_type = OUTGOING_TYPE
+
+        lines = []
+        for nomenclature_id in pick_items(rng.randint(1, max_lines)):
+            if operation_type == OUTGOING_TYPE:
+                if stock[nomenclature_id] <= 0:
+                    continue
+                quantity = rng.randint(1, min(stock[nomenclature_id], 20))
+                stock[nomenclature_id] -= quantity
+                price = base_price[nomenclature_id] * rng.uniform(1.1, 1.4)
+            else:
+                quantity = rng.randint(5, 100)
+                if operation_type == INCOMING_TYPE:
+                    stock[nomenclature_id] += quantity
+                price = base_price[nomenclature_id] * rng.uniform(0.8, 1.0)
+            lines.append((nomenclature_id, quantity, round(price, 2)))
+
+        if not lines:
+            # Продаж без залишку замінюємо на надходження
+            operation_type = INCOMING_TYPE
+            nomenclature_id = pick_items(1)[0]
+            quantity = rng.randint(5, 100)
+            stock[nomenclature_id] += quantity
+            lines.append((nomenclature_id, quantity, round(base_price[nomenclature_id] * rng.uniform(0.8, 1.0), 2)))
+
+        total = 0.0
+        for nomenclature_id, quantity, price in lines:
+            total_with_vat = round(quantity * price, 2)
+            total_without_vat = round(total_with_vat / (1 + vat_rate[nomenclature_id]), 2)
+            total += total_without_vat
+            line_rows.append((
+                new_id(), doc_id, nomenclature_id, quantity, 'шт.', price, total_with_vat,
+                round(total_with_vat - total_without_vat, 2), total_without_vat, 0,
+            ))
+
+        doc_rows.append((
+            doc_id, document_date, operation_type, round(total, 2), 'UAH',
+            rng.choice(counterparty_ids), False,
+        ))
+        stats['documents'] += 1
+        stats['lines'] += len(lines)
+
+        if len(doc_rows) >= batch_size:
+            writer.write(doc_rows, line_rows)
+            db.session.commit()
+
+    writer.write(doc_rows, line_rows)
     db.session.commit()
-    print("Створення тестових даних завершено!")
\ No newline at end of file
+
+    stats['posted'] = stats['errors'] = 0
+    if post:
+        report = DocumentPostingService(db.session).post_documents(chunk_size=chunk_size)
+        stats['errors'] = sum(1 for r in report if r['status'] == 'error')
+        stats['posted'] = len(report) - stats['errors']
+    return stats
+
+
+def _document_dates(rng, documents, date_from, date_to):
+    """
+    Дати документів у хронологічному порядку.
+    Кількість на день пропорційна вазі дня тижня, час - у межах робочого дня.
+    """
+    days = [date_from + timedelta(days=i) for i in range((date_to - date_from).days + 1)]
+    weights = [WEEKDAY_WEIGHTS[day.weekday()] for day in days]
+    total_weight = sum(weights)
+
+    per_day = [int(documents * weight / total_weight) for weight in weights]
+    for index in rng.choices(range(len(days)), weights=weights, k=documents - sum(per_day)):
+        per_day[index] += 1
+
+    for day, count in zip(days, per_day):
+        midnight = datetime.combine(day, time())
+        offsets = sorted(
+            int(rng.triangular(WORKDAY_START, WORKDAY_END, WORKDAY_PEAK) * 1_000_000) for _ in range(count)
+        )
+        # Дати строго зростають: порядок проведення збігається з порядком генерації
+        previous = -1
+        for offset in offsets:
+            previous = max(offset, previous + 1)
+            yield midnight + timedelta(microseconds=previous)
+
+
+class _CopyWriter:
+    """Запис порцій через COPY ... FROM STDIN (CSV)."""
+
+    def write(self, doc_rows, line_rows):
+        connection = db.session.connection()
+        cursor = connection.connection.cursor()
+        try:
+            self._copy(cursor, Document.__tablename__, DOCUMENT_COLUMNS, doc_rows)
+            self._copy(cursor, DocumentLine.__tablename__, LINE_COLUMNS, line_rows)
+        finally:
+            cursor.close()
+        doc_rows.clear()
+        line_rows.clear()
+
+    @staticmethod
+    def _copy(cursor, table, columns, rows):
+        if not rows:
+            return
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+class _InsertWriter:
+    """Запис порцій multi-row INSERT (для драйверів без COPY)."""
+
+    def write(self, doc_rows, line_rows):
+        if doc_rows:
+            db.session.execute(insert(Document), [dict(zip(DOCUMENT_COLUMNS, row)) for row in doc_rows])
+        if line_rows:
+            db.session.execute(insert(DocumentLine), [dict(zip(LINE_COLUMNS, row)) for row in line_rows])
+        doc_rows.clear()
+        line_rows.clear()
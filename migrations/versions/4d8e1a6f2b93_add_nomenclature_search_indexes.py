@@ -0,0 +1,35 @@
+"""Add nomenclature search indexes
+
+Revision ID: 4d8e1a6f2b93
+Revises: 7a3c5f0e9d21
+Create Date: 2026-10-18 14:47:25.370051
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d8e1a6f2b93'
+down_revision = '7a3c5f0e9d21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    with op.get_context().autocommit_block():
+        op.create_index('ix_nomenclature_name_lower_prefix', 'nomenclature',
+                        [sa.text('lower(nomenclature_name) text_pattern_ops')],
+                        unique=False, postgresql_concurrently=True)
+        op.create_index('ix_nomenclature_name_trgm', 'nomenclature', ['nomenclature_name'],
+                        unique=False, postgresql_using='gin',
+                        postgresql_ops={'nomenclature_name': 'gin_trgm_ops'},
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_nomenclature_name_trgm', table_name='nomenclature', postgresql_concurrently=True)
+        op.drop_index('ix_nomenclature_name_lower_prefix', table_name='nomenclature', postgresql_concurrently=True)
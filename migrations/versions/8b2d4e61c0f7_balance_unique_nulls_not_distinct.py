@@ -0,0 +1,52 @@
+"""Make uix_nomenclature_account NULLS NOT DISTINCT
+
+Revision ID: 8b2d4e61c0f7
+Revises: 3f1c9a7e5b20
+Create Date: 2026-10-18 11:03:54.402871
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2d4e61c0f7'
+down_revision = '3f1c9a7e5b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Старий UNIQUE вважав NULL-рахунки різними, тож дублікати могли з'явитись.
+    # Зливаємо їх в один рядок перед створенням нового обмеження.
+    op.execute("""
+        WITH merged AS (
+            SELECT nomenclature_id, account, min(balance_id) AS keep_id,
+                   sum(quantity) AS quantity, sum(total_amount) AS total_amount,
+                   max(last_updated) AS last_updated
+            FROM inventory_balances
+            GROUP BY nomenclature_id, account
+            HAVING count(*) > 1
+        )
+        UPDATE inventory_balances b
+        SET quantity = m.quantity, total_amount = m.total_amount, last_updated = m.last_updated
+        FROM merged m
+        WHERE b.balance_id = m.keep_id
+    """)
+    op.execute("""
+        DELETE FROM inventory_balances b
+        USING inventory_balances k
+        WHERE b.nomenclature_id = k.nomenclature_id
+          AND b.account IS NOT DISTINCT FROM k.account
+          AND b.balance_id > k.balance_id
+    """)
+
+    with op.batch_alter_table('inventory_balances', schema=None) as batch_op:
+        batch_op.drop_constraint('uix_nomenclature_account', type_='unique')
+        batch_op.create_unique_constraint('uix_nomenclature_account', ['nomenclature_id', 'account'],
+                                          postgresql_nulls_not_distinct=True)
+
+
+def downgrade():
+    with op.batch_alter_table('inventory_balances', schema=None) as batch_op:
+        batch_op.drop_constraint('uix_nomenclature_account', type_='unique')
+        batch_op.create_unique_constraint('uix_nomenclature_account', ['nomenclature_id', 'account'])
@@ -0,0 +1,43 @@
+"""Add indexes for posting and reporting queries
+
+Revision ID: e1f6b8c25a9d
+Revises: 5e9a0d3b7c64
+Create Date: 2026-10-18 13:20:17.551903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1f6b8c25a9d'
+down_revision = '5e9a0d3b7c64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CONCURRENTLY не блокує запис у великі таблиці, але не працює в транзакції
+    with op.get_context().autocommit_block():
+        op.create_index('ix_documents_date_id', 'documents', ['document_date', 'documents_id'],
+                        unique=False, postgresql_concurrently=True)
+        op.create_index('ix_documents_posted_type_date', 'documents', ['operation_type', 'document_date'],
+                        unique=False, postgresql_where=sa.text('is_posted'), postgresql_concurrently=True)
+        op.create_index('ix_documents_posted_date', 'documents', ['document_date'],
+                        unique=False, postgresql_where=sa.text('is_posted'), postgresql_concurrently=True)
+        op.create_index('ix_documents_counterparty_id', 'documents', ['counterparty_id'],
+                        unique=False, postgresql_concurrently=True)
+        op.create_index('ix_document_lines_document_id', 'document_lines', ['document_id'],
+                        unique=False, postgresql_concurrently=True)
+        op.create_index('ix_document_lines_nomenclature_document', 'document_lines', ['nomenclature_id', 'document_id'],
+                        unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_document_lines_nomenclature_document', table_name='document_lines', postgresql_concurrently=True)
+        op.drop_index('ix_document_lines_document_id', table_name='document_lines', postgresql_concurrently=True)
+        op.drop_index('ix_documents_counterparty_id', table_name='documents', postgresql_concurrently=True)
+        op.drop_index('ix_documents_posted_date', table_name='documents', postgresql_concurrently=True)
+        op.drop_index('ix_documents_posted_type_date', table_name='documents', postgresql_concurrently=True)
+        op.drop_index('ix_documents_date_id', table_name='documents', postgresql_concurrently=True)